@@ -0,0 +1,150 @@
+import math
+import re
+from datetime import datetime, time, timedelta
+from db import DB
+
+# Medication adherence: the free-text `frequency` column is parsed into an expected dose
+# schedule, and logged doses are compared against it per period. A dose only counts toward
+# the period it was taken in, so doubling up one day does not cover a missed day.
+
+_WORDS = {"once": 1, "one": 1, "twice": 2, "two": 2, "thrice": 3, "three": 3, "four": 4,
+          "five": 5, "six": 6}
+_LATIN = {"qd": (1, 1), "od": (1, 1), "qhs": (1, 1), "bid": (2, 1), "tid": (3, 1), "qid": (4, 1),
+          "qod": (1, 2), "qw": (1, 7)}
+_PERIODS = {"day": 1, "daily": 1, "night": 1, "nightly": 1, "morning": 1, "evening": 1,
+            "bedtime": 1, "week": 7, "weekly": 7, "month": 30, "monthly": 30}
+
+_AS_NEEDED_RE = re.compile(r"\b(prn|as needed|when needed|if needed)\b")
+_EVERY_HOURS_RE = re.compile(r"\b(?:every|q)\s*(\d+)\s*(?:h|hr|hrs|hours?)\b")
+_EVERY_OTHER_RE = re.compile(r"\bevery other (day|week)\b")
+_EVERY_N_RE = re.compile(r"\bevery\s+(\d+)\s+(day|week|month)s?\b")
+_COUNT_RE = re.compile(r"\b(\d+|once|one|twice|two|thrice|three|four|five|six)(?:\s*x|\s+times?)?\s*"
+                       r"(?:a|an|per|each|every|/)?\s*(day|daily|week|weekly|month|monthly)\b")
+_SINGLE_RE = re.compile(r"\b(?:daily|every day|each day|a day|nightly|every night|at bedtime|"
+                        r"every morning|every evening|weekly|every week|monthly|every month)\b")
+
+
+class DoseSchedule:
+    # `doses` expected every `period_days` days; as_needed schedules expect nothing
+    __slots__ = ("doses", "period_days", "as_needed")
+
+    def __init__(self, doses=0, period_days=1, as_needed=False):
+        self.doses = doses
+        self.period_days = period_days
+        self.as_needed = as_needed
+
+    def label(self):
+        if self.as_needed:
+            return "as needed"
+        if self.period_days == 1:
+            return f"{self.doses}x daily"
+        if self.period_days == 7:
+            return f"{self.doses}x weekly"
+        return f"{self.doses}x every {self.period_days} days"
+
+
+def parse_frequency(text):
+    # Returns a DoseSchedule, or None when the text cannot be understood
+    t = " ".join((text or "").lower().replace("-", " ").replace(".", "").split())
+    if not t:
+        return None
+    if _AS_NEEDED_RE.search(t):
+        return DoseSchedule(as_needed=True)
+    for word in t.split():
+        if word in _LATIN:
+            return DoseSchedule(*_LATIN[word])
+    m = _EVERY_HOURS_RE.search(t)
+    if m:
+        hours = int(m.group(1))
+        if hours <= 0:
+            return None
+        if hours <= 24:
+            return DoseSchedule(round(24 / hours), 1)
+        return DoseSchedule(1, round(hours / 24))
+    m = _EVERY_OTHER_RE.search(t)
+    if m:
+        return DoseSchedule(1, 2 * _PERIODS[m.group(1)])
+    m = _EVERY_N_RE.search(t)
+    if m and int(m.group(1)) > 0:
+        return DoseSchedule(1, int(m.group(1)) * _PERIODS[m.group(2)])
+    m = _COUNT_RE.search(t)
+    if m:
+        n = int(m.group(1)) if m.group(1).isdigit() else _WORDS[m.group(1)]
+        return DoseSchedule(n, _PERIODS[m.group(2)]) if n > 0 else None
+    m = _SINGLE_RE.search(t)
+    if m:
+        return DoseSchedule(1, _PERIODS[m.group(0).split()[-1]])
+    return None
+
+
+def _as_datetime(value):
+    return value if isinstance(value, datetime) else datetime.combine(value, time.min)
+
+
+def adherence_for(med, logs, start, end):
+    # med: medication row; logs: its (takentime, isskipped) rows in [start, end), any order.
+    # Periods are counted from the later of `start` and the medication's tracking start; the
+    # last period may be partial and then expects a proportional share of its doses.
+    schedule = parse_frequency(med.get("frequency"))
+    taken = sum(1 for _, skipped in logs if not skipped)
+    result = {
+        "medicationid": med.get("medicationid"),
+        "medname": med.get("medname"),
+        "frequency": med.get("frequency"),
+        "schedule": schedule.label() if schedule else None,
+        "taken": taken,
+        "skipped": len(logs) - taken,
+        "expected": None,
+        "on_schedule": None,
+        "missed": None,
+        "extra": None,
+        "adherence": None,
+    }
+    if schedule is None or schedule.as_needed:
+        return result
+    first = max(start, _as_datetime(med.get("createdat") or start))
+    if first >= end:
+        result.update(expected=0, on_schedule=0, missed=0, extra=taken)
+        return result
+    period = timedelta(days=schedule.period_days)
+    span = (end - first) / period
+    full = int(span)
+    expected_per = [schedule.doses] * full
+    if span > full:
+        expected_per.append(math.ceil(schedule.doses * (span - full)))
+    counts = [0] * len(expected_per)
+    for when, skipped in logs:
+        if skipped or when < first:
+            continue
+        i = int((when - first) / period)
+        if i < len(counts):
+            counts[i] += 1
+    on_schedule = sum(min(c, e) for c, e in zip(counts, expected_per))
+    expected = sum(expected_per)
+    result.update(expected=expected, on_schedule=on_schedule, missed=expected - on_schedule,
+                  extra=taken - on_schedule,
+                  adherence=round(on_schedule / expected, 3) if expected else None)
+    return result
+
+
+def user_adherence(user_id, start, end):
+    # Adherence for all of a user's medications over [start, end) from one procedure call
+    rows = DB.call_proc("sp_med_adherence_logs", (user_id, start, end))
+    meds = []
+    logs = {}
+    for r in rows:
+        if "medname" in r:
+            meds.append(r)
+        else:
+            logs.setdefault(r["medicationid"], []).append((r["takentime"], bool(r["isskipped"])))
+    results = [adherence_for(m, logs.get(m["medicationid"], []), start, end) for m in meds]
+    expected = sum(r["expected"] or 0 for r in results)
+    on_schedule = sum(r["on_schedule"] or 0 for r in results)
+    return {
+        "from": start.isoformat(sep=" "),
+        "to": end.isoformat(sep=" "),
+        "medications": results,
+        "expected": expected,
+        "on_schedule": on_schedule,
+        "adherence": round(on_schedule / expected, 3) if expected else None,
+    }
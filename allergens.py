@@ -0,0 +1,110 @@
+import threading
+import numpy as np
+from catalog import FoodCatalog
+from search import allergen_list
+
+# Allergen bitmaps over the in-process food catalog. Every allergen gets one packed bitset
+# with a bit per catalog position, so "foods free of A, B and C" is an OR of three rows and a
+# NOT, and "which allergens are in this meal" reads a few bit columns -- no join against
+# food_allergens per request. Any food or allergen insert/delete bumps catalog_version, and
+# the bitmaps are rebuilt from the reloaded snapshot, in every worker process.
+
+
+def parse_exclude(values):
+    # ?exclude=peanuts&exclude=milk or ?exclude=peanuts,milk -> ("milk", "peanuts")
+    names = {n.strip().lower() for v in values for n in (v or "").split(",")}
+    return tuple(sorted(n for n in names if n))
+
+
+class AllergenBitmaps:
+    # Built once per catalog snapshot and never modified, so readers need no lock
+    def __init__(self, foods):
+        labels = {}
+        rows, cols = [], []
+        for pos, food in enumerate(foods):
+            for name in allergen_list(food):
+                key = name.lower()
+                labels.setdefault(key, name)
+                rows.append(key)
+                cols.append(pos)
+        self._keys = sorted(labels)
+        self.names = [labels[k] for k in self._keys]
+        self._row = {k: i for i, k in enumerate(self._keys)}
+        self.size = len(foods)
+        dense = np.zeros((len(self._keys), self.size), dtype=bool)
+        if rows:
+            dense[[self._row[k] for k in rows], cols] = True
+        self._bits = np.packbits(dense, axis=1, bitorder="little")
+        # Food ids in catalog order, and sorted for id -> position lookups
+        self._ids = np.array([f.get("foodid") for f in foods], dtype=np.int64)
+        self._order = np.argsort(self._ids, kind="stable")
+        self._sorted_ids = self._ids[self._order]
+
+    def free_of(self, exclude):
+        # Boolean mask over catalog positions: True where the food has none of `exclude`.
+        # Unknown allergen names match no food and exclude nothing.
+        rows = [self._row[k] for k in exclude if k in self._row]
+        if not rows:
+            return np.ones(self.size, dtype=bool)
+        hit = np.bitwise_or.reduce(self._bits[rows], axis=0)
+        return np.unpackbits(~hit, count=self.size, bitorder="little").astype(bool)
+
+    def containing(self, exclude):
+        # Ids of the foods with at least one of `exclude`
+        return set(self._ids[~self.free_of(exclude)].tolist())
+
+    def in_foods(self, food_ids):
+        # Display names of the allergens present in any of `food_ids`
+        ids = np.asarray(list(food_ids), dtype=np.int64)
+        if not ids.size or not self._keys:
+            return []
+        at = np.searchsorted(self._sorted_ids, ids).clip(max=max(self.size - 1, 0))
+        pos = self._order[at[self._sorted_ids[at] == ids]]
+        present = ((self._bits[:, pos >> 3] >> (pos & 7).astype(np.uint8)) & 1).any(axis=1)
+        return [self.names[i] for i in np.flatnonzero(present)]
+
+
+class AllergenIndex:
+    # The bitmaps for the newest catalog version seen
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current = (None, None)
+
+    def bitmaps(self, version, foods):
+        current_version, bitmaps = self._current
+        if bitmaps is not None and current_version == version:
+            return bitmaps
+        with self._lock:
+            current_version, bitmaps = self._current
+            if bitmaps is None or current_version != version:
+                bitmaps = AllergenBitmaps(foods)
+                self._current = (version, bitmaps)
+            return bitmaps
+
+
+ALLERGEN_INDEX = AllergenIndex()
+
+
+def _snapshot():
+    version, foods = FoodCatalog.request_snapshot()
+    return version, foods, ALLERGEN_INDEX.bitmaps(version, foods)
+
+
+def allergen_names():
+    return _snapshot()[2].names
+
+
+def safe_foods(exclude):
+    # (catalog version, foods free of every allergen in `exclude`), in catalog order
+    version, foods, bitmaps = _snapshot()
+    if not exclude:
+        return version, foods
+    return version, [foods[i] for i in np.flatnonzero(bitmaps.free_of(exclude))]
+
+
+def foods_containing(exclude):
+    return _snapshot()[2].containing(exclude) if exclude else set()
+
+
+def meal_allergens(food_ids):
+    return _snapshot()[2].in_foods(food_ids)
@@ -0,0 +1,203 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+import numpy as np
+from db import DB
+
+# Date-range nutrition analytics. One procedure call returns per-day, per-meal-type totals for
+# the window; buckets, breakdowns and rolling averages are then array math over a dense
+# (day x meal type x metric) cube instead of one sp_user_daily_macros call per day.
+
+MEAL_TYPES = ("breakfast", "lunch", "dinner", "snack")
+METRICS = ("calories", "proteins", "carbs", "fats", "meals")
+GRANULARITIES = ("day", "week", "month")
+DEFAULT_DAYS = 30
+MAX_RANGE_DAYS = int(os.getenv("ANALYTICS_MAX_DAYS", "731"))
+CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "256"))
+
+_MEAL_INDEX = {m: i for i, m in enumerate(MEAL_TYPES)}
+_MEALS = METRICS.index("meals")
+
+
+class SeriesCache:
+    # Finalized days (everything before today) of a window, keyed by (user, first day, cutoff)
+    # and tagged with the daily-rollup fingerprint they were read under. Any change to one of
+    # those days (including back-dated logs and rebuilds) bumps a revision, so the entry misses.
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, fingerprint, cube):
+        with self._lock:
+            self._entries[key] = (fingerprint, cube)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def count(self, result):
+        # result: "hits", "misses" or "stale"; under the lock like the rest of the state
+        with self._lock:
+            setattr(self, result, getattr(self, result) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "stale": self.stale,
+                    "size": len(self._entries)}
+
+
+SERIES_CACHE = SeriesCache(CACHE_SIZE)
+
+
+def parse_window(args, today=None):
+    # (start, end, granularity, rolling) from request args; ?date= is the old single-day form
+    today = today or date.today()
+    if args.get("date"):
+        start = end = date.fromisoformat(args["date"])
+    else:
+        end = date.fromisoformat(args["to"]) if args.get("to") else today
+        start = date.fromisoformat(args["from"]) if args.get("from") else end - timedelta(days=DEFAULT_DAYS - 1)
+    if end < start:
+        raise ValueError("'from' must be on or before 'to'")
+    if (end - start).days + 1 > MAX_RANGE_DAYS:
+        raise ValueError(f"Range is limited to {MAX_RANGE_DAYS} days")
+    granularity = args.get("granularity") or "day"
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    rolling = int(args.get("rolling") or 7)
+    if not 1 <= rolling <= 90:
+        raise ValueError("rolling must be between 1 and 90 days")
+    return start, end, granularity, rolling
+
+
+def _fetch(user_id, start, end, cutoff, rows_from):
+    rows = DB.call_proc("sp_user_macro_series", (user_id, start, end, cutoff, rows_from))
+    fingerprint = None
+    series = []
+    for r in rows:
+        if "revisions" in r:
+            fingerprint = (int(r["days"]), int(r["revisions"]))
+        else:
+            series.append(r)
+    return fingerprint, series
+
+
+def _cube(rows, start, days):
+    cube = np.zeros((days, len(MEAL_TYPES), len(METRICS)))
+    if rows:
+        di = np.array([(r["day"] - start).days for r in rows])
+        mi = np.array([_MEAL_INDEX[r["mealtype"]] for r in rows])
+        cube[di, mi] = np.array([[float(r[m] or 0) for m in METRICS] for r in rows])
+    return cube
+
+
+def _load_cube(user_id, start, end, today):
+    # Dense cube for [start, end]. Days before today are final: when cached under a matching
+    # fingerprint, the procedure only reads the fingerprint plus today's (or later) rows.
+    total = (end - start).days + 1
+    cutoff = min(end + timedelta(days=1), today)
+    n_final = (cutoff - start).days
+    if n_final <= 0:
+        return _cube(_fetch(user_id, start, end, start, start)[1], start, total)
+    key = (user_id, start, cutoff)
+    entry = SERIES_CACHE.get(key)
+    fingerprint, rows = _fetch(user_id, start, end, cutoff, cutoff if entry is not None else start)
+    if entry is not None and entry[0] != fingerprint:
+        SERIES_CACHE.count("stale")
+        entry = None
+        fingerprint, rows = _fetch(user_id, start, end, cutoff, start)
+    if entry is None:
+        SERIES_CACHE.count("misses")
+        cube = _cube(rows, start, total)
+        SERIES_CACHE.put(key, fingerprint, cube[:n_final].copy())
+        return cube
+    SERIES_CACHE.count("hits")
+    return np.concatenate([entry[1], _cube(rows, cutoff, total - n_final)])
+
+
+def _bucket_starts(days, granularity):
+    # Index of the first day of each bucket; weeks start on Monday (1970-01-01 was a Thursday)
+    if granularity == "day":
+        return np.arange(len(days))
+    if granularity == "week":
+        keys = (days.astype("int64") + 3) // 7
+    else:
+        keys = days.astype("datetime64[M]").astype("int64")
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+def _macros(values, digits=1):
+    return {m: (None if np.isnan(v) else round(float(v), 0 if m == "calories" else digits))
+            for m, v in zip(METRICS[:_MEALS], values)}
+
+
+def macro_trends(user_id, start, end, granularity="day", rolling=7, today=None):
+    today = today or date.today()
+    # Read rolling-1 extra days so the first rolling average in the window is complete
+    lookback = rolling - 1
+    first = start - timedelta(days=lookback)
+    cube = _load_cube(user_id, first, end, today)
+    daily = cube.sum(axis=1)
+    logged = daily[:, _MEALS] > 0
+
+    # Rolling means over the days that have meals logged (a missing log is not a zero-calorie day)
+    csum = np.vstack([np.zeros((1, len(METRICS))), np.cumsum(daily, axis=0)])
+    ccount = np.r_[0, np.cumsum(logged)]
+    idx = np.arange(lookback, len(daily)) + 1
+    roll_sum = csum[idx] - csum[idx - rolling]
+    roll_count = (ccount[idx] - ccount[idx - rolling])[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        roll_avg = np.where(roll_count > 0, roll_sum / roll_count, np.nan)
+
+    cube, daily, logged = cube[lookback:], daily[lookback:], logged[lookback:]
+    days = np.arange(np.datetime64(start), np.datetime64(end) + 1)
+    starts = _bucket_starts(days, granularity)
+    ends = np.r_[starts[1:], len(days)] - 1
+    sums = np.add.reduceat(cube, starts, axis=0)
+    totals = sums.sum(axis=1)
+    logged_days = np.add.reduceat(logged.astype("int64"), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        averages = np.where(logged_days[:, None] > 0, totals / logged_days[:, None], np.nan)
+
+    buckets = []
+    for b in range(len(starts)):
+        buckets.append({
+            "start": str(days[starts[b]]),
+            "end": str(days[ends[b]]),
+            "days": int(ends[b] - starts[b] + 1),
+            "logged_days": int(logged_days[b]),
+            "meals": int(totals[b, _MEALS]),
+            "totals": _macros(totals[b]),
+            "daily_average": _macros(averages[b]),
+            "calories_by_mealtype": {m: round(float(sums[b, i, 0])) for i, m in enumerate(MEAL_TYPES)},
+        })
+
+    window = cube.sum(axis=0)
+    window_cal = window[:, 0].sum()
+    n_logged = int(logged.sum())
+    return {
+        "userID": user_id,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "granularity": granularity,
+        "rolling_days": rolling,
+        "logged_days": n_logged,
+        "totals": _macros(window.sum(axis=0)),
+        "daily_average": _macros(window.sum(axis=0) / n_logged if n_logged else np.full(len(METRICS), np.nan)),
+        "by_mealtype": {m: dict(_macros(window[i]), meals=int(window[i, _MEALS]),
+                                calorie_share=round(float(window[i, 0] / window_cal), 3) if window_cal else None)
+                        for i, m in enumerate(MEAL_TYPES)},
+        "buckets": buckets,
+        "rolling": [dict(_macros(roll_avg[i]), date=str(days[i])) for i in range(len(days))],
+    }
@@ -0,0 +1,340 @@
+import base64
+import binascii
+import functools
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from urllib.parse import parse_qsl, urlsplit
+import mysql.connector
+from flask import Blueprint, Response, g, request, session
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import Map, Rule
+from db import DB, group_meal_rows
+from search import allergen_list
+from allergens import meal_allergens, parse_exclude, safe_foods
+from analytics import macro_trends, parse_window
+from adherence import user_adherence
+from calendar_view import expand, find_conflicts, parse_anchor, window_for
+import ingest
+
+log = logging.getLogger(__name__)
+
+# Versioned JSON API over the same stored-procedure reads as the HTML pages. Lists are
+# columnar ({"columns": [...], "rows": [[...], ...]}) so field names go over the wire once,
+# and long collections are keyset-paginated with an opaque `next` cursor. POST /api/v1/batch
+# runs several GETs in one HTTP call, all on one pooled connection. Meal and medication logs
+# are POSTed with an Idempotency-Key header and answer 201 once written, or 202 once queued
+# (INGEST_MODE=queue, see ingest.py).
+
+API_PREFIX = "/api/v1"
+PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "200"))
+MAX_BATCH = int(os.getenv("API_MAX_BATCH", "20"))
+
+api = Blueprint("api", __name__, url_prefix=API_PREFIX)
+# The same rules again, for matching batch sub-requests without a request context
+_resources = Map()
+_handlers = {}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def _json(body, status=200):
+    return Response(json.dumps(body, separators=(",", ":"), default=_plain), status=status,
+                    mimetype="application/json")
+
+
+def columnar(rows, columns=None):
+    columns = columns or (list(rows[0].keys()) if rows else [])
+    return {"columns": columns, "rows": [[r.get(c) for c in columns] for r in rows]}
+
+
+def _encode_cursor(values):
+    raw = json.dumps(values, separators=(",", ":"), default=_plain).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(args, size):
+    # The values a previous page's `next` carried, or [None] * size on the first page
+    token = args.get("cursor")
+    if not token:
+        return [None] * size
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (binascii.Error, ValueError):
+        raise ApiError(400, "Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ApiError(400, "Invalid cursor")
+    return values
+
+
+def _cursor_int(value):
+    # Ids and offsets in a cursor: non-negative ints (bool is an int subclass, so excluded)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ApiError(400, "Invalid cursor")
+    return value
+
+
+def _keyset_cursor(args):
+    # (before_time, before_id) for the keyset-paginated lists, checked before they reach SQL
+    before_time, before_id = _decode_cursor(args, 2)
+    if (before_time is None) != (before_id is None):
+        raise ApiError(400, "Invalid cursor")
+    if before_time is not None:
+        try:
+            before_time = datetime.fromisoformat(before_time)
+        except (TypeError, ValueError):
+            raise ApiError(400, "Invalid cursor")
+    return before_time, _cursor_int(before_id)
+
+
+def _limit(args):
+    return min(max(args.get("limit", PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+
+
+def _dispatch(handler, uid, args, view_args):
+    # (status, body) for one resource call; shared by the routes and the batch endpoint
+    if not uid:
+        return 401, {"error": "Please log in"}
+    try:
+        return 200, handler(uid, args, **view_args)
+    except ApiError as e:
+        return e.status, {"error": str(e)}
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    except mysql.connector.Error as e:
+        # SIGNALed validation errors from the procedures
+        if e.sqlstate == "45000":
+            return 400, {"error": e.msg}
+        raise
+
+
+def resource(rule):
+    def decorator(handler):
+        endpoint = handler.__name__
+        _resources.add(Rule(rule, endpoint=endpoint, methods=["GET"]))
+        _handlers[endpoint] = handler
+
+        @functools.wraps(handler)
+        def view(**view_args):
+            status, body = _dispatch(handler, session.get("userID"), request.args, view_args)
+            return _json(body, status)
+
+        api.add_url_rule(rule, endpoint, view, methods=["GET"])
+        return handler
+    return decorator
+
+
+def _split_detail(rows, detail_key):
+    # Procedures returning a header row followed by detail rows come back flattened
+    header = None
+    details = []
+    for r in rows:
+        if detail_key in r:
+            details.append(r)
+        else:
+            header = r
+    return header, details
+
+
+@resource("/meals")
+def meals(uid, args):
+    before_time, before_id = _keyset_cursor(args)
+    limit = _limit(args)
+    details = group_meal_rows(DB.call_proc("sp_list_meals_with_items", (uid, before_time, before_id, limit)))
+    headers = [d["header"] for d in details.values()]
+    items = [it for d in details.values() for it in d["items"]]
+    nxt = None
+    if len(headers) == limit:
+        nxt = _encode_cursor([str(headers[-1]["logtime"]), headers[-1]["meallogid"]])
+    return {"meals": columnar(headers), "items": columnar(items), "next": nxt}
+
+
+@resource("/meals/<int:meal_id>")
+def meal(uid, args, meal_id):
+    header, items = _split_detail(DB.call_proc("sp_get_meal_detail", (meal_id,)), "foodname")
+    if not header or header.get("userid") != uid:
+        raise ApiError(404, "Meal not found")
+    return {"meal": header, "items": columnar(items), "allergens": meal_allergens(it["foodid"] for it in items)}
+
+
+@resource("/meds")
+def meds(uid, args):
+    return {"meds": columnar(DB.call_proc("sp_list_meds", (uid,)))}
+
+
+@resource("/meds/<int:medication_id>/logs")
+def med_logs(uid, args, medication_id):
+    before_time, before_id = _keyset_cursor(args)
+    limit = _limit(args)
+    rows = DB.call_proc("sp_get_med_logs", (medication_id, args.get("from") or None, args.get("to") or None,
+                                            before_time, before_id, limit))
+    header = next((r for r in rows if "medname" in r), None)
+    logs = [r for r in rows if "medname" not in r]
+    if not header or header.get("userid") != uid:
+        raise ApiError(404, "Medication not found")
+    nxt = None
+    if len(logs) == limit:
+        nxt = _encode_cursor([str(logs[-1]["takentime"]), logs[-1]["medlogid"]])
+    return {"medication": header, "logs": columnar(logs), "next": nxt}
+
+
+@resource("/meds/adherence")
+def adherence(uid, args):
+    end_day = date.fromisoformat(args["to"]) if args.get("to") else date.today()
+    start_day = date.fromisoformat(args["from"]) if args.get("from") else end_day - timedelta(days=29)
+    if end_day < start_day:
+        raise ApiError(400, "'from' must be on or before 'to'")
+    report = user_adherence(uid, datetime.combine(start_day, datetime.min.time()),
+                            datetime.combine(end_day + timedelta(days=1), datetime.min.time()))
+    report["medications"] = columnar(report["medications"])
+    return report
+
+
+@resource("/macros")
+def macros(uid, args):
+    day = date.fromisoformat(args["date"]) if args.get("date") else date.today()
+    rows = DB.call_proc("sp_user_daily_macros", (uid, day))
+    return {"date": day, "macros": rows[0] if rows else None}
+
+
+@resource("/analytics")
+def analytics(uid, args):
+    return macro_trends(uid, *parse_window(args))
+
+
+@resource("/schedules")
+def schedules(uid, args):
+    return {"schedules": columnar(DB.call_proc("sp_list_schedules_by_user", (uid,)))}
+
+
+_OCCURRENCE_COLUMNS = ["eventid", "scheduleid", "eventtitle", "categoryid", "starttime", "endtime",
+                       "recurrence", "occurrence", "conflicts"]
+
+
+@resource("/calendar")
+def calendar(uid, args):
+    view = args.get("view", "week")
+    start, end, _, _ = window_for(view, parse_anchor(args.get("date")))
+    occs = expand(DB.call_proc("sp_list_events_in_window", (uid, None, start, end)), start, end)
+    conflicts = find_conflicts(occs)
+    return {"view": view, "start": start, "end": end, "conflicts": len(conflicts),
+            "occurrences": columnar(occs, _OCCURRENCE_COLUMNS)}
+
+
+_FOOD_COLUMNS = ["foodid", "name", "calories", "proteins", "carbs", "fats"]
+
+
+@resource("/foods")
+def foods(uid, args):
+    # The catalog is served from FoodCatalog's in-process copy; the cursor is an offset into
+    # it, tagged with the catalog version so a page from a changed catalog is refused.
+    # ?exclude=peanuts,milk leaves out foods with any of those allergens.
+    version, catalog = safe_foods(parse_exclude(args.getlist("exclude")))
+    cursor_version, offset = _decode_cursor(args, 2)
+    cursor_version, offset = _cursor_int(cursor_version), _cursor_int(offset)
+    if cursor_version is not None and cursor_version != version:
+        raise ApiError(409, "The food catalog changed; start again without a cursor")
+    offset = offset or 0
+    limit = _limit(args)
+    page = catalog[offset:offset + limit]
+    body = columnar(page, _FOOD_COLUMNS)
+    for row, food in zip(body["rows"], page):
+        row.append(allergen_list(food))
+    body["columns"] = _FOOD_COLUMNS + ["allergens"]
+    nxt = _encode_cursor([version, offset + limit]) if offset + limit < len(catalog) else None
+    return {"version": version, "foods": body, "next": nxt}
+
+
+def _submission(submit):
+    # POST handler body: submit(uid, payload, key) -> True if queued, False if written
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return _json({"error": "Expected a JSON object body"}, 400)
+
+    def handler(uid, args):
+        key = ingest.idempotency_key(request.headers.get("Idempotency-Key") or payload.get("idempotencyKey"))
+        return {"idempotencyKey": key, "queued": submit(uid, payload, key)}
+
+    status, body = _dispatch(handler, session.get("userID"), request.args, {})
+    if status == 200:
+        status = 202 if body["queued"] else 201
+    return _json(body, status)
+
+
+@api.route("/meds/<int:medication_id>/logs", methods=["POST"])
+def log_med(medication_id):
+    # {"takentime": "2024-05-01 08:00", "isskipped": false}; both optional
+    return _submission(lambda uid, p, key: ingest.submit_med_log(uid, medication_id, p.get("takentime"),
+                                                                 p.get("isskipped", False), key))
+
+
+@api.route("/meals", methods=["POST"])
+def log_meal():
+    # {"mealtype": "lunch", "logtime": "2024-05-01 12:30", "items": [{"foodid": 1, "qty": 150}]}
+    return _submission(lambda uid, p, key: ingest.submit_meal(uid, p.get("mealtype"), p.get("logtime"),
+                                                              p.get("items") or [], key))
+
+
+def _run_sub(adapter, uid, path):
+    if not isinstance(path, str) or not path:
+        return 400, {"error": "Each sub-request needs a path"}
+    parts = urlsplit(path)
+    route = parts.path[len(API_PREFIX):] if parts.path.startswith(API_PREFIX + "/") else parts.path
+    try:
+        endpoint, view_args = adapter.match(route, method="GET")
+    except NotFound:
+        return 404, {"error": f"No such resource: {parts.path}"}
+    except MethodNotAllowed:
+        return 405, {"error": "Only GET resources can be batched"}
+    args = MultiDict(parse_qsl(parts.query, keep_blank_values=True))
+    try:
+        return _dispatch(_handlers[endpoint], uid, args, view_args)
+    except Exception:
+        # One failing sub-request must not sink the others
+        log.exception("batch sub-request %s failed", path)
+        return 500, {"error": "Internal error"}
+
+
+@api.route("/batch", methods=["POST"])
+def batch():
+    # {"requests": [{"id": "meals", "path": "/api/v1/meals?limit=20"}, ...]} ->
+    # {"responses": [{"id": "meals", "status": 200, "body": {...}}, ...]} in request order
+    # POST only to carry a body: nothing is written, so don't expire the user's ETags
+    g.read_only = True
+    uid = session.get("userID")
+    if not uid:
+        return _json({"error": "Please log in"}, 401)
+    payload = request.get_json(silent=True)
+    subs = payload.get("requests") if isinstance(payload, dict) else None
+    if not isinstance(subs, list) or not subs:
+        return _json({"error": "Expected a JSON body with a non-empty 'requests' list"}, 400)
+    if len(subs) > MAX_BATCH:
+        return _json({"error": f"At most {MAX_BATCH} requests per batch"}, 400)
+    adapter = _resources.bind("localhost")
+    responses = []
+    with DB.pinned_reads():
+        for i, sub in enumerate(subs):
+            sub_id, path = (sub.get("id", i), sub.get("path")) if isinstance(sub, dict) else (i, sub)
+            status, body = _run_sub(adapter, uid, path)
+            responses.append({"id": sub_id, "status": status, "body": body})
+    return _json({"responses": responses})
@@ -1,12 +1,80 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from werkzeug.security import generate_password_hash, check_password_hash
-from db import DB
+from flask import Flask, Response, g, jsonify, make_response, render_template, request, redirect, stream_with_context, url_for, flash, session
+from db import DB, group_meal_rows
+from catalog import FoodCatalog
+from search import search_foods, allergen_list
+from allergens import allergen_names, foods_containing, meal_allergens, parse_exclude, safe_foods
+from dashboard import Section, load_sections, server_timing
+from analytics import GRANULARITIES, SERIES_CACHE, macro_trends, parse_window
+from adherence import user_adherence
+from calendar_view import VIEWS, expand, find_conflicts, parse_anchor, window_for
+from etags import DATA_VERSIONS, conditional
+from fragments import FRAGMENTS, FragmentCacheExtension
+from api import api
+import etags
+import metrics
+import passwords
+import seed
+import bench
+import bulk
+import ingest
+import click
+import io
+import json
 import os
-from datetime import datetime
+import time
+from datetime import date, datetime, timedelta
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "dev_secret")
-DB.init_pool()
+# The connection pools are created on first use (DB.get_conn), not at import: password hash
+# workers and CLI commands import this module too
+
+MEALS_PAGE_SIZE = int(os.getenv("MEALS_PAGE_SIZE", "20"))
+MED_LOGS_PAGE_SIZE = int(os.getenv("MED_LOGS_PAGE_SIZE", "50"))
+# Upper bound for ?chunk= on /import: one chunk is one multi-row INSERT held in memory
+IMPORT_MAX_CHUNK = int(os.getenv("IMPORT_MAX_CHUNK", "1000"))
+
+# Conditional GET: pages tagged with @conditional answer 304 while the user's data is unchanged
+etags.init_app(app)
+
+# {% cache name, version... %} blocks in templates (see fragments.py)
+app.jinja_env.add_extension(FragmentCacheExtension)
+
+# JSON API for mobile clients under /api/v1 (see api.py)
+app.register_blueprint(api)
+
+# Per-query latency/row metrics, slow-query log and per-request query counters
+DB.add_query_hook(metrics.record_query)
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.request_stats = metrics.start_request()
+
+@app.before_request
+def start_ingest():
+    # INGEST_MODE=queue: meal and medication logs are queued locally and written in batches by a
+    # flusher thread, started with the first request so importing the app starts nothing
+    ingest.start()
+
+@app.before_request
+def route_reads():
+    # Read-your-writes: reads stay on the primary for a few seconds after this user's last write
+    DB.route_reads_after(session.get("data_written_at", 0))
+
+@app.after_request
+def finish_request_metrics(response):
+    stats = g.get("request_stats")
+    started = g.get("request_started")
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    metrics.finish_request(request.endpoint, elapsed, stats)
+    if stats is not None:
+        timing = f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries"'
+        existing = response.headers.get("Server-Timing")
+        response.headers["Server-Timing"] = f"{existing}, {timing}" if existing else timing
+    return response
 
 @app.context_processor
 def inject_user():
@@ -48,20 +116,46 @@ def require_login():
         return False
     return True
 
+def throttled(*checks):
+    # checks: (AttemptThrottle, key) pairs; returns the longest wait, 0 if none applies
+    return max((throttle.retry_after(key) for throttle, key in checks), default=0)
+
+def request_idempotency_key():
+    # Sent with a form (idempotencyKey) or by API clients (Idempotency-Key); fresh otherwise
+    return ingest.idempotency_key(request.form.get("idempotencyKey") or request.headers.get("Idempotency-Key"))
+
 @app.route("/login", methods=["GET","POST"])
 def login():
     if request.method == "POST":
-        email = request.form.get("email")
+        email = (request.form.get("email") or "").strip().lower()
         password = request.form.get("password")
-        # For simplicity, compare plaintext to stored passwordHash; in production use hashing
+        ip = request.remote_addr or "unknown"
+        # Throttle before any hashing so a credential-stuffing burst costs no CPU
+        wait = throttled((passwords.IP_ATTEMPTS, ip), (passwords.ACCOUNT_FAILURES, email))
+        if wait:
+            flash(f"Too many login attempts. Try again in {wait} seconds.", "error")
+            return render_template("auth/login.html"), 429
+        passwords.IP_ATTEMPTS.hit(ip)
         user_rows = DB.call_proc("sp_get_user_by_email", (email,))
-        if user_rows:
-            user = user_rows[0]
-            if check_password_hash(user.get("passwordhash"), password):
-                session["userID"] = user["userid"]
-                session["firstName"] = user["firstname"]
-                flash("Logged in", "success")
-                return redirect(url_for("index"))
+        user = user_rows[0] if user_rows else None
+        try:
+            ok = passwords.verify_password(user.get("passwordhash") if user else None, password)
+        except passwords.HashingBusy as e:
+            flash(str(e), "error")
+            return render_template("auth/login.html"), 503
+        if ok:
+            passwords.ACCOUNT_FAILURES.reset(email)
+            if passwords.needs_rehash(user.get("passwordhash")):
+                # Upgrade to the configured hash parameters while we have the plaintext
+                try:
+                    DB.call_proc("sp_update_password_hash", (user["userid"], passwords.hash_password(password)))
+                except Exception as e:
+                    app.logger.warning("password rehash for user %s failed: %s", user["userid"], e)
+            session["userID"] = user["userid"]
+            session["firstName"] = user["firstname"]
+            flash("Logged in", "success")
+            return redirect(url_for("index"))
+        passwords.ACCOUNT_FAILURES.hit(email)
         flash("Invalid credentials", "error")
     return render_template("auth/login.html")
 
@@ -74,8 +168,14 @@ def logout():
 @app.route("/register", methods=["GET","POST"])
 def register():
     if request.method == "POST":
+        ip = request.remote_addr or "unknown"
+        wait = throttled((passwords.IP_ATTEMPTS, ip))
+        if wait:
+            flash(f"Too many attempts. Try again in {wait} seconds.", "error")
+            return render_template("auth/register.html"), 429
+        passwords.IP_ATTEMPTS.hit(ip)
         try:
-            hashed = generate_password_hash(request.form.get("password"))
+            hashed = passwords.hash_password(request.form.get("password") or "")
             DB.call_proc("sp_create_user", (
                 request.form.get("firstName"),
                 request.form.get("lastName"),
@@ -89,48 +189,36 @@ def register():
     return render_template("auth/register.html")
 
 @app.route("/")
+@conditional(extra=lambda: date.today())
 def index():
     uid = session.get("userID")
     if not uid:
         return redirect(url_for("welcome"))
-    schedules = DB.call_proc("sp_list_schedules_by_user", (uid,))
-    meals = DB.call_proc("sp_list_meals", (uid,))
-    try:
-        meds = DB.call_proc("sp_list_meds", (uid,))
-    except Exception as e:
-        meds = []
-        flash("Medications procedure missing or failed: " + str(e), "error")
-    # Fetch recent meals with items in one call for dashboard
-    recent_headers = []
-    recent_items = []
-    try:
-        rows = DB.call_proc("sp_list_recent_meal_items_by_user", (uid, 5))
-        # First result set: headers; second: items
-        # Differentiate by presence of 'foodname' key
-        for r in rows:
-            if "foodname" in r:
-                recent_items.append(r)
-            else:
-                recent_headers.append(r)
-    except Exception:
-        recent_headers = []
-        recent_items = []
-    # Build map meallogid -> {header, items}
-    meal_details = {}
-    for h in recent_headers:
-        meal_details[h.get("meallogid")] = {"header": h, "items": []}
-    for it in recent_items:
-        mlid = it.get("meallogid")
-        if mlid in meal_details:
-            meal_details[mlid]["items"].append(it)
-    # Daily macros for today
-    macros_today = None
-    try:
-        mrows = DB.call_proc("sp_user_daily_macros", (uid, datetime.now().strftime("%Y-%m-%d")))
-        macros_today = mrows[0] if mrows else None
-    except Exception:
-        macros_today = None
-    return render_template("index.html", users=[], schedules=schedules, meals=meals, meds=meds, uid=uid, meal_details=meal_details, macros_today=macros_today)
+    today = datetime.now().strftime("%Y-%m-%d")
+
+    def macros_for_today():
+        mrows = DB.call_proc("sp_user_daily_macros", (uid, today))
+        return mrows[0] if mrows else None
+
+    # Independent panels load concurrently; a slow or failing panel renders empty
+    values, timings = load_sections([
+        Section("schedules", lambda: DB.call_proc("sp_list_schedules_by_user", (uid,)), []),
+        Section("meals", lambda: DB.call_proc("sp_list_meals", (uid,)), []),
+        Section("meds", lambda: DB.call_proc("sp_list_meds", (uid,)), []),
+        # Recent meals with items in one call
+        Section("recent_meals", lambda: group_meal_rows(DB.call_proc("sp_list_recent_meal_items_by_user", (uid, 5))), {}),
+        Section("macros", macros_for_today, None),
+    ])
+    failed = [name for name, _, status in timings if status != "ok"]
+    if failed:
+        flash("Some sections could not be loaded: " + ", ".join(failed), "warning")
+    # The recent-meals fragment is cached per data version, but never from a fallback panel
+    recent_version = None if {"meals", "recent_meals"} & set(failed) else g.get("data_version")
+    resp = make_response(render_template("index.html", users=[], schedules=values["schedules"], meals=values["meals"],
+                                         meds=values["meds"], uid=uid, meal_details=values["recent_meals"],
+                                         macros_today=values["macros"], recent_meals_version=recent_version))
+    resp.headers["Server-Timing"] = server_timing(timings)
+    return resp
 
 @app.route("/welcome")
 def welcome():
@@ -185,6 +273,7 @@ def delete_user(userID):
 
 # Schedules
 @app.route("/schedules")
+@conditional()
 def list_schedules():
     if not require_login():
         return redirect(url_for("login"))
@@ -214,12 +303,37 @@ def delete_schedule(scheduleID):
     return redirect(url_for("list_schedules"))
 
 # Events
+def calendar_window():
+    # (view, start, end, prev anchor, next anchor) from ?view=day|week|month&date=YYYY-MM-DD
+    view = request.args.get("view") or "month"
+    try:
+        return (view,) + window_for(view, parse_anchor(request.args.get("date")))
+    except ValueError as e:
+        flash(f"Invalid calendar window: {e}", "error")
+        return ("month",) + window_for("month", date.today())
+
 @app.route("/events/<int:scheduleID>")
 def list_events(scheduleID):
     if not require_login():
         return redirect(url_for("login"))
-    events = DB.call_proc("sp_list_events_by_schedule", (scheduleID,))
-    return render_template("events/list.html", events=events, scheduleID=scheduleID)
+    view, start, end, prev, nxt = calendar_window()
+    # Only this window's events (and recurring series) are read; series expand in memory
+    events = DB.call_proc("sp_list_events_in_window", (session.get("userID"), scheduleID, start, end))
+    occs = expand(events, start, end)
+    return render_template("events/list.html", events=occs, scheduleID=scheduleID,
+                           scheduleName=events[0]["schedulename"] if events else None,
+                           view=view, start=start, last_day=(end - timedelta(days=1)).date(), prev=prev, next=nxt, views=VIEWS)
+
+@app.route("/calendar")
+def calendar():
+    if not require_login():
+        return redirect(url_for("login"))
+    view, start, end, prev, nxt = calendar_window()
+    events = DB.call_proc("sp_list_events_in_window", (session.get("userID"), None, start, end))
+    occs = expand(events, start, end)
+    conflicts = find_conflicts(occs)
+    return render_template("events/calendar.html", events=occs, conflicts=conflicts, view=view,
+                           start=start, last_day=(end - timedelta(days=1)).date(), prev=prev, next=nxt, views=VIEWS)
 
 @app.route("/events/create/<int:scheduleID>", methods=["GET","POST"])
 def create_event(scheduleID):
@@ -233,7 +347,11 @@ def create_event(scheduleID):
                       request.form.get("eventTitle"),
                       request.form.get("startTime"),
                       request.form.get("endTime"),
-                      request.form.get("description")
+                      request.form.get("description"),
+                      request.form.get("recurrence") or "none",
+                      request.form.get("recurInterval", 1, type=int),
+                      # Repeat-until is a date; the series includes occurrences on that day
+                      f"{request.form.get('recurUntil')} 23:59:59" if request.form.get("recurUntil") else None
             ))
             flash("Event created", "success")
             return redirect(url_for("list_events", scheduleID=scheduleID))
@@ -251,24 +369,34 @@ def delete_event(eventID):
     return redirect(request.referrer or url_for("index"))
 
 # Meals
+def meal_items_from_form():
+    # [{"foodid": .., "qty": ..}] for the sp_add_meal_items JSON argument; blank rows are skipped
+    items = []
+    for foodID, qty in zip(request.form.getlist("foodID"), request.form.getlist("quantityInGram")):
+        if foodID and qty:
+            items.append({"foodid": int(foodID), "qty": int(qty)})
+    return items
+
 @app.route("/meals/<int:userID>")
+@conditional()
 def list_meals(userID):
     if not require_login():
         return redirect(url_for("login"))
     if session.get("userID") != userID:
         flash("Unauthorized", "error")
         return redirect(url_for("index"))
-    meals = DB.call_proc("sp_list_meals", (userID,))
-    # Build detailed items per meal
-    meal_items_map = {}
-    for m in meals or []:
-        try:
-            rows = DB.call_proc("sp_get_meal_detail", (m.get("meallogid"),))
-            items = [r for r in rows if "foodname" in r]
-            meal_items_map[m.get("meallogid")] = items
-        except Exception:
-            meal_items_map[m.get("meallogid")] = []
-    return render_template("meals/list.html", meals=meals, userID=userID, meal_items_map=meal_items_map)
+    # One round trip per page: headers + items, keyset-paginated on (logtime, meallogid)
+    before_time = request.args.get("before") or None
+    before_id = request.args.get("before_id", type=int)
+    rows = DB.call_proc("sp_list_meals_with_items", (userID, before_time, before_id, MEALS_PAGE_SIZE))
+    meal_details = group_meal_rows(rows)
+    meals = [det["header"] for det in meal_details.values()]
+    meal_items_map = {mlid: det["items"] for mlid, det in meal_details.items()}
+    next_page = None
+    if len(meals) == MEALS_PAGE_SIZE:
+        last = meals[-1]
+        next_page = {"before": str(last.get("logtime")), "before_id": last.get("meallogid")}
+    return render_template("meals/list.html", meals=meals, userID=userID, meal_items_map=meal_items_map, next_page=next_page)
  
 @app.route("/meals/edit/<int:mealLogID>", methods=["GET","POST"])
 def edit_meal(mealLogID):
@@ -286,31 +414,19 @@ def edit_meal(mealLogID):
     if not header or header.get("userid") != session.get("userID"):
         flash("Unauthorized or not found", "error")
         return redirect(url_for("index"))
-    # Use allergens proc with lowercase keys; fallback and normalize if needed
-    try:
-        foods = DB.call_proc("sp_list_foods_with_allergens")
-    except Exception:
-        raw_foods = DB.call_proc("sp_list_foods")
-        foods = [{
-            "foodid": f.get("foodid") or f.get("foodID"),
-            "name": f.get("name") or f.get("Name"),
-            "calories": f.get("calories") or f.get("Calories"),
-            "proteins": f.get("proteins") or f.get("Proteins"),
-            "carbs": f.get("carbs") or f.get("Carbs"),
-            "fats": f.get("fats") or f.get("Fats")
-        } for f in (raw_foods or [])]
     if request.method == "POST":
         try:
-            DB.call_proc("sp_update_meal", (mealLogID, request.form.get("mealType"), request.form.get("logTime")))
-            DB.call_proc("sp_clear_meal_items", (mealLogID,))
-            for foodID, qty in zip(request.form.getlist("foodID"), request.form.getlist("quantityInGram")):
-                if foodID and qty:
-                    DB.call_proc("sp_add_meal_item", (int(mealLogID), int(foodID), int(qty)))
+            new_items = meal_items_from_form()
+            with DB.transaction() as tx:
+                tx.call_proc("sp_update_meal", (mealLogID, request.form.get("mealType"), request.form.get("logTime")))
+                tx.call_proc("sp_clear_meal_items", (mealLogID,))
+                if new_items:
+                    tx.call_proc("sp_add_meal_items", (mealLogID, json.dumps(new_items)))
             flash("Meal updated", "success")
             return redirect(url_for("list_meals", userID=session.get("userID")))
         except Exception as e:
             flash(str(e), "error")
-    return render_template("meals/edit.html", meal=header, items=items, foods=foods)
+    return render_template("meals/edit.html", meal=header, items=items, allergen_names=allergen_names())
 
 @app.route("/meals/detail/<int:mealLogID>")
 def meal_detail(mealLogID):
@@ -333,7 +449,8 @@ def meal_detail(mealLogID):
     if not header or header.get("userid") != session.get("userID"):
         flash("Unauthorized or not found", "error")
         return redirect(url_for("index"))
-    return render_template("meals/detail.html", meal=header, items=items)
+    return render_template("meals/detail.html", meal=header, items=items,
+                           allergens=meal_allergens(it["foodid"] for it in items))
 
 @app.route("/meals/create/<int:userID>", methods=["GET","POST"])
 def create_meal(userID):
@@ -342,23 +459,18 @@ def create_meal(userID):
     if session.get("userID") != userID:
         flash("Unauthorized", "error")
         return redirect(url_for("index"))
-    foods = DB.call_proc("sp_list_foods")
     if request.method == "POST":
         try:
-            # Create meal log
-            DB.call_proc("sp_create_meal", (userID, request.form.get("mealType"), request.form.get("logTime")))
-            # Get last inserted meal for the user
-            last = DB.execute("SELECT meallogid FROM meal_log WHERE userid = %s ORDER BY meallogid DESC LIMIT 1", (userID,))
-            mealLogID = last[0]["meallogid"]
-            # Add items
-            for foodID, qty in zip(request.form.getlist("foodID"), request.form.getlist("quantityInGram")):
-                if foodID and qty:
-                    DB.call_proc("sp_add_meal_item", (int(mealLogID), int(foodID), int(qty)))
-            flash("Meal created", "success")
+            # Meal header and all items are written together, now or by the ingest flusher
+            queued = ingest.submit_meal(userID, request.form.get("mealType"), request.form.get("logTime") or None,
+                                        meal_items_from_form(), request_idempotency_key())
+            flash("Meal saved; it will appear in a moment" if queued else "Meal created", "success")
             return redirect(url_for("list_meals", userID=userID))
         except Exception as e:
             flash(str(e), "error")
-    return render_template("meals/create.html", foods=foods, userID=userID)
+    # A double-submitted form carries the same key and is logged once
+    return render_template("meals/create.html", userID=userID, idempotency_key=ingest.idempotency_key(),
+                           allergen_names=allergen_names())
 
 @app.route("/meals/<int:mealLogID>/delete", methods=["POST"]) 
 def delete_meal(mealLogID):
@@ -371,44 +483,51 @@ def delete_meal(mealLogID):
 
 # Foods
 @app.route("/foods")
+@conditional(extra=lambda: FoodCatalog.request_snapshot()[0])
 def list_foods():
     if not require_login():
         return redirect(url_for("login"))
-    try:
-        foods = DB.call_proc("sp_list_foods_with_allergens")
-    except Exception:
-        raw_foods = DB.call_proc("sp_list_foods")
-        foods = [{
-            "foodid": f.get("foodid") or f.get("foodID"),
-            "name": f.get("name") or f.get("Name"),
-            "calories": f.get("calories") or f.get("Calories"),
-            "proteins": f.get("proteins") or f.get("Proteins"),
-            "carbs": f.get("carbs") or f.get("Carbs"),
-            "fats": f.get("fats") or f.get("Fats")
-        } for f in (raw_foods or [])]
-    return render_template("foods/list.html", foods=foods)
+    # ?exclude=peanuts&exclude=milk hides foods with any of those allergens (allergen bitmaps)
+    exclude = parse_exclude(request.args.getlist("exclude"))
+    version, foods = safe_foods(exclude)
+    return render_template("foods/list.html", foods=foods, catalog_version=version, exclude=exclude,
+                           allergen_names=allergen_names())
+
+# Typeahead for the meal forms: top-k foods whose name tokens start with every query term
+@app.route("/foods/search")
+def search_foods_json():
+    if not session.get("userID"):
+        return jsonify({"error": "Please log in"}), 401
+    k = min(max(request.args.get("k", 10, type=int), 1), 50)
+    skip = foods_containing(parse_exclude(request.args.getlist("exclude")))
+    results = search_foods(request.args.get("q", ""), k, skip)
+    return jsonify([{
+        "foodid": f.get("foodid"),
+        "name": f.get("name"),
+        "calories": f.get("calories"),
+        "proteins": float(f.get("proteins") or 0),
+        "carbs": float(f.get("carbs") or 0),
+        "fats": float(f.get("fats") or 0),
+        "allergens": allergen_list(f),
+    } for f in results])
 
 @app.route("/foods/create", methods=["GET","POST"])
 def create_food():
     if request.method == "POST":
         try:
-            DB.call_proc("sp_create_food", (
-                request.form.get("Name"),
-                int(request.form.get("Calories")),
-                float(request.form.get("Proteins")),
-                float(request.form.get("Carbs")),
-                float(request.form.get("Fats"))
-            ))
             # Add optional allergens, comma-separated
             allergens_str = request.form.get("Allergens") or ""
             allergens = [a.strip() for a in allergens_str.split(",") if a.strip()]
-            if allergens:
-                # Fetch the last inserted food id
-                last_food = DB.execute("SELECT foodid FROM food_items ORDER BY foodid DESC LIMIT 1")
-                if last_food:
-                    fid = last_food[0]["foodid"]
-                    for a in allergens:
-                        DB.call_proc("sp_add_allergen", (int(fid), a))
+            with DB.transaction() as tx:
+                tx.call_proc("sp_create_food", (
+                    request.form.get("Name"),
+                    int(request.form.get("Calories")),
+                    float(request.form.get("Proteins")),
+                    float(request.form.get("Carbs")),
+                    float(request.form.get("Fats"))
+                ))
+                if allergens:
+                    tx.call_proc("sp_add_allergens", (tx.last_insert_id(), json.dumps(allergens)))
             flash("Food created", "success")
             return redirect(url_for("list_foods"))
         except Exception as e:
@@ -417,6 +536,7 @@ def create_food():
 
 # Medications
 @app.route("/meds/<int:userID>")
+@conditional()
 def list_meds(userID):
     if not require_login():
         return redirect(url_for("login"))
@@ -430,7 +550,12 @@ def list_meds(userID):
 def med_detail(medicationID):
     if not require_login():
         return redirect(url_for("login"))
-    results = DB.call_proc("sp_get_med_logs", (medicationID,))
+    # Newest page first, optionally limited to ?from=&to=; "Older" pages on (takentime, medlogid)
+    window_from = request.args.get("from") or None
+    window_to = request.args.get("to") or None
+    before_time = request.args.get("before") or None
+    before_id = request.args.get("before_id", type=int)
+    results = DB.call_proc("sp_get_med_logs", (medicationID, window_from, window_to, before_time, before_id, MED_LOGS_PAGE_SIZE))
     header = None
     logs = []
     for row in results:
@@ -441,7 +566,34 @@ def med_detail(medicationID):
     if not header or header.get("userid") != session.get("userID"):
         flash("Unauthorized or not found", "error")
         return redirect(url_for("index"))
-    return render_template("meds/detail.html", med=header, logs=logs)
+    next_page = None
+    if len(logs) == MED_LOGS_PAGE_SIZE:
+        last = logs[-1]
+        next_page = {"before": str(last.get("takentime")), "before_id": last.get("medlogid")}
+    return render_template("meds/detail.html", med=header, logs=logs, next_page=next_page,
+                           window={"from": window_from or "", "to": window_to or ""})
+
+@app.route("/meds/<int:userID>/adherence")
+def med_adherence(userID):
+    if not require_login():
+        return redirect(url_for("login"))
+    if session.get("userID") != userID:
+        flash("Unauthorized", "error")
+        return redirect(url_for("index"))
+    # Window is [from, to] in whole days; defaults to the last 30 days including today
+    try:
+        end_day = date.fromisoformat(request.args["to"]) if request.args.get("to") else date.today()
+        start_day = date.fromisoformat(request.args["from"]) if request.args.get("from") else end_day - timedelta(days=29)
+        if end_day < start_day:
+            raise ValueError("'from' must be on or before 'to'")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    report = user_adherence(userID, datetime.combine(start_day, datetime.min.time()),
+                            datetime.combine(end_day + timedelta(days=1), datetime.min.time()))
+    if request.args.get("format") == "json" or request.accept_mimetypes.best == "application/json":
+        return jsonify(report)
+    return render_template("meds/adherence.html", userID=userID, report=report,
+                           window={"from": start_day.isoformat(), "to": end_day.isoformat()})
 
 @app.route("/meds/create/<int:userID>", methods=["GET","POST"])
 def create_med(userID):
@@ -456,19 +608,299 @@ def create_med(userID):
 
 @app.route("/meds/log/<int:medicationID>", methods=["POST"]) 
 def log_med(medicationID):
+    if not require_login():
+        return redirect(url_for("login"))
     try:
-        taken = request.form.get("takenTime")
-        # Fallback to current timestamp if empty to avoid MySQL datetime error
-        if not taken or not taken.strip():
-            taken = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Blank time means now
+        taken = (request.form.get("takenTime") or "").strip() or None
         skipped = bool(request.form.get("isSkipped"))
-        DB.call_proc("sp_log_med", (medicationID, taken, skipped))
-        flash("Medication logged", "success")
+        queued = ingest.submit_med_log(session.get("userID"), medicationID, taken, skipped, request_idempotency_key())
+        flash("Medication log saved; it will appear in a moment" if queued else "Medication logged", "success")
     except Exception as e:
         flash(str(e), "error")
     return redirect(request.referrer or url_for("index"))
 
-# Analytics page removed; macros are shown on the home page
+# Bulk import/export
+@app.route("/import/<kind>", methods=["GET", "POST"])
+def import_data(kind):
+    if not require_login():
+        return redirect(url_for("login"))
+    if kind not in bulk.KINDS:
+        return jsonify({"error": f"kind must be one of {', '.join(bulk.KINDS)}"}), 404
+    upload = request.files.get("file")
+    if request.method == "GET" or upload is None:
+        return jsonify({"error": "POST a CSV or JSONL file as multipart field 'file'"}), 400
+    chunk_size = request.args.get("chunk", 500, type=int)
+    if chunk_size < 1:
+        return jsonify({"error": "chunk must be at least 1"}), 400
+    uid = session.get("userID")
+    allowed_meds = None
+    if kind == "medlogs":
+        allowed_meds = {m["medicationid"] for m in DB.call_proc("sp_list_meds", (uid,))}
+    fmt = bulk.detect_format(upload.filename, request.args.get("format"))
+    # The upload is spooled to disk by werkzeug; read it back as a text stream
+    text = io.TextIOWrapper(upload.stream, encoding="utf-8", newline="")
+    report = bulk.import_records(kind, bulk.read_records(text, fmt),
+                                 chunk_size=min(chunk_size, IMPORT_MAX_CHUNK),
+                                 skip=request.args.get("skip", 0, type=int),
+                                 user_id=uid if kind == "meals" else None,
+                                 allowed_meds=allowed_meds)
+    return jsonify(report.as_dict())
+
+@app.route("/export/<int:userID>.jsonl")
+def export_data(userID):
+    if not require_login():
+        return redirect(url_for("login"))
+    if session.get("userID") != userID:
+        flash("Unauthorized", "error")
+        return redirect(url_for("index"))
+    return Response(stream_with_context(bulk.export_history(userID)), mimetype="application/x-ndjson",
+                    headers={"Content-Disposition": f"attachment; filename=wefit-history-{userID}.jsonl"})
+
+# Metrics (Prometheus text exposition format)
+@metrics.register_collector
+def catalog_metrics():
+    stats = FoodCatalog.stats()
+    return (
+        metrics.family("wefit_catalog_cache_hits_total", "counter",
+                       "Food catalog reads served from the in-process cache.", [(None, stats["hits"])])
+        + metrics.family("wefit_catalog_cache_misses_total", "counter",
+                         "Food catalog reads that reloaded from MySQL.", [(None, stats["misses"])])
+        + metrics.family("wefit_catalog_cache_foods", "gauge",
+                         "Foods held in the in-process catalog cache.", [(None, stats["size"])])
+    )
+
+@metrics.register_collector
+def fragment_metrics():
+    stats = FRAGMENTS.stats()
+    return (
+        metrics.family("wefit_fragment_cache_requests_total", "counter",
+                       "Cached template fragment lookups by result.",
+                       [({"result": r}, stats[r]) for r in ("hits", "misses")])
+        + metrics.family("wefit_fragment_cache_evictions_total", "counter",
+                         "Fragments evicted to stay within FRAGMENT_CACHE_BYTES.", [(None, stats["evictions"])])
+        + metrics.family("wefit_fragment_cache_entries", "gauge",
+                         "Rendered fragments held in the cache.", [(None, stats["entries"])])
+        + metrics.family("wefit_fragment_cache_bytes", "gauge",
+                         "Characters of rendered HTML held in the cache.", [(None, stats["bytes"])])
+    )
+
+@metrics.register_collector
+def analytics_metrics():
+    stats = SERIES_CACHE.stats()
+    return (
+        metrics.family("wefit_analytics_cache_requests_total", "counter",
+                       "Analytics reads by whether the finalized days came from cache.",
+                       [({"result": r}, stats[r]) for r in ("hits", "misses", "stale")])
+        + metrics.family("wefit_analytics_cache_entries", "gauge",
+                         "Date windows held in the analytics cache.", [(None, stats["size"])])
+    )
+
+@metrics.register_collector
+def data_version_metrics():
+    stats = DATA_VERSIONS.stats()
+    return metrics.family("wefit_data_version_cache_requests_total", "counter",
+                          "User data-version lookups by whether the cached version was used.",
+                          [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])])
+
+@metrics.register_collector
+def hash_pool_metrics():
+    stats = passwords.HASH_POOL.stats()
+    return (
+        metrics.family("wefit_password_hash_in_flight", "gauge",
+                       "Password hash/verify operations running or queued.", [(None, stats["in_flight"])])
+        + metrics.family("wefit_password_hash_total", "counter",
+                         "Password hash/verify operations by outcome.",
+                         [({"result": r}, stats[r]) for r in ("completed", "rejected", "timeouts")])
+    )
+
+@metrics.register_collector
+def ingest_metrics():
+    stats = ingest.stats()
+    if stats is None:
+        return []
+    lines = (
+        metrics.family("wefit_ingest_queue_depth", "gauge",
+                       "Meal/medication logs waiting in the local ingest queue.", [(None, stats["depth"])])
+        + metrics.family("wefit_ingest_queue_oldest_seconds", "gauge",
+                         "Age of the oldest queued log, i.e. the current flush lag.", [(None, round(stats["oldest_age"], 3))])
+        + metrics.family("wefit_ingest_dead_letters", "gauge",
+                         "Queued logs given up on; kept in the queue file for inspection.", [(None, stats["dead"])])
+        + metrics.family("wefit_ingest_flushed_total", "counter", "Queued logs written to MySQL by kind.",
+                         [({"kind": k}, n) for k, n in sorted(stats["flushed"].items())])
+        + metrics.family("wefit_ingest_entries_total", "counter", "Queued logs that were not written, by outcome.",
+                         [({"result": r}, stats[r]) for r in ("retries", "rejected", "dead_lettered")])
+    )
+    if stats["last_lag"] is not None:
+        lines += metrics.family("wefit_ingest_last_flush_lag_seconds", "gauge",
+                                "Queue time of the oldest log in the last flushed batch.",
+                                [(None, round(stats["last_lag"], 3))])
+    return lines
+
+@metrics.register_collector
+def pool_metrics():
+    pools = [(name, stats) for name, stats in (("primary", DB.pool_stats()), ("replica", DB.replica_pool_stats()))
+             if stats]
+    if not pools:
+        return []
+
+    def each(key, **labels):
+        return [(dict(labels, pool=name), stats[key]) for name, stats in pools]
+
+    lines = (
+        metrics.family("wefit_db_pool_connections", "gauge", "Connections in the MySQL pools by state.",
+                       each("in_use", state="in_use") + each("idle", state="idle") + each("opened", state="opened"))
+        + metrics.family("wefit_db_pool_waiting", "gauge",
+                         "Requests currently queued for a connection.", each("waiting"))
+        + metrics.family("wefit_db_pool_exhausted_total", "counter",
+                         "Acquires that timed out waiting for a connection.", each("exhausted_total"))
+        + metrics.family("wefit_db_pool_recycled_total", "counter",
+                         "Connections replaced for age or a failed liveness ping.", each("recycled_total"))
+    )
+    for i, (name, stats) in enumerate(pools):
+        wait = metrics.histogram_family("wefit_db_pool_wait_seconds", "Time spent waiting to acquire a connection.",
+                                        stats["wait_buckets"], stats["wait_sum"], stats["acquired_total"],
+                                        labels={"pool": name})
+        # One HELP/TYPE header per family
+        lines += wait if i == 0 else wait[2:]
+    routes = DB.route_stats()
+    lines += (
+        metrics.family("wefit_db_reads_total", "counter", "Read queries by where they were served.",
+                       [({"target": t}, routes[t]) for t in ("replica", "primary")])
+        + metrics.family("wefit_db_replica_fallbacks_total", "counter",
+                         "Replica reads that failed and were retried on the primary.", [(None, routes["fallback"])])
+        + metrics.family("wefit_db_replica_up", "gauge", "1 when reads may be sent to the replica.",
+                         [(None, int(routes["replica_configured"] and not routes["replica_down"]))])
+    )
+    return lines
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# Analytics: macro series over a date range (?from=&to=&granularity=day|week|month&rolling=N)
+@app.route("/analytics/<int:userID>")
+def analytics(userID):
+    if not require_login():
+        return redirect(url_for("login"))
+    if session.get("userID") != userID:
+        flash("Unauthorized", "error")
+        return redirect(url_for("index"))
+    wants_json = request.args.get("format") == "json" or request.accept_mimetypes.best == "application/json"
+    try:
+        start, end, granularity, rolling = parse_window(request.args)
+    except ValueError as e:
+        if wants_json:
+            return jsonify({"error": str(e)}), 400
+        flash(f"Invalid range: {e}", "error")
+        start, end, granularity, rolling = parse_window({})
+    report = macro_trends(userID, start, end, granularity, rolling)
+    if wants_json:
+        return jsonify(report)
+    return render_template("analytics/macros.html", userID=userID, report=report, granularities=GRANULARITIES)
+
+# Maintenance commands (run with `flask --app app <command>`)
+@app.cli.command("verify-meal-totals")
+@click.option("--user", "user_id", type=int, default=None, help="Only check meals for this user.")
+@click.option("--repair", is_flag=True, help="Rewrite drifted totals from meal_items.")
+def verify_meal_totals(user_id, repair):
+    drift = DB.call_proc("sp_verify_meal_totals", (user_id, repair))
+    for d in drift:
+        click.echo("meal {meallogid} (user {userid}): calories {storedcalories} != {expectedcalories}, "
+                   "proteins {storedproteins} != {expectedproteins}, carbs {storedcarbs} != {expectedcarbs}, "
+                   "fats {storedfats} != {expectedfats}".format(**d))
+    if not drift:
+        click.echo("Meal totals are consistent.")
+    elif repair:
+        click.echo(f"Repaired {len(drift)} meal(s).")
+    else:
+        click.echo(f"{len(drift)} meal(s) drifted; rerun with --repair to fix.")
+
+@app.cli.command("import-data")
+@click.argument("kind", type=click.Choice(bulk.KINDS))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), default=None, help="Defaults from the file extension.")
+@click.option("--chunk-size", default=500, type=click.IntRange(min=1), show_default=True, help="Rows per multi-row insert / transaction.")
+@click.option("--checkpoint", type=click.Path(dir_okay=False), default=None, help="Resume from and record progress in this file.")
+@click.option("--errors", "errors_path", type=click.Path(dir_okay=False), default=None, help="Write rejected rows here as JSONL.")
+@click.option("--user", "user_id", type=int, default=None, help="Import meals for this user (overrides the userid column).")
+def import_data_command(kind, path, fmt, chunk_size, checkpoint, errors_path, user_id):
+    skip = bulk.load_checkpoint(checkpoint)
+    if skip:
+        click.echo(f"Resuming after row {skip}.")
+    sink = open(errors_path, "a") if errors_path else None
+    try:
+        with open(path, encoding="utf-8", newline="") as f:
+            report = bulk.import_records(kind, bulk.read_records(f, bulk.detect_format(path, fmt)),
+                                         chunk_size=chunk_size, skip=skip, checkpoint=checkpoint,
+                                         error_sink=sink, user_id=user_id)
+    finally:
+        if sink is not None:
+            sink.close()
+    click.echo(f"{report.inserted} row(s) inserted, {report.failed} rejected, through row {report.rows_done}.")
+    for e in report.errors[:10]:
+        click.echo(f"  row {e['row']}: {e['error']}")
+
+@app.cli.command("export-history")
+@click.argument("user_id", type=int)
+@click.argument("output", type=click.File("w"))
+def export_history_command(user_id, output):
+    for line in bulk.export_history(user_id):
+        output.write(line)
+
+@app.cli.command("rebuild-daily-summary")
+@click.option("--from", "date_from", required=True, type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.option("--to", "date_to", required=True, type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.option("--batch-days", default=7, type=click.IntRange(min=1), show_default=True, help="Days rebuilt per transaction.")
+def rebuild_daily_summary(date_from, date_to, batch_days):
+    if date_to < date_from:
+        raise click.BadParameter("--to must not be before --from")
+    DB.rebuild_daily_summary(date_from.date(), date_to.date(), batch_days)
+    click.echo(f"Rebuilt daily summaries from {date_from:%Y-%m-%d} to {date_to:%Y-%m-%d}.")
+
+@app.cli.command("seed-data")
+@click.option("--scale", type=click.Choice(list(seed.SCALES)), default="small", show_default=True)
+@click.option("--seed", "seed_value", default=1, show_default=True, help="Same seed and sizes, same data.")
+@click.option("--users", type=int, default=None, help="Override the scale's user count.")
+@click.option("--foods", type=int, default=None, help="Override the scale's food catalog size.")
+@click.option("--meal-items", type=int, default=None, help="Override the scale's (approximate) meal item count.")
+@click.option("--med-logs", type=int, default=None, help="Override the scale's (approximate) medication log count.")
+@click.option("--days", type=int, default=None, help="Days of history, ending --end.")
+@click.option("--end", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Last day of history (default today).")
+def seed_data_command(scale, seed_value, users, foods, meal_items, med_logs, days, end):
+    params = seed.scale_params(scale, users=users, foods=foods, meal_items=meal_items, med_logs=med_logs, days=days)
+    click.echo(f"Seeding {params} with seed {seed_value}; users log in as u<N>.s{seed_value}@{seed.EMAIL_DOMAIN} / {seed.SEED_PASSWORD}")
+    result = seed.seed(params, seed_value, end.date() if end else None,
+                       progress=lambda c: click.echo(f"  {c['users']} users, {c['meal_items']} meal items, {c['med_logs']} med logs"))
+    click.echo(json.dumps(result))
+
+@app.cli.command("bench")
+@click.option("--route", "routes", multiple=True, type=click.Choice(list(bench.ROUTES)), help="Repeatable; default: " + ", ".join(bench.DEFAULT_ROUTES))
+@click.option("--requests", "requests_total", default=1000, show_default=True)
+@click.option("--concurrency", default=4, show_default=True)
+@click.option("--warmup", default=50, show_default=True, help="Unrecorded requests run first.")
+@click.option("--users", "user_count", default=200, show_default=True, help="Seeded users to spread requests over.")
+@click.option("--seed", "seed_value", default=1, show_default=True, help="Seed the data was generated with.")
+@click.option("--url", default=None, help="Benchmark a running server over HTTP instead of the in-process test client.")
+@click.option("--out", type=click.File("w"), default=None, help="Write the JSON report here.")
+def bench_command(routes, requests_total, concurrency, warmup, user_count, seed_value, url, out):
+    if url and user_count > passwords.IP_MAX_ATTEMPTS:
+        # Every user logs in from this one IP; stay within the server's login throttle
+        click.echo(f"Using {passwords.IP_MAX_ATTEMPTS} users over HTTP (IP_MAX_ATTEMPTS login limit)")
+        user_count = passwords.IP_MAX_ATTEMPTS
+    users = bench.sample_users(user_count, seed_value)
+    if not users:
+        raise click.ClickException(f"No users seeded with --seed {seed_value}; run `flask --app app seed-data` first.")
+    jobs = bench.plan(routes or bench.DEFAULT_ROUTES, users, requests_total + warmup, seed_value)
+    try:
+        sessions = bench.http_sessions(url, users) if url else bench.client_sessions(app)
+    except bench.BenchError as e:
+        raise click.ClickException(str(e))
+    report = bench.run(jobs, sessions, concurrency, warmup)
+    report["meta"].update(mode="http" if url else "test_client", url=url, users=len(users), seed=seed_value)
+    click.echo(bench.format_table(report))
+    if out:
+        out.write(bench.dumps(report))
 
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=5000, debug=True, use_reloader=False)
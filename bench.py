@@ -0,0 +1,235 @@
+import http.cookiejar
+import json
+import random
+import re
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+import numpy as np
+from db import DB
+import seed
+
+# Route-level benchmark. Requests are replayed against seeded users either in-process through
+# Flask's test client (no server needed; sessions are set directly) or over HTTP against a
+# running server (each user logs in with the seed password before the run). Latency is measured on the
+# client side, queries per request come from the app's Server-Timing header.
+
+# name -> URL template; {uid}, {meallogid}, {medicationid} come from the sampled user
+ROUTES = {
+    "dashboard": "/",
+    "meals": "/meals/{uid}",
+    "meal_edit": "/meals/edit/{meallogid}",
+    "meal_detail": "/meals/detail/{meallogid}",
+    "foods": "/foods",
+    "meds": "/meds/{uid}",
+    "med_detail": "/meds/detail/{medicationid}",
+    "adherence": "/meds/{uid}/adherence",
+    "analytics": "/analytics/{uid}",
+    "calendar": "/calendar",
+}
+DEFAULT_ROUTES = ("dashboard", "meals", "meal_edit", "foods", "meds")
+_QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+class BenchError(Exception):
+    pass
+
+
+def sample_users(count, seed_value=1):
+    # Seeded users with one of their meals and medications, chosen deterministically
+    rows = DB.execute(
+        "SELECT u.userid AS uid, u.emailid AS email, "
+        "(SELECT MAX(ml.meallogid) FROM meal_log ml WHERE ml.userid = u.userid) AS meallogid, "
+        "(SELECT MIN(m.medicationid) FROM medication m WHERE m.userid = u.userid) AS medicationid "
+        "FROM user u WHERE u.emailid LIKE %s ORDER BY u.userid",
+        (f"%.s{seed_value}@{seed.EMAIL_DOMAIN}",))
+    if len(rows) > count:
+        rows = random.Random(seed_value).sample(rows, count)
+    return rows
+
+
+def plan(routes, users, requests, seed_value=1):
+    # Deterministic request list: routes round-robin, users at random. Routes a user has no
+    # target for (no meals, no medications) are skipped for that user.
+    rng = random.Random(f"{seed_value}:plan")
+    jobs = []
+    while len(jobs) < requests:
+        added = False
+        for name in routes:
+            user = rng.choice(users)
+            try:
+                url = ROUTES[name].format(**user)
+            except KeyError:
+                continue
+            if "None" in url:
+                continue
+            jobs.append((name, user, url))
+            added = True
+            if len(jobs) == requests:
+                break
+        if not added:
+            break
+    return jobs
+
+
+class _ClientSession:
+    # In-process: Flask test client with the session set directly (no password hashing)
+    def __init__(self, app):
+        self.app = app
+        self.clients = {}
+
+    def get(self, user, url):
+        client = self.clients.get(user["uid"])
+        if client is None:
+            client = self.clients[user["uid"]] = self.app.test_client()
+            with client.session_transaction() as s:
+                s["userID"] = user["uid"]
+                s["firstName"] = "Bench"
+        resp = client.get(url)
+        resp.close()
+        return resp.status_code, resp.headers.get("Server-Timing", "")
+
+
+def _landed_on_login(resp):
+    return urllib.parse.urlsplit(resp.geturl()).path.rstrip("/").endswith("/login")
+
+
+class _HttpSession:
+    # Over HTTP: one cookie jar per user, all logged in with the seed password before the run
+    # so no login happens on the clock. The login route is throttled per client IP
+    # (IP_MAX_ATTEMPTS per IP_ATTEMPT_WINDOW), so keep `users` within that limit.
+    def __init__(self, base_url, users):
+        self.base_url = base_url.rstrip("/")
+        self.openers = {u["uid"]: self._login(u) for u in users}
+
+    def _login(self, user):
+        jar = http.cookiejar.CookieJar()
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+        body = urllib.parse.urlencode({"email": user["email"], "password": seed.SEED_PASSWORD}).encode()
+        try:
+            with opener.open(self.base_url + "/login", body) as resp:
+                resp.read()
+                failed = _landed_on_login(resp)
+        except urllib.error.HTTPError as e:
+            hint = " (login throttle: use fewer --users or wait a minute)" if e.code == 429 else ""
+            raise BenchError(f"Login as {user['email']} failed with HTTP {e.code}{hint}")
+        # A rejected login renders the form again; a good one redirects away with a session cookie
+        if failed or not any(c.name == "session" for c in jar):
+            raise BenchError(f"Login as {user['email']} failed; is the server seeded with this --seed?")
+        return opener
+
+    def get(self, user, url):
+        try:
+            with self.openers[user["uid"]].open(self.base_url + url) as resp:
+                resp.read()
+                # Redirected to the login page: the session was lost, not a successful request
+                if _landed_on_login(resp):
+                    return 401, ""
+                return resp.status, resp.headers.get("Server-Timing", "")
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get("Server-Timing", "")
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None}
+    ms = np.asarray(values) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2),
+            "mean_ms": round(float(ms.mean()), 2), "max_ms": round(float(ms.max()), 2)}
+
+
+def _summary(samples, wall):
+    latencies = [s[1] for s in samples]
+    queries = [s[3] for s in samples if s[3] is not None]
+    statuses = {}
+    for s in samples:
+        statuses[str(s[2])] = statuses.get(str(s[2]), 0) + 1
+    return dict(
+        requests=len(samples),
+        errors=sum(1 for s in samples if s[2] >= 400),
+        throughput_rps=round(len(samples) / wall, 2) if wall else None,
+        queries_per_request=round(sum(queries) / len(queries), 2) if queries else None,
+        status=statuses,
+        **_percentiles(latencies),
+    )
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(jobs, session_factory, concurrency=1, warmup=0):
+    # Runs `jobs` on `concurrency` threads, each with its own session; returns the report dict
+    for name, user, url in jobs[:warmup]:
+        session_factory().get(user, url)
+    jobs = jobs[warmup:]
+    samples = []
+    lock = threading.Lock()
+    position = iter(jobs)
+
+    def worker():
+        session = session_factory()
+        local = []
+        while True:
+            with lock:
+                job = next(position, None)
+            if job is None:
+                break
+            name, user, url = job
+            start = time.perf_counter()
+            status, timing = session.get(user, url)
+            elapsed = time.perf_counter() - start
+            m = _QUERIES_RE.search(timing)
+            local.append((name, elapsed, status, int(m.group(1)) if m else None))
+        with lock:
+            samples.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f"bench-{i}") for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    by_route = {}
+    for s in samples:
+        by_route.setdefault(s[0], []).append(s)
+    return {
+        "meta": {"commit": _git_commit(), "started_at": datetime.now().isoformat(timespec="seconds"),
+                 "concurrency": concurrency, "warmup": warmup, "wall_seconds": round(wall, 3)},
+        "total": _summary(samples, wall),
+        "routes": {name: _summary(rows, wall) for name, rows in sorted(by_route.items())},
+    }
+
+
+def client_sessions(app):
+    return lambda: _ClientSession(app)
+
+
+def http_sessions(base_url, users):
+    # Shared by all workers so each user logs in once (the login route is rate limited per IP)
+    session = _HttpSession(base_url, users)
+    return lambda: session
+
+
+def format_table(report):
+    lines = [f"{'route':<14}{'reqs':>7}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'q/req':>7}"]
+    rows = list(report["routes"].items()) + [("TOTAL", report["total"])]
+    for name, r in rows:
+        lines.append(f"{name:<14}{r['requests']:>7}{r['errors']:>5}{r['p50_ms'] or 0:>9.1f}{r['p95_ms'] or 0:>9.1f}"
+                     f"{r['p99_ms'] or 0:>9.1f}{r['queries_per_request'] or 0:>7.1f}")
+    lines.append(f"throughput: {report['total']['throughput_rps']} req/s over {report['meta']['wall_seconds']} s")
+    return "\n".join(lines)
+
+
+def dumps(report):
+    return json.dumps(report, indent=2, sort_keys=True)
@@ -0,0 +1,293 @@
+import csv
+import json
+import os
+import uuid
+from datetime import datetime
+from db import DB
+
+# Streaming bulk import/export. Imports read one record at a time, validate it, and insert
+# valid rows in chunked multi-row statements (one transaction per chunk); exports pull rows
+# through a server-side cursor. Memory use is bounded by the chunk size, not the file size.
+
+KINDS = ("foods", "meals", "medlogs")
+MEAL_TYPES = ("breakfast", "lunch", "dinner", "snack")
+MAX_REPORTED_ERRORS = 100
+
+
+def detect_format(filename, fmt=None):
+    if fmt:
+        return fmt.lower()
+    return "jsonl" if (filename or "").lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def read_records(text_stream, fmt):
+    # Yields (row_number, record dict); row numbers are 1-based data rows (CSV header excluded)
+    if fmt == "jsonl":
+        for n, line in enumerate(text_stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield n, json.loads(line)
+            except ValueError as e:
+                yield n, ValueError(f"invalid JSON: {e}")
+    else:
+        for n, row in enumerate(csv.DictReader(text_stream), 1):
+            yield n, row
+
+
+def _parse_time(value, field):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value).strip().replace("T", " "))
+    except ValueError:
+        raise ValueError(f"{field} must be an ISO date/time, got {value!r}")
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in ("1", "true", "yes", "y", "skipped")
+
+
+def _split_list(value, sep):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [v.strip() for v in str(value).split(sep) if v.strip()]
+
+
+def _validate_food(r, user_id):
+    name = (r.get("name") or "").strip()
+    if not name:
+        raise ValueError("name is required")
+    try:
+        calories = int(float(r.get("calories")))
+        macros = [float(r.get(k) or 0) for k in ("proteins", "carbs", "fats")]
+    except (TypeError, ValueError):
+        raise ValueError("calories, proteins, carbs and fats must be numbers")
+    allergens = sorted({a.strip() for a in _split_list(r.get("allergens"), ";") if str(a).strip()})
+    return (name, calories, *macros), allergens
+
+
+def _validate_meal(r, user_id):
+    uid = user_id if user_id is not None else r.get("userid")
+    try:
+        uid = int(uid)
+    except (TypeError, ValueError):
+        raise ValueError("userid is required")
+    mealtype = (r.get("mealtype") or "").strip().lower()
+    if mealtype not in MEAL_TYPES:
+        raise ValueError(f"mealtype must be one of {', '.join(MEAL_TYPES)}")
+    logtime = _parse_time(r.get("logtime"), "logtime")
+    items = {}
+    for it in _split_list(r.get("items"), ";"):
+        try:
+            if isinstance(it, dict):
+                foodid, qty = int(it["foodid"]), int(it.get("qty", it.get("quantityingram")))
+            else:
+                foodid, qty = (int(x) for x in str(it).split(":"))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"items must be foodid:qty pairs, got {it!r}")
+        if qty <= 0:
+            raise ValueError("item quantities must be positive")
+        items[foodid] = items.get(foodid, 0) + qty
+    return (uid, mealtype, logtime), sorted(items.items())
+
+
+def _validate_medlog(r, user_id, allowed_meds=None):
+    try:
+        medid = int(r.get("medicationid"))
+    except (TypeError, ValueError):
+        raise ValueError("medicationid is required")
+    if allowed_meds is not None and medid not in allowed_meds:
+        raise ValueError(f"medication {medid} does not belong to this user")
+    return (medid, _parse_time(r.get("takentime"), "takentime"), _parse_bool(r.get("isskipped"))), None
+
+
+def _values(n, width):
+    row = "(" + ",".join(["%s"] * width) + ")"
+    return ",".join([row] * n)
+
+
+def _insert_foods(tx, rows):
+    ids = tx.insert_rows("food_items", "foodid", ("name", "calories", "proteins", "carbs", "fats"),
+                         [food for food, _ in rows], ("name",))
+    allergens = [(fid, a) for fid, (_, labels) in zip(ids, rows) for a in labels]
+    if allergens:
+        tx.execute("INSERT INTO food_allergens (foodid, allergenname) VALUES " + _values(len(allergens), 2),
+                   [v for pair in allergens for v in pair])
+
+
+def _insert_meals(tx, rows):
+    # Each meal gets a fresh idempotency key, which also identifies its generated id
+    ids = tx.insert_rows("meal_log", "meallogid", ("userid", "mealtype", "logtime", "idemkey"),
+                         [meal + (uuid.uuid4().hex,) for meal, _ in rows], ("idemkey",))
+    items = [(mid, foodid, qty) for mid, (_, its) in zip(ids, rows) for foodid, qty in its]
+    if items:
+        # Item triggers roll the new items into meal_log and user_daily_summary totals
+        tx.execute("INSERT INTO meal_items (meallogid, foodid, quantityingram) VALUES " + _values(len(items), 3),
+                   [v for it in items for v in it])
+
+
+def _insert_medlogs(tx, rows):
+    tx.execute("INSERT INTO medication_log (medicationid, takentime, isskipped) VALUES " + _values(len(rows), 3),
+               [v for log, _ in rows for v in log])
+
+
+_HANDLERS = {
+    "foods": (_validate_food, _insert_foods),
+    "meals": (_validate_meal, _insert_meals),
+    "medlogs": (_validate_medlog, _insert_medlogs),
+}
+
+
+class ImportReport:
+    def __init__(self, kind, skipped=0):
+        self.kind = kind
+        self.rows_done = skipped
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, row, message, sink=None):
+        self.failed += 1
+        entry = {"row": row, "error": str(message)}
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(entry)
+        if sink is not None:
+            sink.write(json.dumps(entry) + "\n")
+
+    def as_dict(self):
+        return {"kind": self.kind, "rows_done": self.rows_done, "inserted": self.inserted,
+                "failed": self.failed, "errors": self.errors}
+
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f).get("rows_done", 0)
+    return 0
+
+
+def save_checkpoint(path, kind, rows_done):
+    if not path:
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"kind": kind, "rows_done": rows_done}, f)
+    os.replace(tmp, path)
+
+
+def import_records(kind, records, chunk_size=500, skip=0, checkpoint=None, error_sink=None,
+                   user_id=None, allowed_meds=None):
+    # records: iterable of (row_number, dict). Rows up to `skip` were committed by an earlier run.
+    # After every committed chunk the checkpoint file records how far we got, so a rerun with
+    # the same checkpoint resumes there. A chunk that fails as a whole is retried row by row so
+    # one bad row only rejects itself.
+    validate, insert = _HANDLERS[kind]
+    report = ImportReport(kind, skip)
+    chunk = []
+
+    def flush():
+        if not chunk:
+            return
+        try:
+            with DB.transaction() as tx:
+                insert(tx, [parsed for _, parsed in chunk])
+            report.inserted += len(chunk)
+        except Exception:
+            for row, parsed in chunk:
+                try:
+                    with DB.transaction() as tx:
+                        insert(tx, [parsed])
+                    report.inserted += 1
+                except Exception as e:
+                    report.error(row, e, error_sink)
+        report.rows_done = chunk[-1][0]
+        save_checkpoint(checkpoint, kind, report.rows_done)
+        chunk.clear()
+
+    for row, record in records:
+        if row <= skip:
+            continue
+        try:
+            if isinstance(record, Exception):
+                raise record
+            if kind == "medlogs":
+                parsed = validate(record, user_id, allowed_meds)
+            else:
+                parsed = validate(record, user_id)
+        except Exception as e:
+            report.error(row, e, error_sink)
+            report.rows_done = row
+            continue
+        chunk.append((row, parsed))
+        if len(chunk) >= chunk_size:
+            flush()
+    flush()
+    save_checkpoint(checkpoint, kind, report.rows_done)
+    return report
+
+
+def _jsonable(row):
+    out = {}
+    for k, v in row.items():
+        if isinstance(v, datetime):
+            out[k] = v.isoformat(sep=" ")
+        elif v is not None and not isinstance(v, (int, float, str, bool)):
+            out[k] = str(v)
+        else:
+            out[k] = v
+    return out
+
+
+def export_history(user_id, batch_size=500):
+    # Yields JSONL lines for a user's meals (with items), medications (with logs) and schedule
+    # events. Each query streams through a server-side cursor; consecutive rows of the same
+    # meal/medication are grouped as they arrive, so only one record is held at a time.
+    meal = None
+    for r in DB.stream(
+            "SELECT ML.meallogid, ML.mealtype, ML.logtime, ML.totalcalories, ML.totalproteins, ML.totalcarbs, "
+            "ML.totalfats, MI.foodid, F.name AS foodname, MI.quantityingram "
+            "FROM meal_log ML "
+            "LEFT JOIN meal_items MI ON MI.meallogid = ML.meallogid "
+            "LEFT JOIN food_items F ON F.foodid = MI.foodid "
+            "WHERE ML.userid = %s ORDER BY ML.logtime, ML.meallogid", (user_id,), batch_size):
+        if meal is None or meal["meallogid"] != r["meallogid"]:
+            if meal is not None:
+                yield json.dumps(meal) + "\n"
+            meal = _jsonable({k: r[k] for k in ("meallogid", "mealtype", "logtime", "totalcalories",
+                                                 "totalproteins", "totalcarbs", "totalfats")})
+            meal["type"] = "meal"
+            meal["items"] = []
+        if r["foodid"] is not None:
+            meal["items"].append({"foodid": r["foodid"], "foodname": r["foodname"], "qty": r["quantityingram"]})
+    if meal is not None:
+        yield json.dumps(meal) + "\n"
+
+    medid = None
+    for r in DB.stream(
+            "SELECT M.medicationid, M.medname, M.dosage, M.frequency, L.medlogid, L.takentime, L.isskipped "
+            "FROM medication M LEFT JOIN medication_log L ON L.medicationid = M.medicationid "
+            "WHERE M.userid = %s ORDER BY M.medicationid, L.takentime", (user_id,), batch_size):
+        if r["medicationid"] != medid:
+            medid = r["medicationid"]
+            med = _jsonable({k: r[k] for k in ("medicationid", "medname", "dosage", "frequency")})
+            med["type"] = "medication"
+            yield json.dumps(med) + "\n"
+        if r["medlogid"] is not None:
+            log = _jsonable({k: r[k] for k in ("medicationid", "medlogid", "takentime")})
+            log["isskipped"] = bool(r["isskipped"])
+            log["type"] = "medication_log"
+            yield json.dumps(log) + "\n"
+
+    for r in DB.stream(
+            "SELECT E.eventid, E.scheduleid, S.schedulename, E.eventtitle, E.starttime, E.endtime, E.description "
+            "FROM schedule S JOIN schedule_events E ON E.scheduleid = S.scheduleid "
+            "WHERE S.userid = %s ORDER BY E.starttime", (user_id,), batch_size):
+        event = _jsonable(r)
+        event["type"] = "event"
+        yield json.dumps(event) + "\n"
@@ -0,0 +1,112 @@
+import heapq
+import itertools
+import os
+from calendar import monthrange
+from datetime import date, datetime, time, timedelta
+
+# Calendar windows over schedule_events. Recurring events are stored once (their first
+# occurrence) and expanded lazily here, only for the window being shown; overlaps across a
+# user's schedules are found with a sweep line over the expanded occurrences.
+
+VIEWS = ("day", "week", "month")
+MAX_OCCURRENCES = int(os.getenv("CALENDAR_MAX_OCCURRENCES", "2000"))
+
+
+def window_for(view, anchor):
+    # [start, end) datetimes for the day/week/month containing `anchor`, plus the anchors of
+    # the previous and next windows; weeks start on Monday
+    if view == "day":
+        first, last = anchor, anchor + timedelta(days=1)
+        prev, nxt = anchor - timedelta(days=1), last
+    elif view == "week":
+        first = anchor - timedelta(days=anchor.weekday())
+        last = first + timedelta(days=7)
+        prev, nxt = first - timedelta(days=7), last
+    elif view == "month":
+        first = anchor.replace(day=1)
+        last = _add_months(first, 1)
+        prev, nxt = _add_months(first, -1), last
+    else:
+        raise ValueError(f"view must be one of {', '.join(VIEWS)}")
+    return datetime.combine(first, time.min), datetime.combine(last, time.min), prev, nxt
+
+
+def _add_months(value, months):
+    # Same day of month, clamped to the month's length (Jan 31 + 1 month = Feb 28/29)
+    y, m = divmod(value.month - 1 + months, 12)
+    y += value.year
+    return value.replace(year=y, month=m + 1, day=min(value.day, monthrange(y, m + 1)[1]))
+
+
+def _occurrence(event, start, end, index):
+    occ = dict(event)
+    occ["starttime"] = start
+    occ["endtime"] = end
+    occ["occurrence"] = index
+    return occ
+
+
+def occurrences(event, start, end):
+    # Occurrences of one event that overlap [start, end), in order. The first candidate is
+    # computed directly, so a long-running series costs only the occurrences in the window.
+    first_start, first_end = event["starttime"], event["endtime"]
+    length = first_end - first_start
+    rule = event.get("recurrence") or "none"
+    if rule == "none":
+        if first_start < end and first_end > start:
+            yield _occurrence(event, first_start, first_end, 0)
+        return
+    interval = max(int(event.get("recurinterval") or 1), 1)
+    until = event.get("recuruntil")
+    if rule == "monthly":
+        # Months between the series start and the window, backed off for long events
+        behind = (start.year - first_start.year) * 12 + start.month - first_start.month - 1 - length.days // 28
+        k = max(0, behind // interval)
+
+        def nth(i):
+            return _add_months(first_start, i * interval)
+    else:
+        step = timedelta(days=interval * (7 if rule == "weekly" else 1))
+        # First occurrence whose end is after `start`
+        k = max(0, (start - first_end) // step + 1)
+
+        def nth(i):
+            return first_start + i * step
+    while True:
+        occ_start = nth(k)
+        if occ_start >= end or (until is not None and occ_start > until):
+            return
+        if occ_start + length > start:
+            yield _occurrence(event, occ_start, occ_start + length, k)
+        k += 1
+
+
+def expand(events, start, end, limit=MAX_OCCURRENCES):
+    # Merge every event's occurrence stream in start order; nothing beyond the window (or the
+    # limit) is ever generated
+    streams = [occurrences(e, start, end) for e in events]
+    merged = heapq.merge(*streams, key=lambda o: (o["starttime"], o["eventid"]))
+    return list(itertools.islice(merged, limit))
+
+
+def find_conflicts(occs):
+    # Sweep line over start-ordered occurrences: a min-heap keyed on end time holds the ones
+    # still running, so each occurrence is compared only against those it actually overlaps.
+    # Returns [(earlier, later)] pairs and marks each occurrence with a `conflicts` count.
+    active = []
+    pairs = []
+    for occ in occs:
+        occ["conflicts"] = 0
+    for seq, occ in enumerate(sorted(occs, key=lambda o: (o["starttime"], o["endtime"]))):
+        while active and active[0][0] <= occ["starttime"]:
+            heapq.heappop(active)
+        for _, _, other in active:
+            pairs.append((other, occ))
+            other["conflicts"] += 1
+            occ["conflicts"] += 1
+        heapq.heappush(active, (occ["endtime"], seq, occ))
+    return pairs
+
+
+def parse_anchor(value):
+    return date.fromisoformat(value) if value else date.today()
@@ -0,0 +1,93 @@
+import threading
+from flask import g, has_request_context
+from db import DB
+
+
+def load_foods():
+    # Use allergens proc with lowercase keys; fallback and normalize if needed
+    try:
+        return DB.call_proc("sp_list_foods_with_allergens")
+    except Exception:
+        raw_foods = DB.call_proc("sp_list_foods")
+        return [{
+            "foodid": f.get("foodid") or f.get("foodID"),
+            "name": f.get("name") or f.get("Name"),
+            "calories": f.get("calories") or f.get("Calories"),
+            "proteins": f.get("proteins") or f.get("Proteins"),
+            "carbs": f.get("carbs") or f.get("Carbs"),
+            "fats": f.get("fats") or f.get("Fats")
+        } for f in (raw_foods or [])]
+
+
+class FoodCatalog:
+    # Process-wide copy of the food catalog keyed by catalog_version. Each read costs one
+    # primary-key lookup of the version, so a write in any worker process is picked up on
+    # that worker's next read; the catalog query itself only runs after a change.
+    # The returned list is shared between threads and must be treated as read-only.
+    _lock = threading.Lock()
+    _stats_lock = threading.Lock()
+    _version = None
+    _foods = None
+    _hits = 0
+    _misses = 0
+
+    @staticmethod
+    def current_version():
+        rows = DB.call_proc("sp_get_catalog_version")
+        return rows[0]["version"] if rows else 0
+
+    @classmethod
+    def snapshot(cls):
+        # (version, foods) for the current catalog, reloading only if the version moved
+        version = cls.current_version()
+        if cls._foods is not None and cls._version == version:
+            cls._count(hit=True)
+            return version, cls._foods
+        with cls._lock:
+            # Another thread may have reloaded this version while we waited
+            if cls._foods is not None and cls._version == version:
+                cls._count(hit=True)
+                return version, cls._foods
+            cls._count(hit=False)
+            foods = load_foods()
+            cls._foods, cls._version = foods, version
+            return version, foods
+
+    @classmethod
+    def request_snapshot(cls):
+        # snapshot(), taken once per request: the ETag, the allergen filter and the rendered
+        # rows then agree on one version, and the version is looked up once
+        if not has_request_context():
+            return cls.snapshot()
+        snap = g.get("catalog_snapshot")
+        if snap is None:
+            snap = g.catalog_snapshot = cls.snapshot()
+        return snap
+
+    @classmethod
+    def foods(cls):
+        return cls.snapshot()[1]
+
+    @classmethod
+    def invalidate(cls):
+        with cls._lock:
+            cls._foods = None
+            cls._version = None
+
+    @classmethod
+    def _count(cls, hit):
+        with cls._stats_lock:
+            if hit:
+                cls._hits += 1
+            else:
+                cls._misses += 1
+
+    @classmethod
+    def stats(cls):
+        with cls._stats_lock:
+            return {
+                "hits": cls._hits,
+                "misses": cls._misses,
+                "version": cls._version,
+                "size": len(cls._foods) if cls._foods is not None else 0,
+            }
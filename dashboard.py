@@ -0,0 +1,109 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from db import DB
+
+log = logging.getLogger(__name__)
+
+SECTION_TIMEOUT_MS = int(os.getenv("DASHBOARD_SECTION_TIMEOUT_MS", "1500"))
+
+
+class Section:
+    def __init__(self, name, loader, fallback=None, timeout_ms=None):
+        self.name = name
+        self.loader = loader
+        self.fallback = fallback
+        self.timeout_ms = timeout_ms if timeout_ms is not None else SECTION_TIMEOUT_MS
+
+
+_executor = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # Shared by all requests and sized below the DB pool, so concurrent dashboards can never
+    # ask for more connections than the pool has while leaving one for request threads.
+    # A section only goes to the executor after taking one of its slots, so work never waits
+    # in the executor's queue: with every worker busy the section runs in the request thread.
+    global _executor, _slots
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = int(os.getenv("DASHBOARD_WORKERS", str(max(1, DB.POOL_SIZE - 1))))
+                _slots = threading.BoundedSemaphore(workers)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dashboard")
+    return _executor
+
+
+def _timed(loader, started=None):
+    start = time.perf_counter()
+    if started is not None:
+        started.append(start)
+    try:
+        return loader(), None, (time.perf_counter() - start) * 1000
+    except Exception as e:
+        return None, e, (time.perf_counter() - start) * 1000
+
+
+def _release(_future):
+    _slots.release()
+
+
+def _record(values, timings, s, value, error, elapsed):
+    if error is None:
+        values[s.name] = value
+        timings.append((s.name, elapsed, "ok"))
+    else:
+        values[s.name] = s.fallback
+        timings.append((s.name, elapsed, "error"))
+        log.warning("dashboard section %s failed: %s", s.name, error)
+
+
+def load_sections(sections):
+    # Run the sections' loaders concurrently, on free executor workers and the rest inline in
+    # the request thread. Each section's budget counts from when its loader starts; a section
+    # that overruns or fails yields its fallback so the page still renders. A loader that
+    # overruns cannot be stopped: it finishes in the background and keeps its slot until then.
+    # Returns (values by name, [(name, elapsed_ms, status)]), status being ok/timeout/error.
+    executor = _get_executor()
+    pending = []
+    inline = []
+    for s in sections:
+        if not _slots.acquire(blocking=False):
+            inline.append(s)
+            continue
+        started = []
+        try:
+            # The loader runs in a copy of the caller's context so its queries count toward this request
+            future = executor.submit(contextvars.copy_context().run, _timed, s.loader, started)
+        except Exception:
+            _slots.release()
+            raise
+        future.add_done_callback(_release)
+        pending.append((s, future, started, time.perf_counter()))
+    values = {}
+    timings = []
+    for s in inline:
+        _record(values, timings, s, *_timed(s.loader))
+    for s, future, started, submitted in pending:
+        # A slot guarantees an idle worker, so `started` is set almost at once
+        begin = started[0] if started else submitted
+        remaining = s.timeout_ms / 1000 - (time.perf_counter() - begin)
+        try:
+            value, error, elapsed = future.result(timeout=max(remaining, 0))
+        except FutureTimeout:
+            values[s.name] = s.fallback
+            timings.append((s.name, (time.perf_counter() - begin) * 1000, "timeout"))
+            log.warning("dashboard section %s exceeded its %d ms budget", s.name, s.timeout_ms)
+            continue
+        _record(values, timings, s, value, error, elapsed)
+    return values, timings
+
+
+def server_timing(timings):
+    # Server-Timing header value, so slow panels show up in the browser's network tab
+    return ", ".join(f'{name};dur={ms:.1f};desc="{status}"' for name, ms, status in timings)
@@ -1,59 +1,641 @@
+import contextvars
 import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import timedelta
 from dotenv import load_dotenv
 import mysql.connector
-from mysql.connector import pooling
+from mysql.connector.errors import InterfaceError, OperationalError, PoolError
 
 load_dotenv()
 
+# Upper bounds (seconds) of the acquire wait-time histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class _Waiter:
+    __slots__ = ("event", "entry")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.entry = None
+
+
+class PooledConnection:
+    # Thin proxy over a MySQL connection; close() hands it back to the pool instead of closing it
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+
+    def __getattr__(self, name):
+        return getattr(self._entry["conn"], name)
+
+    def close(self):
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool.release(entry)
+
+
+class ConnectionPool:
+    # Blocking pool: up to `size` persistent connections plus `max_overflow` temporary ones.
+    # When all are busy, acquire() waits in a FIFO queue (a released connection is handed
+    # straight to the longest waiter) for up to `timeout` seconds before raising PoolTimeout.
+    # Connections older than `recycle` seconds are replaced, and ones idle for more than
+    # `ping_after` seconds are pinged on checkout so a server-side timeout never reaches a query.
+    def __init__(self, name, size, max_overflow=0, timeout=10.0, recycle=3600, ping_after=30, **connect_args):
+        self.name = name
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._connect_args = connect_args
+        self._lock = threading.Lock()
+        self._idle = deque()
+        self._waiters = deque()
+        self._opened = 0
+        self._in_use = 0
+        self._acquired_total = 0
+        self._exhausted_total = 0
+        self._created_total = 0
+        self._recycled_total = 0
+        self._wait_counts = [0] * (len(WAIT_BUCKETS) + 1)
+        self._wait_sum = 0.0
+
+    def _open(self):
+        conn = mysql.connector.connect(**self._connect_args)
+        now = time.monotonic()
+        with self._lock:
+            self._created_total += 1
+        return {"conn": conn, "created": now, "used": now}
+
+    def _discard(self, entry):
+        try:
+            entry["conn"].close()
+        except Exception:
+            pass
+
+    def _checkout(self, entry):
+        # Returns a usable entry, replacing the connection if it is too old or fails a ping
+        now = time.monotonic()
+        if entry is not None and self.recycle and now - entry["created"] > self.recycle:
+            self._discard(entry)
+            with self._lock:
+                self._recycled_total += 1
+            entry = None
+        elif entry is not None and now - entry["used"] > self.ping_after:
+            try:
+                entry["conn"].ping(reconnect=False)
+            except Exception:
+                self._discard(entry)
+                with self._lock:
+                    self._recycled_total += 1
+                entry = None
+        if entry is None:
+            entry = self._open()
+        return entry
+
+    def acquire(self):
+        start = time.monotonic()
+        waiter = None
+        with self._lock:
+            if self._idle and not self._waiters:
+                entry = self._idle.pop()
+            elif self._opened < self.size + self.max_overflow and not self._waiters:
+                self._opened += 1
+                entry = None
+            else:
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+        if waiter is not None:
+            got = waiter.event.wait(self.timeout)
+            with self._lock:
+                if not got and not waiter.event.is_set():
+                    self._waiters.remove(waiter)
+                    self._exhausted_total += 1
+                    raise PoolTimeout(f"Connection pool '{self.name}' exhausted: no connection within {self.timeout}s")
+            # A handed-over entry of None means a slot was freed and we may open our own
+            entry = waiter.entry
+        try:
+            entry = self._checkout(entry)
+        except Exception:
+            self._release_slot()
+            raise
+        waited = time.monotonic() - start
+        with self._lock:
+            self._in_use += 1
+            self._acquired_total += 1
+            self._wait_sum += waited
+            for i, bound in enumerate(WAIT_BUCKETS):
+                if waited <= bound:
+                    self._wait_counts[i] += 1
+                    break
+            else:
+                self._wait_counts[-1] += 1
+        return PooledConnection(self, entry)
+
+    def _release_slot(self):
+        # A slot whose connection is gone: let the next waiter open a fresh one, else shrink
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.entry = None
+                waiter.event.set()
+            else:
+                self._opened -= 1
+
+    def release(self, entry):
+        conn = entry["conn"]
+        healthy = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            healthy = False
+        entry["used"] = time.monotonic()
+        with self._lock:
+            self._in_use -= 1
+        if not healthy:
+            self._discard(entry)
+            self._release_slot()
+            return
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.entry = entry
+                waiter.event.set()
+                return
+            if self._opened <= self.size:
+                self._idle.append(entry)
+                return
+            self._opened -= 1
+        # Overflow connection with nobody waiting
+        self._discard(entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "opened": self._opened,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": len(self._waiters),
+                "acquired_total": self._acquired_total,
+                "exhausted_total": self._exhausted_total,
+                "created_total": self._created_total,
+                "recycled_total": self._recycled_total,
+                "wait_buckets": list(zip(WAIT_BUCKETS + (float("inf"),), self._wait_counts)),
+                "wait_sum": self._wait_sum,
+            }
+
+
+# Procedures that only read and may be served by a replica. Anything not listed here or in
+# PRIMARY_READ_PROCS is treated as a write.
+READ_ONLY_PROCS = frozenset({
+    "sp_list_users",
+    "sp_list_schedules",
+    "sp_list_schedules_by_user",
+    "sp_list_events_by_schedule",
+    "sp_list_events_in_window",
+    "sp_list_meals",
+    "sp_list_meals_with_items",
+    "sp_get_meal_detail",
+    "sp_recent_meals",
+    "sp_list_recent_meal_items_by_user",
+    "sp_list_meds",
+    "sp_get_med_logs",
+    "sp_med_adherence_logs",
+    "sp_recent_meds",
+    "sp_user_daily_macros",
+    "sp_user_macro_series",
+})
+
+# Reads whose result must be current (logins, and the catalog/data versions that caches and
+# ETags are keyed on, plus the catalog itself): always the primary, but not counted as writes
+PRIMARY_READ_PROCS = frozenset({
+    "sp_get_user_by_email",
+    "sp_get_user_data_version",
+    "sp_get_catalog_version",
+    "sp_list_foods",
+    "sp_list_foods_with_allergens",
+})
+
+# Until this time.time() the current context reads from the primary (read-your-writes)
+_primary_until = contextvars.ContextVar("wefit_primary_until", default=0.0)
+# (connection, is_replica) that this context's reads run on, inside DB.pinned_reads()
+_pinned = contextvars.ContextVar("wefit_pinned_reads", default=None)
+
+
+def _pool_settings(prefix, defaults=None):
+    # Pool and connection settings from MYSQL_* (or MYSQL_REPLICA_*, falling back to MYSQL_*)
+    defaults = defaults or {}
+
+    def env(name, default):
+        return os.getenv(prefix + name, defaults.get(name, default))
+
+    return dict(
+        size=int(env("POOL_SIZE", "5")),
+        max_overflow=int(env("POOL_MAX_OVERFLOW", "5")),
+        timeout=float(env("POOL_TIMEOUT", "10")),
+        recycle=float(env("POOL_RECYCLE", "3600")),
+        ping_after=float(env("POOL_PING_AFTER", "30")),
+        host=env("HOST", "localhost"),
+        port=int(env("PORT", "3306")),
+        user=env("USER", "wefit_user"),
+        password=env("PASSWORD", "wefit_pass"),
+        database=env("DATABASE", "wefit_db"),
+        autocommit=True,
+    )
+
+
 class DB:
+    POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "5"))
+    # Reads stay on the primary this long after the user's last write
+    READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+    # After a replica failure, reads go to the primary this long before the replica is retried
+    REPLICA_RETRY_SECONDS = float(os.getenv("MYSQL_REPLICA_RETRY", "30"))
     _pool = None
+    _replica = None
+    _replica_down_until = 0.0
+    _pool_lock = threading.Lock()
+    _query_hooks = []
+    _route_lock = threading.Lock()
+    _routes = {"replica": 0, "primary": 0, "fallback": 0}
 
     @classmethod
     def init_pool(cls):
-        if cls._pool is None:
-            cls._pool = pooling.MySQLConnectionPool(
-                pool_name="wefit_pool",
-                pool_size=5,
-                host=os.getenv("MYSQL_HOST", "localhost"),
-                port=int(os.getenv("MYSQL_PORT", "3306")),
-                user=os.getenv("MYSQL_USER", "wefit_user"),
-                password=os.getenv("MYSQL_PASSWORD", "wefit_pass"),
-                database=os.getenv("MYSQL_DATABASE", "wefit_db"),
-                autocommit=True,
-            )
+        with cls._pool_lock:
+            if cls._pool is None:
+                primary = _pool_settings("MYSQL_")
+                cls._pool = ConnectionPool("wefit_pool", **primary)
+                # A replica is optional; without MYSQL_REPLICA_HOST everything uses the primary
+                if os.getenv("MYSQL_REPLICA_HOST"):
+                    cls._replica = ConnectionPool("wefit_replica_pool", **_pool_settings(
+                        "MYSQL_REPLICA_", {k.upper(): str(v) for k, v in primary.items()}))
 
     @classmethod
     def get_conn(cls):
         if cls._pool is None:
             cls.init_pool()
-        return cls._pool.get_connection()
+        return cls._pool.acquire()
+
+    @classmethod
+    def route_reads_after(cls, written_at):
+        # Called at the start of each request with the time of the user's last write (from the
+        # session), so their reads follow their writes whichever worker serves them. Always
+        # overwrites: server threads are reused across requests.
+        _primary_until.set(written_at + cls.READ_YOUR_WRITES_SECONDS if written_at else 0.0)
+
+    @classmethod
+    def note_write(cls):
+        _primary_until.set(time.time() + cls.READ_YOUR_WRITES_SECONDS)
+
+    @classmethod
+    def _count_route(cls, route):
+        with cls._route_lock:
+            cls._routes[route] += 1
+
+    @classmethod
+    def _use_replica(cls):
+        if cls._pool is None:
+            cls.init_pool()
+        if cls._replica is not None and time.time() >= max(cls._replica_down_until, _primary_until.get()):
+            return cls._replica
+        return None
+
+    @classmethod
+    def _mark_replica_down(cls):
+        cls._replica_down_until = time.time() + cls.REPLICA_RETRY_SECONDS
+        cls._count_route("fallback")
+
+    @classmethod
+    def _read_conn(cls):
+        # A connection for a read that cannot be retried halfway (streams): the replica when
+        # routing allows and it hands out a connection, otherwise the primary
+        replica = cls._use_replica()
+        if replica is not None:
+            try:
+                conn = replica.acquire()
+                cls._count_route("replica")
+                return conn
+            except (InterfaceError, OperationalError, PoolError):
+                cls._mark_replica_down()
+        cls._count_route("primary")
+        return cls.get_conn()
+
+    @classmethod
+    @contextmanager
+    def pinned_reads(cls):
+        # Runs every read in the block on one connection (the replica's when routing allows),
+        # e.g. the sub-requests of an API batch. Primary-only reads share it only when it is a
+        # primary connection; writes are never pinned. The connection belongs to this thread.
+        conn = cls._read_conn()
+        token = _pinned.set((conn, conn._pool is cls._replica))
+        try:
+            yield
+        finally:
+            _pinned.reset(token)
+            conn.close()
+
+    @classmethod
+    def _read(cls, run):
+        # run(conn) on the replica when it is configured, healthy and this context has not
+        # written recently; a connection-level replica failure retries once on the primary
+        replica = cls._use_replica()
+        if replica is not None:
+            conn = None
+            try:
+                conn = replica.acquire()
+                result = run(conn)
+                cls._count_route("replica")
+                return result
+            except (InterfaceError, OperationalError, PoolError):
+                cls._mark_replica_down()
+            finally:
+                if conn is not None:
+                    conn.close()
+        cls._count_route("primary")
+        conn = cls.get_conn()
+        try:
+            return run(conn)
+        finally:
+            conn.close()
+
+    @classmethod
+    def route_stats(cls):
+        with cls._route_lock:
+            stats = dict(cls._routes)
+        stats["replica_configured"] = cls._replica is not None
+        stats["replica_down"] = time.time() < cls._replica_down_until
+        return stats
+
+    @classmethod
+    def add_query_hook(cls, hook):
+        # hook(name, args, seconds, rows, result_sets, error) runs after every call_proc/execute,
+        # including those made inside a transaction
+        cls._query_hooks.append(hook)
+
+    @classmethod
+    def pool_stats(cls):
+        return cls._pool.stats() if cls._pool is not None else None
+
+    @classmethod
+    def replica_pool_stats(cls):
+        return cls._replica.stats() if cls._replica is not None else None
 
     @staticmethod
     def call_proc(proc_name, args=()):
+        pinned = _pinned.get()
+        if pinned is not None and (proc_name in READ_ONLY_PROCS or
+                                   (proc_name in PRIMARY_READ_PROCS and not pinned[1])):
+            return _run_proc(pinned[0], proc_name, args)
+        if proc_name in READ_ONLY_PROCS:
+            return DB._read(lambda conn: _run_proc(conn, proc_name, args))
+        if proc_name not in PRIMARY_READ_PROCS:
+            DB.note_write()
         conn = DB.get_conn()
         try:
-            cur = conn.cursor(dictionary=True)
-            cur.callproc(proc_name, args)
-            # Collect result sets if any
-            results = []
-            for result in cur.stored_results():
-                results.extend(result.fetchall())
-            cur.close()
-            return results
+            return _run_proc(conn, proc_name, args)
         finally:
             conn.close()
 
     @staticmethod
     def execute(query, params=None):
+        pinned = _pinned.get()
+        if pinned is not None and _is_read_query(query):
+            return _run_query(pinned[0], query, params)
+        if _is_read_query(query):
+            return DB._read(lambda conn: _run_query(conn, query, params))
+        DB.note_write()
         conn = DB.get_conn()
         try:
-            cur = conn.cursor(dictionary=True)
+            return _run_query(conn, query, params)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def stream(query, params=None, batch_size=500):
+        # Server-side (unbuffered) cursor: rows are pulled from MySQL batch_size at a time, so
+        # memory stays flat however large the result. Holds one connection until the generator
+        # is exhausted or closed. Runs on the replica when one is configured.
+        conn = DB._read_conn()
+        start = time.perf_counter()
+        rows = 0
+        error = None
+        cur = conn.cursor(dictionary=True, buffered=False)
+        try:
             cur.execute(query, params or ())
-            if cur.with_rows:
-                rows = cur.fetchall()
-            else:
-                rows = []
-            cur.close()
-            return rows
+            while True:
+                batch = cur.fetchmany(batch_size)
+                if not batch:
+                    break
+                rows += len(batch)
+                yield from batch
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            try:
+                # Drain anything left unread (consumer stopped early) so the connection is reusable
+                conn.consume_results()
+                cur.close()
+            finally:
+                conn.close()
+                _observe(_statement_label(query), params, start, rows, 1, error)
+
+    @classmethod
+    @contextmanager
+    def transaction(cls):
+        # Unit of work on a single pooled connection: commits when the block exits cleanly,
+        # rolls back if it raises. Usage: with DB.transaction() as tx: tx.call_proc(...)
+        cls.note_write()
+        conn = cls.get_conn()
+        try:
+            conn.start_transaction()
+            yield Transaction(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
         finally:
             conn.close()
+
+    @classmethod
+    def rebuild_daily_summary(cls, date_from, date_to, batch_days=7):
+        # One transaction per batch_days days, so a long range never holds one huge transaction
+        for start, end in _day_batches(date_from, date_to, batch_days):
+            with cls.transaction() as tx:
+                tx.call_proc("sp_rebuild_daily_summary", (start, end))
+
+    @classmethod
+    @contextmanager
+    def bulk_load(cls):
+        # Dedicated, unpooled primary connection with @wefit_bulk_load set, which switches off
+        # the per-row bookkeeping triggers. The variable dies with the connection, so it can
+        # never leak into the pool. Callers finish with tx.finish(first_day, last_day).
+        if cls._pool is None:
+            cls.init_pool()
+        conn = mysql.connector.connect(**cls._pool._connect_args)
+        try:
+            _run_query(conn, "SET @wefit_bulk_load = 1")
+            yield BulkLoad(conn)
+        finally:
+            conn.close()
+
+
+class Transaction:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def call_proc(self, proc_name, args=()):
+        return _run_proc(self._conn, proc_name, args)
+
+    def execute(self, query, params=None):
+        return _run_query(self._conn, query, params)
+
+    def last_insert_id(self):
+        # Session-scoped, so it is the id generated on this connection (even inside a procedure)
+        return self.execute("SELECT LAST_INSERT_ID() AS id")[0]["id"]
+
+    def insert_rows(self, table, id_column, columns, rows, key):
+        # Multi-row INSERT returning each row's generated id, in order. With the default
+        # innodb_autoinc_lock_mode=2 concurrent inserts may interleave ids, so they are read
+        # back by `key` (columns that identify a new row) among ids >= the first one generated
+        # here. Rows whose key repeats within `rows` are inserted one at a time instead.
+        at = [columns.index(k) for k in key]
+        keys = [tuple(row[i] for i in at) for row in rows]
+        repeats = Counter(keys)
+        batch = [n for n, k in enumerate(keys) if repeats[k] == 1]
+        ids = [None] * len(rows)
+        if batch:
+            self.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES " + _placeholders(len(batch), len(columns)),
+                         [v for n in batch for v in rows[n]])
+            found = {}
+            for r in self.execute(
+                    f"SELECT {id_column} AS id, {', '.join(key)} FROM {table} WHERE {id_column} >= %s "
+                    f"AND ({', '.join(key)}) IN ({_placeholders(len(batch), len(key))})",
+                    [self.last_insert_id()] + [v for n in batch for v in keys[n]]):
+                k = tuple(r[c] for c in key)
+                if k in found:
+                    raise mysql.connector.DatabaseError(msg=f"{table} key {k} matched more than one new row")
+                found[k] = r["id"]
+            for n in batch:
+                if keys[n] not in found:
+                    raise mysql.connector.DatabaseError(msg=f"{table} key {keys[n]} not found after insert")
+                ids[n] = found[keys[n]]
+        for n in (n for n, k in enumerate(keys) if repeats[k] > 1):
+            self.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES " + _placeholders(1, len(columns)),
+                         list(rows[n]))
+            ids[n] = self.last_insert_id()
+        return ids
+
+
+class BulkLoad(Transaction):
+    @contextmanager
+    def chunk(self):
+        # One transaction per chunk of multi-row inserts
+        self._conn.start_transaction()
+        try:
+            yield self
+            self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            raise
+
+    def finish(self, date_from, date_to, batch_days=31):
+        # Derived data for the loaded rows, then the daily rollup a transaction per batch, then
+        # new data versions once everything is in place
+        with self.chunk():
+            self.call_proc("sp_finish_bulk_load", (date_from, date_to))
+        for start, end in _day_batches(date_from, date_to, batch_days):
+            with self.chunk():
+                self.call_proc("sp_rebuild_daily_summary", (start, end))
+        self.call_proc("sp_bump_data_versions")
+
+
+def _observe(name, args, start, rows, result_sets, error=None):
+    if DB._query_hooks:
+        elapsed = time.perf_counter() - start
+        for hook in DB._query_hooks:
+            hook(name, args, elapsed, rows, result_sets, error)
+
+
+def _day_batches(date_from, date_to, days):
+    # Inclusive (start, end) date ranges of at most `days` days covering date_from..date_to
+    while date_from <= date_to:
+        end = min(date_from + timedelta(days=days - 1), date_to)
+        yield date_from, end
+        date_from = end + timedelta(days=1)
+
+
+def _placeholders(n, width):
+    row = "(" + ",".join(["%s"] * width) + ")"
+    return ",".join([row] * n)
+
+
+def _is_read_query(query):
+    q = " ".join(query.split()).upper()
+    return q.startswith("SELECT ") and " FOR UPDATE" not in q and " FOR SHARE" not in q
+
+
+def _statement_label(query):
+    # Parameterized SQL is already low-cardinality; collapse whitespace and cap the length
+    return " ".join(query.split())[:80]
+
+
+def _run_proc(conn, proc_name, args=()):
+    start = time.perf_counter()
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.callproc(proc_name, args)
+        # Collect result sets if any
+        results = []
+        result_sets = 0
+        for result in cur.stored_results():
+            results.extend(result.fetchall())
+            result_sets += 1
+    except Exception as e:
+        _observe(proc_name, args, start, 0, 0, e)
+        raise
+    finally:
+        cur.close()
+    _observe(proc_name, args, start, len(results), result_sets)
+    return results
+
+
+def _run_query(conn, query, params=None):
+    start = time.perf_counter()
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute(query, params or ())
+        result_sets = 1 if cur.with_rows else 0
+        rows = cur.fetchall() if result_sets else []
+    except Exception as e:
+        _observe(_statement_label(query), params, start, 0, 0, e)
+        raise
+    finally:
+        cur.close()
+    _observe(_statement_label(query), params, start, len(rows), result_sets)
+    return rows
+
+def group_meal_rows(rows):
+    # Stored procedures that return meal headers followed by their item rows come back
+    # flattened; item rows are the ones carrying 'foodname'. Build header -> items in one pass.
+    meals = {}
+    for r in rows or []:
+        mlid = r.get("meallogid")
+        entry = meals.get(mlid)
+        if entry is None:
+            entry = meals[mlid] = {"header": None, "items": []}
+        if "foodname" in r:
+            entry["items"].append(r)
+        else:
+            entry["header"] = r
+    return {mlid: det for mlid, det in meals.items() if det["header"] is not None}
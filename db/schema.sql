@@ -19,6 +19,8 @@ CREATE TABLE schedule (
   scheduleid INT AUTO_INCREMENT PRIMARY KEY,
   schedulename VARCHAR(100) NOT NULL,
   userid INT NOT NULL,
+  -- Longest event ever stored in this schedule (only grows); bounds calendar window scans
+  maxeventminutes INT NOT NULL DEFAULT 0,
   CONSTRAINT fk_schedule_user FOREIGN KEY (userid)
     REFERENCES user(userid)
     ON UPDATE CASCADE
@@ -41,7 +43,12 @@ CREATE TABLE schedule_events (
   endtime DATETIME NOT NULL,
   description TEXT NULL,
   duration INT GENERATED ALWAYS AS (TIMESTAMPDIFF(MINUTE, starttime, endtime)) STORED,
+  -- Recurring events store their first occurrence; later ones are expanded on read
+  recurrence ENUM('none','daily','weekly','monthly') NOT NULL DEFAULT 'none',
+  recurinterval INT NOT NULL DEFAULT 1,
+  recuruntil DATETIME NULL,
   CONSTRAINT chk_event_time CHECK (endtime > starttime),
+  CONSTRAINT chk_event_interval CHECK (recurinterval > 0),
   CONSTRAINT fk_event_schedule FOREIGN KEY (scheduleid)
     REFERENCES schedule(scheduleid)
     ON UPDATE CASCADE
@@ -73,12 +80,38 @@ CREATE TABLE food_allergens (
   PRIMARY KEY (foodid, allergenname)
 );
 
+-- Food catalog version, bumped by triggers whenever foods or allergens change.
+-- App workers compare it against their cached catalog to decide when to reload.
+CREATE TABLE catalog_version (
+  id TINYINT PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 0
+);
+
+-- Per-user data version, bumped by triggers on every write to a user's meals, medications,
+-- schedules or events. Pages derive their ETags from it.
+CREATE TABLE user_data_version (
+  userid INT PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 0,
+  CONSTRAINT fk_data_version_user FOREIGN KEY (userid)
+    REFERENCES user(userid)
+    ON UPDATE CASCADE
+    ON DELETE CASCADE
+) ENGINE=InnoDB;
+
 -- Meal Log
 CREATE TABLE meal_log (
   meallogid INT AUTO_INCREMENT PRIMARY KEY,
   userid INT NOT NULL,
   mealtype ENUM('breakfast','lunch','dinner','snack') NOT NULL,
   logtime DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  -- Materialized per-meal macro totals, maintained by the meal_items/food_items triggers
+  totalcalories DECIMAL(12,4) NOT NULL DEFAULT 0,
+  totalproteins DECIMAL(12,4) NOT NULL DEFAULT 0,
+  totalcarbs DECIMAL(12,4) NOT NULL DEFAULT 0,
+  totalfats DECIMAL(12,4) NOT NULL DEFAULT 0,
+  -- Client/queue idempotency key; a replayed write with the same key is a no-op
+  idemkey VARCHAR(64) NULL,
+  CONSTRAINT uq_meal_idemkey UNIQUE (idemkey),
   CONSTRAINT fk_meal_user FOREIGN KEY (userid)
     REFERENCES user(userid)
     ON UPDATE CASCADE
@@ -108,6 +141,11 @@ CREATE TABLE medication (
   medname VARCHAR(150) NOT NULL,
   dosage VARCHAR(100) NOT NULL,
   frequency VARCHAR(100) NOT NULL,
+  -- Tracking start for adherence; moved back if older doses are logged
+  createdat DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  -- Dose counters maintained by the medication_log triggers
+  dosestaken INT NOT NULL DEFAULT 0,
+  dosesskipped INT NOT NULL DEFAULT 0,
   CONSTRAINT fk_med_user FOREIGN KEY (userid)
     REFERENCES user(userid)
     ON UPDATE CASCADE
@@ -120,19 +158,46 @@ CREATE TABLE medication_log (
   medicationid INT NOT NULL,
   takentime DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
   isskipped BOOLEAN NOT NULL DEFAULT FALSE,
+  idemkey VARCHAR(64) NULL,
+  CONSTRAINT uq_medlog_idemkey UNIQUE (idemkey),
   CONSTRAINT fk_medlog_med FOREIGN KEY (medicationid)
     REFERENCES medication(medicationid)
     ON UPDATE CASCADE
     ON DELETE CASCADE
 );
 
+-- Daily nutrition rollups per user, maintained incrementally by the meal_log triggers
+CREATE TABLE user_daily_summary (
+  summaryid INT AUTO_INCREMENT PRIMARY KEY,
+  userid INT NOT NULL,
+  summarydate DATE NOT NULL,
+  totalcalories DECIMAL(14,4) NOT NULL DEFAULT 0,
+  totalproteins DECIMAL(14,4) NOT NULL DEFAULT 0,
+  totalcarbs DECIMAL(14,4) NOT NULL DEFAULT 0,
+  totalfats DECIMAL(14,4) NOT NULL DEFAULT 0,
+  -- Bumped on every change to the day's meals; the analytics cache fingerprints ranges with it
+  revision INT UNSIGNED NOT NULL DEFAULT 0,
+  createdat TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT fk_summary_user FOREIGN KEY (userid)
+    REFERENCES user(userid)
+    ON UPDATE CASCADE
+    ON DELETE CASCADE,
+  CONSTRAINT uq_user_date UNIQUE(userid, summarydate)
+) ENGINE=InnoDB;
+
 -- Indexes for performance
 CREATE INDEX idx_schedule_user ON schedule(userid);
-CREATE INDEX idx_event_schedule ON schedule_events(scheduleid);
+CREATE INDEX idx_event_schedule_time ON schedule_events(scheduleid, starttime);
+CREATE INDEX idx_event_recurring ON schedule_events(scheduleid, recurrence);
 CREATE INDEX idx_meal_user_time ON meal_log(userid, logtime);
+CREATE INDEX idx_meal_time ON meal_log(logtime);
+CREATE INDEX idx_summary_date ON user_daily_summary(summarydate);
 CREATE INDEX idx_med_user ON medication(userid);
+CREATE INDEX idx_medlog_med_time ON medication_log(medicationid, takentime);
 
 -- Sample Data
+INSERT INTO catalog_version (id, version) VALUES (1, 0);
+
 INSERT INTO user (firstname, lastname, emailid, passwordhash) VALUES
 ('Priyan','Baskar','priyan@example.com','hash123'),
 ('Satyaa','Guruswamy','satyaa@example.com','hash456');
@@ -259,6 +324,12 @@ BEGIN
   WHERE emailid = p_email;
 END $$
 
+-- Rehash on login when the stored hash uses outdated parameters
+CREATE PROCEDURE sp_update_password_hash(IN p_userID INT, IN p_passwordHash VARCHAR(255))
+BEGIN
+  UPDATE user SET passwordhash = p_passwordHash WHERE userid = p_userID;
+END $$
+
 -- Schedule Procedures
 CREATE PROCEDURE sp_create_schedule(IN p_userID INT, IN p_name VARCHAR(100))
 BEGIN
@@ -296,14 +367,54 @@ BEGIN
   ORDER BY s.scheduleid DESC;
 END $$
 
+-- Events of a user's schedules (one schedule, or all when p_scheduleID is NULL) that overlap
+-- [p_from, p_to). One-off events are a range on idx_event_schedule_time: an event ending
+-- after p_from cannot start earlier than p_from minus the schedule's longest event.
+-- Recurring series come back once each, for the caller to expand.
+CREATE PROCEDURE sp_list_events_in_window(IN p_userID INT, IN p_scheduleID INT, IN p_from DATETIME, IN p_to DATETIME)
+BEGIN
+  SELECT e.eventid AS eventid, e.scheduleid AS scheduleid, s.schedulename AS schedulename, e.categoryid AS categoryid,
+         e.eventtitle AS eventtitle, e.starttime AS starttime, e.endtime AS endtime, e.duration AS duration,
+         e.description AS description, e.recurrence AS recurrence, e.recurinterval AS recurinterval,
+         e.recuruntil AS recuruntil
+  FROM schedule s
+  JOIN schedule_events e ON e.scheduleid = s.scheduleid
+  WHERE s.userid = p_userID
+    AND (p_scheduleID IS NULL OR s.scheduleid = p_scheduleID)
+    AND e.recurrence = 'none'
+    AND e.starttime >= DATE_SUB(p_from, INTERVAL s.maxeventminutes MINUTE)
+    AND e.starttime < p_to
+    AND e.endtime > p_from
+  UNION ALL
+  SELECT e.eventid, e.scheduleid, s.schedulename, e.categoryid,
+         e.eventtitle, e.starttime, e.endtime, e.duration,
+         e.description, e.recurrence, e.recurinterval,
+         e.recuruntil
+  FROM schedule s
+  JOIN schedule_events e ON e.scheduleid = s.scheduleid
+  WHERE s.userid = p_userID
+    AND (p_scheduleID IS NULL OR s.scheduleid = p_scheduleID)
+    AND e.recurrence <> 'none'
+    AND e.starttime < p_to
+    AND (e.recuruntil IS NULL OR DATE_ADD(e.recuruntil, INTERVAL e.duration MINUTE) > p_from)
+  ORDER BY starttime, eventid;
+END $$
+
 -- Event Procedures
 CREATE PROCEDURE sp_create_event(
-  IN p_scheduleID INT, IN p_categoryID INT, IN p_title VARCHAR(150), IN p_start DATETIME, IN p_end DATETIME, IN p_desc TEXT
+  IN p_scheduleID INT, IN p_categoryID INT, IN p_title VARCHAR(150), IN p_start DATETIME, IN p_end DATETIME, IN p_desc TEXT,
+  IN p_recurrence VARCHAR(10), IN p_interval INT, IN p_until DATETIME
 )
 BEGIN
   IF p_end <= p_start THEN SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT='endTime must be greater than startTime'; END IF;
-  INSERT INTO schedule_events(scheduleid, categoryid, eventtitle, starttime, endtime, description)
-  VALUES(p_scheduleID, p_categoryID, p_title, p_start, p_end, p_desc);
+  IF p_until IS NOT NULL AND p_until < p_start THEN
+    SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT='Repeat-until must not be before startTime';
+  END IF;
+  INSERT INTO schedule_events(scheduleid, categoryid, eventtitle, starttime, endtime, description,
+                              recurrence, recurinterval, recuruntil)
+  VALUES(p_scheduleID, p_categoryID, p_title, p_start, p_end, p_desc,
+         COALESCE(NULLIF(p_recurrence, ''), 'none'), GREATEST(COALESCE(p_interval, 1), 1),
+         IF(COALESCE(NULLIF(p_recurrence, ''), 'none') = 'none', NULL, p_until));
 END $$
 
 CREATE PROCEDURE sp_update_event(
@@ -334,6 +445,18 @@ BEGIN
   INSERT INTO meal_items(meallogid, foodid, quantityingram) VALUES(p_mealLogID, p_foodID, p_qty);
 END $$
  
+-- Add several items to a meal in one multi-row insert.
+-- p_items: JSON array of {"foodid": INT, "qty": INT}
+CREATE PROCEDURE sp_add_meal_items(IN p_mealLogID INT, IN p_items JSON)
+BEGIN
+  INSERT INTO meal_items(meallogid, foodid, quantityingram)
+  SELECT p_mealLogID, J.foodid, J.qty
+  FROM JSON_TABLE(p_items, '$[*]' COLUMNS (
+    foodid INT PATH '$.foodid' ERROR ON EMPTY,
+    qty INT PATH '$.qty' ERROR ON EMPTY
+  )) J;
+END $$
+
 -- Update meal header (type/time)
 CREATE PROCEDURE sp_update_meal(IN p_mealLogID INT, IN p_type VARCHAR(30), IN p_time DATETIME)
 BEGIN
@@ -354,17 +477,52 @@ END $$
 CREATE PROCEDURE sp_list_meals(IN p_userID INT)
 BEGIN
   SELECT ML.meallogid AS meallogid, ML.mealtype AS mealtype, ML.logtime AS logtime,
-         fn_total_meal_calories(ML.meallogid) AS totalcalories
+         ROUND(ML.totalcalories) AS totalcalories
   FROM meal_log ML
   WHERE ML.userid = p_userID
   ORDER BY ML.logtime DESC;
 END $$
 
+-- Meal history page for a user: headers plus all of their items in two result sets.
+-- Keyset pagination over (logtime, meallogid) so each page is a range scan on idx_meal_user_time.
+CREATE PROCEDURE sp_list_meals_with_items(IN p_userID INT, IN p_beforeTime DATETIME, IN p_beforeID INT, IN p_limit INT)
+BEGIN
+  IF p_limit IS NULL OR p_limit <= 0 THEN
+    SET p_limit = 20;
+  END IF;
+  SELECT ML.meallogid AS meallogid, ML.userid AS userid, ML.mealtype AS mealtype, ML.logtime AS logtime,
+         ROUND(ML.totalcalories) AS totalcalories
+  FROM meal_log ML
+  WHERE ML.userid = p_userID
+    AND (p_beforeTime IS NULL
+         OR ML.logtime < p_beforeTime
+         OR (ML.logtime = p_beforeTime AND ML.meallogid < p_beforeID))
+  ORDER BY ML.logtime DESC, ML.meallogid DESC
+  LIMIT p_limit;
+
+  SELECT MI.meallogid AS meallogid, MI.foodid AS foodid, F.name AS foodname, MI.quantityingram AS quantityingram,
+         F.calories AS calories, F.proteins AS proteins, F.carbs AS carbs, F.fats AS fats
+  FROM (
+    SELECT ML.meallogid, ML.logtime
+    FROM meal_log ML
+    WHERE ML.userid = p_userID
+      AND (p_beforeTime IS NULL
+           OR ML.logtime < p_beforeTime
+           OR (ML.logtime = p_beforeTime AND ML.meallogid < p_beforeID))
+    ORDER BY ML.logtime DESC, ML.meallogid DESC
+    LIMIT p_limit
+  ) PG
+  JOIN meal_items MI ON MI.meallogid = PG.meallogid
+  JOIN food_items F ON F.foodid = MI.foodid
+  ORDER BY PG.logtime DESC, PG.meallogid DESC, MI.foodid;
+END $$
+
 -- Meal detail with items
 CREATE PROCEDURE sp_get_meal_detail(IN p_mealLogID INT)
 BEGIN
   SELECT ML.meallogid AS meallogid, ML.userid AS userid, ML.mealtype AS mealtype, ML.logtime AS logtime,
-    fn_total_meal_calories(ML.meallogid) AS totalcalories
+    ROUND(ML.totalcalories) AS totalcalories, ROUND(ML.totalproteins, 2) AS totalproteins,
+    ROUND(ML.totalcarbs, 2) AS totalcarbs, ROUND(ML.totalfats, 2) AS totalfats
   FROM meal_log ML
   WHERE ML.meallogid = p_mealLogID;
 
@@ -395,7 +553,7 @@ BEGIN
   END IF;
   -- Header rows: recent meals with total calories
     SELECT ML.meallogid AS meallogid, ML.userid AS userid, ML.mealtype AS mealtype, ML.logtime AS logtime,
-      fn_total_meal_calories(ML.meallogid) AS totalcalories
+      ROUND(ML.totalcalories) AS totalcalories
   FROM meal_log ML
   WHERE ML.userid = p_userID
   ORDER BY ML.logtime DESC
@@ -434,6 +592,15 @@ BEGIN
   INSERT INTO food_allergens(foodid, allergenname) VALUES(p_foodID, p_allergen);
 END $$
 
+-- Add several allergen labels to a food in one statement. p_allergens: JSON array of strings
+CREATE PROCEDURE sp_add_allergens(IN p_foodID INT, IN p_allergens JSON)
+BEGIN
+  INSERT INTO food_allergens(foodid, allergenname)
+  SELECT DISTINCT p_foodID, J.allergen
+  FROM JSON_TABLE(p_allergens, '$[*]' COLUMNS (allergen VARCHAR(100) PATH '$')) J
+  WHERE J.allergen IS NOT NULL AND J.allergen <> '';
+END $$
+
 -- List foods
 CREATE PROCEDURE sp_list_foods()
 BEGIN
@@ -453,6 +620,24 @@ BEGIN
   ORDER BY F.name;
 END $$
 
+-- Current food catalog version (single-row primary key lookup)
+CREATE PROCEDURE sp_get_catalog_version()
+BEGIN
+  SELECT version AS version FROM catalog_version WHERE id = 1;
+END $$
+
+CREATE PROCEDURE sp_get_user_data_version(IN p_userID INT)
+BEGIN
+  SELECT COALESCE((SELECT version FROM user_data_version WHERE userid = p_userID), 0) AS version;
+END $$
+
+-- Called from the data-version triggers
+CREATE PROCEDURE sp_bump_user_data_version(IN p_userID INT)
+BEGIN
+  INSERT INTO user_data_version(userid, version) VALUES(p_userID, 1)
+  ON DUPLICATE KEY UPDATE version = version + 1;
+END $$
+
 -- Medication Procedures
 CREATE PROCEDURE sp_create_med(IN p_userID INT, IN p_name VARCHAR(150), IN p_dosage VARCHAR(100), IN p_freq VARCHAR(100))
 BEGIN
@@ -464,25 +649,140 @@ BEGIN
   INSERT INTO medication_log(medicationid, takentime, isskipped) VALUES(p_medicationID, COALESCE(p_takenTime, CURRENT_TIMESTAMP), COALESCE(p_isSkipped, FALSE));
 END $$
 
+-- Batched, idempotent medication logging (ingest.py). p_entries: JSON array of
+-- {"idemkey", "userid", "medicationid", "takentime", "isskipped"}. Entries whose medication
+-- does not exist or belongs to someone else are returned and not inserted; keys already
+-- present are skipped. Owned entries are resolved into a temporary table first: the
+-- medication_log insert trigger updates medication, and MySQL refuses (error 1442) a trigger
+-- that updates a table its invoking statement reads.
+CREATE PROCEDURE sp_ingest_med_logs(IN p_entries JSON)
+BEGIN
+  SELECT J.idemkey AS idemkey
+  FROM JSON_TABLE(p_entries, '$[*]' COLUMNS (
+    idemkey VARCHAR(64) PATH '$.idemkey',
+    userid INT PATH '$.userid',
+    medicationid INT PATH '$.medicationid'
+  )) J
+  LEFT JOIN medication M ON M.medicationid = J.medicationid AND M.userid = J.userid
+  WHERE M.medicationid IS NULL;
+
+  DROP TEMPORARY TABLE IF EXISTS ingest_med_logs;
+  CREATE TEMPORARY TABLE ingest_med_logs (
+    idemkey VARCHAR(64) PRIMARY KEY,
+    medicationid INT NOT NULL,
+    takentime DATETIME NOT NULL,
+    isskipped TINYINT NOT NULL
+  );
+  INSERT INTO ingest_med_logs(idemkey, medicationid, takentime, isskipped)
+  SELECT J.idemkey, M.medicationid, J.takentime, J.isskipped
+  FROM JSON_TABLE(p_entries, '$[*]' COLUMNS (
+    idemkey VARCHAR(64) PATH '$.idemkey' ERROR ON EMPTY,
+    userid INT PATH '$.userid' ERROR ON EMPTY,
+    medicationid INT PATH '$.medicationid' ERROR ON EMPTY,
+    takentime DATETIME PATH '$.takentime' ERROR ON EMPTY,
+    isskipped TINYINT PATH '$.isskipped' DEFAULT '0' ON EMPTY
+  )) J
+  JOIN medication M ON M.medicationid = J.medicationid AND M.userid = J.userid;
+
+  INSERT INTO medication_log(medicationid, takentime, isskipped, idemkey)
+  SELECT T.medicationid, T.takentime, T.isskipped, T.idemkey
+  FROM ingest_med_logs T
+  ON DUPLICATE KEY UPDATE idemkey = medication_log.idemkey;
+
+  DROP TEMPORARY TABLE IF EXISTS ingest_med_logs;
+END $$
+
+-- Batched, idempotent meal logging (ingest.py). p_entries: JSON array of {"idemkey", "userid",
+-- "mealtype", "logtime", "items": [{"foodid", "qty"}]}. Meals whose key already exists were
+-- committed together with their items by an earlier call and are skipped. The new meal ids
+-- are copied into the temporary table before the items go in, because the meal_items insert
+-- trigger updates meal_log and so that insert must not read meal_log (error 1442).
+CREATE PROCEDURE sp_ingest_meals(IN p_entries JSON)
+BEGIN
+  DROP TEMPORARY TABLE IF EXISTS ingest_new_meals;
+  CREATE TEMPORARY TABLE ingest_new_meals (idemkey VARCHAR(64) PRIMARY KEY, meallogid INT NULL);
+  INSERT INTO ingest_new_meals(idemkey)
+  SELECT J.idemkey
+  FROM JSON_TABLE(p_entries, '$[*]' COLUMNS (idemkey VARCHAR(64) PATH '$.idemkey' ERROR ON EMPTY)) J
+  WHERE NOT EXISTS (SELECT 1 FROM meal_log ML WHERE ML.idemkey = J.idemkey);
+
+  INSERT INTO meal_log(userid, mealtype, logtime, idemkey)
+  SELECT J.userid, J.mealtype, J.logtime, J.idemkey
+  FROM JSON_TABLE(p_entries, '$[*]' COLUMNS (
+    idemkey VARCHAR(64) PATH '$.idemkey' ERROR ON EMPTY,
+    userid INT PATH '$.userid' ERROR ON EMPTY,
+    mealtype VARCHAR(20) PATH '$.mealtype' ERROR ON EMPTY,
+    logtime DATETIME PATH '$.logtime' ERROR ON EMPTY
+  )) J
+  JOIN ingest_new_meals N ON N.idemkey = J.idemkey;
+
+  UPDATE ingest_new_meals N
+  JOIN meal_log ML ON ML.idemkey = N.idemkey
+  SET N.meallogid = ML.meallogid;
+
+  INSERT INTO meal_items(meallogid, foodid, quantityingram)
+  SELECT N.meallogid, J.foodid, J.qty
+  FROM JSON_TABLE(p_entries, '$[*]' COLUMNS (
+    idemkey VARCHAR(64) PATH '$.idemkey',
+    NESTED PATH '$.items[*]' COLUMNS (
+      foodid INT PATH '$.foodid',
+      qty INT PATH '$.qty'
+    )
+  )) J
+  JOIN ingest_new_meals N ON N.idemkey = J.idemkey
+  WHERE J.foodid IS NOT NULL AND N.meallogid IS NOT NULL;
+
+  DROP TEMPORARY TABLE IF EXISTS ingest_new_meals;
+END $$
+
 CREATE PROCEDURE sp_list_meds(IN p_userID INT)
 BEGIN
   SELECT m.medicationid AS medicationid, m.medname AS medname, m.dosage AS dosage, m.frequency AS frequency,
-         (SELECT COUNT(*) FROM medication_log ml WHERE ml.medicationid = m.medicationid AND ml.isskipped = 0) AS dosestaken,
-         (SELECT COUNT(*) FROM medication_log ml WHERE ml.medicationid = m.medicationid AND ml.isskipped = 1) AS dosesskipped
+         m.dosestaken AS dosestaken, m.dosesskipped AS dosesskipped
   FROM medication m WHERE m.userid = p_userID;
 END $$
 
--- Medication logs for a medication
-CREATE PROCEDURE sp_get_med_logs(IN p_medicationID INT)
+-- One page of a medication's logs, newest first, keyset-paginated on (takentime, medlogid)
+-- and optionally limited to [p_from, p_to); every branch is a range on idx_medlog_med_time
+CREATE PROCEDURE sp_get_med_logs(IN p_medicationID INT, IN p_from DATETIME, IN p_to DATETIME,
+                                 IN p_beforeTime DATETIME, IN p_beforeID INT, IN p_limit INT)
 BEGIN
-  SELECT m.medicationid AS medicationid, m.userid AS userid, m.medname AS medname, m.dosage AS dosage, m.frequency AS frequency
+  IF p_limit IS NULL OR p_limit <= 0 THEN
+    SET p_limit = 50;
+  END IF;
+  SELECT m.medicationid AS medicationid, m.userid AS userid, m.medname AS medname, m.dosage AS dosage, m.frequency AS frequency,
+         m.createdat AS createdat, m.dosestaken AS dosestaken, m.dosesskipped AS dosesskipped
   FROM medication m
   WHERE m.medicationid = p_medicationID;
 
   SELECT medlogid AS medlogid, takentime AS takentime, isskipped AS isskipped
   FROM medication_log
   WHERE medicationid = p_medicationID
-  ORDER BY takentime DESC;
+    AND (p_from IS NULL OR takentime >= p_from)
+    AND (p_to IS NULL OR takentime < p_to)
+    AND (p_beforeTime IS NULL
+         OR takentime < p_beforeTime
+         OR (takentime = p_beforeTime AND medlogid < p_beforeID))
+  ORDER BY takentime DESC, medlogid DESC
+  LIMIT p_limit;
+END $$
+
+-- Everything the adherence calculator needs for one user in a single call: the medications
+-- (result set 1) and their logs in [p_from, p_to) (result set 2), read per medication on
+-- idx_medlog_med_time
+CREATE PROCEDURE sp_med_adherence_logs(IN p_userID INT, IN p_from DATETIME, IN p_to DATETIME)
+BEGIN
+  SELECT m.medicationid AS medicationid, m.medname AS medname, m.dosage AS dosage, m.frequency AS frequency,
+         m.createdat AS createdat
+  FROM medication m
+  WHERE m.userid = p_userID
+  ORDER BY m.medicationid;
+
+  SELECT ml.medicationid AS medicationid, ml.takentime AS takentime, ml.isskipped AS isskipped
+  FROM medication m
+  JOIN medication_log ml ON ml.medicationid = m.medicationid
+  WHERE m.userid = p_userID AND ml.takentime >= p_from AND ml.takentime < p_to
+  ORDER BY ml.medicationid, ml.takentime;
 END $$
 
 -- Recent medications (for home page)
@@ -497,22 +797,167 @@ BEGIN
   LIMIT p_limit;
 END $$
 
+-- Compare materialized meal totals against a fresh aggregate of meal_items; optionally repair.
+-- p_userID NULL checks every meal. Returns the drifted rows (before repair).
+CREATE PROCEDURE sp_verify_meal_totals(IN p_userID INT, IN p_repair BOOLEAN)
+BEGIN
+  DROP TEMPORARY TABLE IF EXISTS meal_total_drift;
+  CREATE TEMPORARY TABLE meal_total_drift AS
+  SELECT ML.meallogid AS meallogid, ML.userid AS userid,
+         ML.totalcalories AS storedcalories, COALESCE(T.calories, 0) AS expectedcalories,
+         ML.totalproteins AS storedproteins, COALESCE(T.proteins, 0) AS expectedproteins,
+         ML.totalcarbs AS storedcarbs, COALESCE(T.carbs, 0) AS expectedcarbs,
+         ML.totalfats AS storedfats, COALESCE(T.fats, 0) AS expectedfats
+  FROM meal_log ML
+  LEFT JOIN (
+    SELECT MI.meallogid AS meallogid,
+           SUM(F.calories * MI.quantityingram / 100) AS calories,
+           SUM(F.proteins * MI.quantityingram / 100) AS proteins,
+           SUM(F.carbs * MI.quantityingram / 100) AS carbs,
+           SUM(F.fats * MI.quantityingram / 100) AS fats
+    FROM meal_items MI
+    JOIN food_items F ON F.foodid = MI.foodid
+    JOIN meal_log ML2 ON ML2.meallogid = MI.meallogid
+    WHERE p_userID IS NULL OR ML2.userid = p_userID
+    GROUP BY MI.meallogid
+  ) T ON T.meallogid = ML.meallogid
+  WHERE (p_userID IS NULL OR ML.userid = p_userID)
+    AND (ML.totalcalories <> COALESCE(T.calories, 0)
+      OR ML.totalproteins <> COALESCE(T.proteins, 0)
+      OR ML.totalcarbs <> COALESCE(T.carbs, 0)
+      OR ML.totalfats <> COALESCE(T.fats, 0));
+
+  SELECT * FROM meal_total_drift ORDER BY meallogid;
+
+  IF p_repair THEN
+    UPDATE meal_log ML
+    JOIN meal_total_drift D ON D.meallogid = ML.meallogid
+    SET ML.totalcalories = D.expectedcalories,
+        ML.totalproteins = D.expectedproteins,
+        ML.totalcarbs = D.expectedcarbs,
+        ML.totalfats = D.expectedfats;
+  END IF;
+
+  DROP TEMPORARY TABLE IF EXISTS meal_total_drift;
+END $$
+
 -- Analytical queries
 CREATE PROCEDURE sp_user_daily_macros(IN p_userID INT, IN p_date DATE)
 BEGIN
-  SELECT 
-    COALESCE(SUM(F.proteins * MI.quantityingram / 100),0) AS protein_g,
-    COALESCE(SUM(F.carbs * MI.quantityingram / 100),0) AS carbs_g,
-    COALESCE(SUM(F.fats * MI.quantityingram / 100),0) AS fats_g,
-    COALESCE(SUM(F.calories * MI.quantityingram / 100),0) AS calories
+  -- Single lookup on uq_user_date; the rollup is kept current by triggers
+  SELECT
+    COALESCE(ROUND(SUM(S.totalproteins), 2),0) AS protein_g,
+    COALESCE(ROUND(SUM(S.totalcarbs), 2),0) AS carbs_g,
+    COALESCE(ROUND(SUM(S.totalfats), 2),0) AS fats_g,
+    COALESCE(ROUND(SUM(S.totalcalories)),0) AS calories
+  FROM user_daily_summary S
+  WHERE S.userid = p_userID AND S.summarydate = p_date;
+END $$
+
+-- Per-day, per-meal-type totals for a date range in one pass over idx_meal_user_time.
+-- Result set 1 fingerprints the finalized days [p_from, p_cutoff) from the rollup's
+-- revisions; result set 2 holds the rows for [p_rowsFrom, p_to]. A caller holding the
+-- finalized days in cache passes p_rowsFrom = p_cutoff and only reads the recent days.
+CREATE PROCEDURE sp_user_macro_series(IN p_userID INT, IN p_from DATE, IN p_to DATE,
+                                      IN p_cutoff DATE, IN p_rowsFrom DATE)
+BEGIN
+  IF p_from IS NULL OR p_to IS NULL OR p_to < p_from THEN
+    SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'Valid from/to dates required';
+  END IF;
+  SELECT COUNT(*) AS days, COALESCE(SUM(S.revision), 0) AS revisions
+  FROM user_daily_summary S
+  WHERE S.userid = p_userID AND S.summarydate >= p_from AND S.summarydate < p_cutoff;
+
+  SELECT DATE(ML.logtime) AS day, ML.mealtype AS mealtype, COUNT(*) AS meals,
+         SUM(ML.totalcalories) AS calories, SUM(ML.totalproteins) AS proteins,
+         SUM(ML.totalcarbs) AS carbs, SUM(ML.totalfats) AS fats
   FROM meal_log ML
-  JOIN meal_items MI ON MI.meallogid = ML.meallogid
-  JOIN food_items F ON F.foodid = MI.foodid
-  WHERE ML.userid = p_userID AND DATE(ML.logtime) = p_date;
+  WHERE ML.userid = p_userID
+    AND ML.logtime >= GREATEST(p_from, p_rowsFrom)
+    AND ML.logtime < DATE_ADD(p_to, INTERVAL 1 DAY)
+  GROUP BY DATE(ML.logtime), ML.mealtype
+  ORDER BY day, mealtype;
+END $$
+
+-- Set-based rebuild of user_daily_summary for [p_from, p_to] across all users. Rows in range
+-- are zeroed then re-upserted, so the two statements must commit together: this runs in the
+-- caller's transaction and never starts or commits one itself. Callers split long ranges into
+-- one transaction per batch of days (DB.rebuild_daily_summary, BulkLoad.finish).
+CREATE PROCEDURE sp_rebuild_daily_summary(IN p_from DATE, IN p_to DATE)
+BEGIN
+  IF p_from IS NULL OR p_to IS NULL OR p_to < p_from THEN
+    SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'Valid from/to dates required';
+  END IF;
+  UPDATE user_daily_summary
+  SET totalcalories = 0, totalproteins = 0, totalcarbs = 0, totalfats = 0, revision = revision + 1
+  WHERE summarydate >= p_from AND summarydate <= p_to;
+  INSERT INTO user_daily_summary(userid, summarydate, totalcalories, totalproteins, totalcarbs, totalfats)
+  SELECT ML.userid, DATE(ML.logtime), SUM(ML.totalcalories), SUM(ML.totalproteins), SUM(ML.totalcarbs), SUM(ML.totalfats)
+  FROM meal_log ML
+  WHERE ML.logtime >= p_from AND ML.logtime < DATE_ADD(p_to, INTERVAL 1 DAY)
+  GROUP BY ML.userid, DATE(ML.logtime)
+  ON DUPLICATE KEY UPDATE
+    totalcalories = VALUES(totalcalories),
+    totalproteins = VALUES(totalproteins),
+    totalcarbs = VALUES(totalcarbs),
+    totalfats = VALUES(totalfats),
+    revision = revision + 1;
+END $$
+
+-- Derived data for rows inserted with @wefit_bulk_load set (triggers skipped): meal totals for
+-- meals logged in [p_from, p_to], medication counters and schedule event bounds. The daily
+-- rollup comes after, in batches (sp_rebuild_daily_summary), then sp_bump_data_versions.
+-- Like the rebuild it leaves transaction control to the caller (BulkLoad.finish).
+CREATE PROCEDURE sp_finish_bulk_load(IN p_from DATE, IN p_to DATE)
+BEGIN
+  DECLARE v_prev INT DEFAULT @wefit_bulk_load;
+  IF p_from IS NULL OR p_to IS NULL OR p_to < p_from THEN
+    SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'Valid from/to dates required';
+  END IF;
+  SET @wefit_bulk_load = 1;
+  UPDATE meal_log ML
+  JOIN (
+    SELECT MI.meallogid AS meallogid,
+           SUM(F.calories * MI.quantityingram / 100) AS calories,
+           SUM(F.proteins * MI.quantityingram / 100) AS proteins,
+           SUM(F.carbs * MI.quantityingram / 100) AS carbs,
+           SUM(F.fats * MI.quantityingram / 100) AS fats
+    FROM meal_log ML2
+    JOIN meal_items MI ON MI.meallogid = ML2.meallogid
+    JOIN food_items F ON F.foodid = MI.foodid
+    WHERE ML2.logtime >= p_from AND ML2.logtime < DATE_ADD(p_to, INTERVAL 1 DAY)
+    GROUP BY MI.meallogid
+  ) T ON T.meallogid = ML.meallogid
+  SET ML.totalcalories = T.calories, ML.totalproteins = T.proteins,
+      ML.totalcarbs = T.carbs, ML.totalfats = T.fats;
+  UPDATE medication m
+  JOIN (
+    SELECT medicationid, SUM(isskipped = 0) AS taken, SUM(isskipped <> 0) AS skipped, MIN(takentime) AS firstlog
+    FROM medication_log
+    GROUP BY medicationid
+  ) c ON c.medicationid = m.medicationid
+  SET m.dosestaken = c.taken, m.dosesskipped = c.skipped, m.createdat = LEAST(m.createdat, c.firstlog);
+  UPDATE schedule s
+  JOIN (SELECT scheduleid, MAX(duration) AS longest FROM schedule_events GROUP BY scheduleid) e
+    ON e.scheduleid = s.scheduleid
+  SET s.maxeventminutes = GREATEST(s.maxeventminutes, e.longest);
+  SET @wefit_bulk_load = v_prev;
+END $$
+
+-- Fresh catalog and user data versions, so no cache keeps contents from before a bulk load
+CREATE PROCEDURE sp_bump_data_versions()
+BEGIN
+  UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+  INSERT INTO user_data_version(userid, version)
+  SELECT userid, 1 FROM user
+  ON DUPLICATE KEY UPDATE version = user_data_version.version + 1;
 END $$
 DELIMITER ;
 
 -- Triggers
+-- The per-row bookkeeping triggers (totals, rollups, counters, versions) do nothing while the
+-- session variable @wefit_bulk_load is set; bulk loaders set it on their own connection and
+-- finish with sp_finish_bulk_load, which recomputes everything set-based.
 DELIMITER $$
 CREATE TRIGGER trg_validate_meal_item BEFORE INSERT ON meal_items
 FOR EACH ROW
@@ -529,45 +974,344 @@ BEGIN
     SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'Invalid event time';
   END IF;
 END $$
+
+-- Track each schedule's longest event for sp_list_events_in_window's scan bound
+CREATE TRIGGER trg_event_max_duration_insert AFTER INSERT ON schedule_events
+FOR EACH ROW
+BEGIN
+  IF @wefit_bulk_load IS NULL THEN
+    UPDATE schedule SET maxeventminutes = GREATEST(maxeventminutes, NEW.duration)
+    WHERE scheduleid = NEW.scheduleid;
+  END IF;
+END $$
+
+CREATE TRIGGER trg_event_max_duration_update AFTER UPDATE ON schedule_events
+FOR EACH ROW
+BEGIN
+  IF NEW.duration <> OLD.duration OR NEW.scheduleid <> OLD.scheduleid THEN
+    UPDATE schedule SET maxeventminutes = GREATEST(maxeventminutes, NEW.duration)
+    WHERE scheduleid = NEW.scheduleid;
+  END IF;
+END $$
+
+-- Per-user data versions. Meal item and medication log writes reach these through the
+-- meal_log totals and medication counter updates their own triggers make.
+-- Pages show the user's name
+CREATE TRIGGER trg_user_data_version_update AFTER UPDATE ON user
+FOR EACH ROW
+BEGIN
+  CALL sp_bump_user_data_version(NEW.userid);
+END $$
+
+CREATE TRIGGER trg_meal_log_data_version_insert AFTER INSERT ON meal_log
+FOR EACH ROW
+BEGIN
+  IF @wefit_bulk_load IS NULL THEN
+    CALL sp_bump_user_data_version(NEW.userid);
+  END IF;
+END $$
+
+CREATE TRIGGER trg_meal_log_data_version_update AFTER UPDATE ON meal_log
+FOR EACH ROW
+BEGIN
+  IF @wefit_bulk_load IS NULL THEN
+    CALL sp_bump_user_data_version(NEW.userid);
+    IF NEW.userid <> OLD.userid THEN
+      CALL sp_bump_user_data_version(OLD.userid);
+    END IF;
+  END IF;
+END $$
+
+CREATE TRIGGER trg_meal_log_data_version_delete AFTER DELETE ON meal_log
+FOR EACH ROW
+BEGIN
+  CALL sp_bump_user_data_version(OLD.userid);
+END $$
+
+CREATE TRIGGER trg_medication_data_version_insert AFTER INSERT ON medication
+FOR EACH ROW
+BEGIN
+  IF @wefit_bulk_load IS NULL THEN
+    CALL sp_bump_user_data_version(NEW.userid);
+  END IF;
+END $$
+
+CREATE TRIGGER trg_medication_data_version_update AFTER UPDATE ON medication
+FOR EACH ROW
+BEGIN
+  IF @wefit_bulk_load IS NULL THEN
+    CALL sp_bump_user_data_version(NEW.userid);
+    IF NEW.userid <> OLD.userid THEN
+      CALL sp_bump_user_data_version(OLD.userid);
+    END IF;
+  END IF;
+END $$
+
+CREATE TRIGGER trg_medication_data_version_delete AFTER DELETE ON medication
+FOR EACH ROW
+BEGIN
+  CALL sp_bump_user_data_version(OLD.userid);
+END $$
+
+CREATE TRIGGER trg_schedule_data_version_insert AFTER INSERT ON schedule
+FOR EACH ROW
+BEGIN
+  IF @wefit_bulk_load IS NULL THEN
+    CALL sp_bump_user_data_version(NEW.userid);
+  END IF;
+END $$
+
+CREATE TRIGGER trg_schedule_data_version_update AFTER UPDATE ON schedule
+FOR EACH ROW
+BEGIN
+  CALL sp_bump_user_data_version(NEW.userid);
+  IF NEW.userid <> OLD.userid THEN
+    CALL sp_bump_user_data_version(OLD.userid);
+  END IF;
+END $$
+
+CREATE TRIGGER trg_schedule_data_version_delete AFTER DELETE ON schedule
+FOR EACH ROW
+BEGIN
+  CALL sp_bump_user_data_version(OLD.userid);
+END $$
+
+CREATE TRIGGER trg_schedule_events_data_version_insert AFTER INSERT ON schedule_events
+FOR EACH ROW
+BEGIN
+  IF @wefit_bulk_load IS NULL THEN
+    CALL sp_bump_user_data_version((SELECT userid FROM schedule WHERE scheduleid = NEW.scheduleid));
+  END IF;
+END $$
+
+CREATE TRIGGER trg_schedule_events_data_version_update AFTER UPDATE ON schedule_events
+FOR EACH ROW
+BEGIN
+  CALL sp_bump_user_data_version((SELECT userid FROM schedule WHERE scheduleid = NEW.scheduleid));
+END $$
+
+CREATE TRIGGER trg_schedule_events_data_version_delete AFTER DELETE ON schedule_events
+FOR EACH ROW
+BEGIN
+  CALL sp_bump_user_data_version((SELECT userid FROM schedule WHERE scheduleid = OLD.scheduleid));
+END $$
+
+-- Keep meal_log totals in step with its items (sp_add_meal_item, sp_clear_meal_items, ...)
+CREATE TRIGGER trg_meal_items_totals_insert AFTER INSERT ON meal_items
+FOR EACH ROW
+BEGIN
+  IF @wefit_bulk_load IS NULL THEN
+    UPDATE meal_log ML
+    JOIN food_items F ON F.foodid = NEW.foodid
+    SET ML.totalcalories = ML.totalcalories + F.calories * NEW.quantityingram / 100,
+        ML.totalproteins = ML.totalproteins + F.proteins * NEW.quantityingram / 100,
+        ML.totalcarbs = ML.totalcarbs + F.carbs * NEW.quantityingram / 100,
+        ML.totalfats = ML.totalfats + F.fats * NEW.quantityingram / 100
+    WHERE ML.meallogid = NEW.meallogid;
+  END IF;
+END $$
+
+CREATE TRIGGER trg_meal_items_totals_delete AFTER DELETE ON meal_items
+FOR EACH ROW
+BEGIN
+  UPDATE meal_log ML
+  JOIN food_items F ON F.foodid = OLD.foodid
+  SET ML.totalcalories = ML.totalcalories - F.calories * OLD.quantityingram / 100,
+      ML.totalproteins = ML.totalproteins - F.proteins * OLD.quantityingram / 100,
+      ML.totalcarbs = ML.totalcarbs - F.carbs * OLD.quantityingram / 100,
+      ML.totalfats = ML.totalfats - F.fats * OLD.quantityingram / 100
+  WHERE ML.meallogid = OLD.meallogid;
+END $$
+
+CREATE TRIGGER trg_meal_items_totals_update AFTER UPDATE ON meal_items
+FOR EACH ROW
+BEGIN
+  UPDATE meal_log ML
+  JOIN food_items F ON F.foodid = OLD.foodid
+  SET ML.totalcalories = ML.totalcalories - F.calories * OLD.quantityingram / 100,
+      ML.totalproteins = ML.totalproteins - F.proteins * OLD.quantityingram / 100,
+      ML.totalcarbs = ML.totalcarbs - F.carbs * OLD.quantityingram / 100,
+      ML.totalfats = ML.totalfats - F.fats * OLD.quantityingram / 100
+  WHERE ML.meallogid = OLD.meallogid;
+  UPDATE meal_log ML
+  JOIN food_items F ON F.foodid = NEW.foodid
+  SET ML.totalcalories = ML.totalcalories + F.calories * NEW.quantityingram / 100,
+      ML.totalproteins = ML.totalproteins + F.proteins * NEW.quantityingram / 100,
+      ML.totalcarbs = ML.totalcarbs + F.carbs * NEW.quantityingram / 100,
+      ML.totalfats = ML.totalfats + F.fats * NEW.quantityingram / 100
+  WHERE ML.meallogid = NEW.meallogid;
+END $$
+
+-- Roll meal totals into user_daily_summary; an edit moves the old totals out of the old
+-- (user, day) and the new ones into the new day, which also covers back-dated log times.
+-- Every meal change bumps the day's revision, even one that leaves the totals unchanged.
+CREATE TRIGGER trg_meal_log_summary_insert AFTER INSERT ON meal_log
+FOR EACH ROW
+BEGIN
+  IF @wefit_bulk_load IS NULL THEN
+    INSERT INTO user_daily_summary(userid, summarydate, totalcalories, totalproteins, totalcarbs, totalfats)
+    VALUES(NEW.userid, DATE(NEW.logtime), NEW.totalcalories, NEW.totalproteins, NEW.totalcarbs, NEW.totalfats)
+    ON DUPLICATE KEY UPDATE
+      totalcalories = totalcalories + VALUES(totalcalories),
+      totalproteins = totalproteins + VALUES(totalproteins),
+      totalcarbs = totalcarbs + VALUES(totalcarbs),
+      totalfats = totalfats + VALUES(totalfats),
+      revision = revision + 1;
+  END IF;
+END $$
+
+CREATE TRIGGER trg_meal_log_summary_update AFTER UPDATE ON meal_log
+FOR EACH ROW
+BEGIN
+  IF @wefit_bulk_load IS NULL THEN
+    IF NEW.userid <> OLD.userid OR NEW.logtime <> OLD.logtime OR NEW.mealtype <> OLD.mealtype
+       OR NEW.totalcalories <> OLD.totalcalories OR NEW.totalproteins <> OLD.totalproteins
+       OR NEW.totalcarbs <> OLD.totalcarbs OR NEW.totalfats <> OLD.totalfats THEN
+      INSERT INTO user_daily_summary(userid, summarydate, totalcalories, totalproteins, totalcarbs, totalfats)
+      VALUES(OLD.userid, DATE(OLD.logtime), -OLD.totalcalories, -OLD.totalproteins, -OLD.totalcarbs, -OLD.totalfats)
+      ON DUPLICATE KEY UPDATE
+        totalcalories = totalcalories + VALUES(totalcalories),
+        totalproteins = totalproteins + VALUES(totalproteins),
+        totalcarbs = totalcarbs + VALUES(totalcarbs),
+        totalfats = totalfats + VALUES(totalfats),
+        revision = revision + 1;
+      INSERT INTO user_daily_summary(userid, summarydate, totalcalories, totalproteins, totalcarbs, totalfats)
+      VALUES(NEW.userid, DATE(NEW.logtime), NEW.totalcalories, NEW.totalproteins, NEW.totalcarbs, NEW.totalfats)
+      ON DUPLICATE KEY UPDATE
+        totalcalories = totalcalories + VALUES(totalcalories),
+        totalproteins = totalproteins + VALUES(totalproteins),
+        totalcarbs = totalcarbs + VALUES(totalcarbs),
+        totalfats = totalfats + VALUES(totalfats),
+        revision = revision + 1;
+    END IF;
+  END IF;
+END $$
+
+CREATE TRIGGER trg_meal_log_summary_delete AFTER DELETE ON meal_log
+FOR EACH ROW
+BEGIN
+  UPDATE user_daily_summary
+  SET totalcalories = totalcalories - OLD.totalcalories,
+      totalproteins = totalproteins - OLD.totalproteins,
+      totalcarbs = totalcarbs - OLD.totalcarbs,
+      totalfats = totalfats - OLD.totalfats,
+      revision = revision + 1
+  WHERE userid = OLD.userid AND summarydate = DATE(OLD.logtime);
+END $$
+
+-- Keep medication.dosestaken/dosesskipped current so listing medications never counts logs
+CREATE TRIGGER trg_medication_log_counts_insert AFTER INSERT ON medication_log
+FOR EACH ROW
+BEGIN
+  IF @wefit_bulk_load IS NULL THEN
+    UPDATE medication
+    SET dosestaken = dosestaken + (NOT NEW.isskipped),
+        dosesskipped = dosesskipped + (NEW.isskipped <> 0),
+        createdat = LEAST(createdat, NEW.takentime)
+    WHERE medicationid = NEW.medicationid;
+  END IF;
+END $$
+
+CREATE TRIGGER trg_medication_log_counts_delete AFTER DELETE ON medication_log
+FOR EACH ROW
+BEGIN
+  UPDATE medication
+  SET dosestaken = dosestaken - (NOT OLD.isskipped),
+      dosesskipped = dosesskipped - (OLD.isskipped <> 0)
+  WHERE medicationid = OLD.medicationid;
+END $$
+
+CREATE TRIGGER trg_medication_log_counts_update AFTER UPDATE ON medication_log
+FOR EACH ROW
+BEGIN
+  IF NEW.medicationid <> OLD.medicationid OR NEW.isskipped <> OLD.isskipped THEN
+    UPDATE medication
+    SET dosestaken = dosestaken - (NOT OLD.isskipped),
+        dosesskipped = dosesskipped - (OLD.isskipped <> 0)
+    WHERE medicationid = OLD.medicationid;
+    UPDATE medication
+    SET dosestaken = dosestaken + (NOT NEW.isskipped),
+        dosesskipped = dosesskipped + (NEW.isskipped <> 0)
+    WHERE medicationid = NEW.medicationid;
+  END IF;
+END $$
+
+-- A nutrient edit shifts the totals of every meal that uses the food by the per-100g delta
+CREATE TRIGGER trg_food_items_totals_update AFTER UPDATE ON food_items
+FOR EACH ROW
+BEGIN
+  IF NEW.calories <> OLD.calories OR NEW.proteins <> OLD.proteins
+     OR NEW.carbs <> OLD.carbs OR NEW.fats <> OLD.fats THEN
+    UPDATE meal_log ML
+    JOIN meal_items MI ON MI.meallogid = ML.meallogid
+    SET ML.totalcalories = ML.totalcalories + (NEW.calories - OLD.calories) * MI.quantityingram / 100,
+        ML.totalproteins = ML.totalproteins + (NEW.proteins - OLD.proteins) * MI.quantityingram / 100,
+        ML.totalcarbs = ML.totalcarbs + (NEW.carbs - OLD.carbs) * MI.quantityingram / 100,
+        ML.totalfats = ML.totalfats + (NEW.fats - OLD.fats) * MI.quantityingram / 100
+    WHERE MI.foodid = NEW.foodid;
+  END IF;
+END $$
+
+-- Any change to foods or their allergens invalidates cached catalogs
+CREATE TRIGGER trg_food_items_version_insert AFTER INSERT ON food_items
+FOR EACH ROW
+BEGIN
+  IF @wefit_bulk_load IS NULL THEN
+    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+  END IF;
+END $$
+
+CREATE TRIGGER trg_food_items_version_update AFTER UPDATE ON food_items
+FOR EACH ROW
+BEGIN
+  UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+END $$
+
+CREATE TRIGGER trg_food_items_version_delete AFTER DELETE ON food_items
+FOR EACH ROW
+BEGIN
+  UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+END $$
+
+CREATE TRIGGER trg_food_allergens_version_insert AFTER INSERT ON food_allergens
+FOR EACH ROW
+BEGIN
+  IF @wefit_bulk_load IS NULL THEN
+    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+  END IF;
+END $$
+
+CREATE TRIGGER trg_food_allergens_version_delete AFTER DELETE ON food_allergens
+FOR EACH ROW
+BEGIN
+  UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+END $$
 DELIMITER ;
 
--- Event Scheduler 
-CREATE TABLE user_daily_summary (
-  summaryid INT AUTO_INCREMENT PRIMARY KEY,
-  userid INT NOT NULL,
-  summarydate DATE NOT NULL,
-  totalcalories INT NOT NULL DEFAULT 0,
-  createdat TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-  CONSTRAINT fk_summary_user FOREIGN KEY (userid)
-    REFERENCES user(userid)
-    ON UPDATE CASCADE
-    ON DELETE CASCADE,
-  CONSTRAINT uq_user_date UNIQUE(userid, summarydate)
-) ENGINE=InnoDB;
+-- Sample data above was loaded before the triggers existed; materialize its totals
+CALL sp_verify_meal_totals(NULL, TRUE);
+UPDATE schedule s
+JOIN (SELECT scheduleid, MAX(duration) AS longest FROM schedule_events GROUP BY scheduleid) e
+  ON e.scheduleid = s.scheduleid
+SET s.maxeventminutes = e.longest;
+UPDATE medication m
+JOIN (
+  SELECT medicationid, SUM(isskipped = 0) AS taken, SUM(isskipped <> 0) AS skipped, MIN(takentime) AS firstlog
+  FROM medication_log
+  GROUP BY medicationid
+) c ON c.medicationid = m.medicationid
+SET m.dosestaken = c.taken, m.dosesskipped = c.skipped, m.createdat = LEAST(m.createdat, c.firstlog);
 
+-- Event Scheduler
+-- Safety net only: rollups are maintained by triggers, so the nightly job just
+-- reconciles the last two days set-based instead of iterating users with a cursor.
 DELIMITER $$
-CREATE EVENT IF NOT EXISTS ev_nightly_calorie_summary
+CREATE EVENT IF NOT EXISTS ev_nightly_summary_reconcile
 ON SCHEDULE EVERY 1 DAY STARTS '2025-12-04 23:59:00'
 DO
 BEGIN
-  DECLARE done INT DEFAULT 0;
-  DECLARE v_userID INT;
-  DECLARE cur CURSOR FOR SELECT userid FROM user;
-  DECLARE CONTINUE HANDLER FOR NOT FOUND SET done = 1;
-
-  OPEN cur;
-  read_loop: LOOP
-    FETCH cur INTO v_userID;
-    IF done = 1 THEN LEAVE read_loop; END IF;
-    INSERT INTO user_daily_summary(userid, summarydate, totalcalories)
-    SELECT v_userID, CURDATE(), COALESCE(SUM(F.calories * MI.quantityingram / 100),0)
-    FROM meal_log ML
-    LEFT JOIN meal_items MI ON MI.meallogid = ML.meallogid
-    LEFT JOIN food_items F ON F.foodid = MI.foodid
-    WHERE ML.userid = v_userID AND DATE(ML.logtime) = CURDATE()
-    ON DUPLICATE KEY UPDATE totalcalories = VALUES(totalcalories);
-  END LOOP;
-  CLOSE cur;
+  START TRANSACTION;
+  CALL sp_rebuild_daily_summary(DATE_SUB(CURDATE(), INTERVAL 1 DAY), CURDATE());
+  COMMIT;
 END $$
 DELIMITER ;
-
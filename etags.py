@@ -0,0 +1,108 @@
+import functools
+import hashlib
+import os
+import threading
+import time
+from flask import g, make_response, message_flashed, request, session
+from db import DB
+
+# Conditional GET for per-user pages. Every write to a user's meals, medications, schedules or
+# events bumps user_data_version (see the *_data_version triggers), so a page's ETag can be
+# derived from that counter alone: an unchanged version means the page would render the same.
+#
+# Versions are cached per process for VERSION_TTL seconds, so a revalidation usually answers
+# 304 without touching MySQL at all. A write through this app marks the session with the
+# time of the write, and cached versions older than that are never trusted, so users always
+# see their own changes even when the next request lands on another worker.
+
+VERSION_TTL = float(os.getenv("DATA_VERSION_TTL", "5"))
+ETAG_SALT = os.getenv("ETAG_SALT", "")
+_SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class DataVersions:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, written_at=0):
+        now = time.time()
+        with self._lock:
+            cached = self._versions.get(user_id)
+            if cached is not None and now - cached[1] < self.ttl and cached[1] > written_at:
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+        rows = DB.call_proc("sp_get_user_data_version", (user_id,))
+        version = rows[0]["version"] if rows else 0
+        with self._lock:
+            self._versions[user_id] = (version, now)
+        return version
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._versions.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._versions)}
+
+
+DATA_VERSIONS = DataVersions(VERSION_TTL)
+
+
+def make_etag(*parts):
+    return hashlib.sha1("|".join(str(p) for p in (ETAG_SALT,) + parts).encode()).hexdigest()[:20]
+
+
+def _tag(resp, etag):
+    # Weak: the same version renders an equivalent page, not necessarily identical bytes
+    resp.set_etag(etag, weak=True)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+def conditional(extra=None):
+    # View decorator: ETag = (user, data version, URL, extra()); a matching If-None-Match
+    # returns 304 before the view runs. Pages carrying a flash message are never tagged, since
+    # the message is shown once and must not be replayed from the browser cache.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            uid = session.get("userID")
+            if request.method != "GET" or not uid:
+                return view(*args, **kwargs)
+            version = DATA_VERSIONS.get(uid, session.get("data_written_at", 0))
+            # Also keys the page's per-user {% cache %} fragments
+            g.data_version = version
+            etag = make_etag(uid, version, request.full_path, extra() if extra else "")
+            pending_flash = "_flashes" in session
+            if not pending_flash and request.if_none_match.contains_weak(etag):
+                return _tag(make_response("", 304), etag)
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code == 200 and not pending_flash and not g.get("flashed"):
+                _tag(resp, etag)
+            return resp
+        return wrapper
+    return decorator
+
+
+def _note_flash(sender, message, category, **extra):
+    g.flashed = True
+
+
+def init_app(app):
+    message_flashed.connect(_note_flash, app)
+
+    @app.after_request
+    def note_writes(response):
+        # Any non-GET request by a logged-in user may have changed their data, unless the view
+        # marked itself read-only (g.read_only, e.g. the API batch endpoint)
+        uid = session.get("userID")
+        if uid and request.method not in _SAFE_METHODS and not g.get("read_only"):
+            DATA_VERSIONS.invalidate(uid)
+            session["data_written_at"] = time.time()
+        return response
@@ -0,0 +1,93 @@
+import os
+import threading
+from collections import OrderedDict
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+# Rendered-fragment cache for templates. A block wrapped in
+#
+#     {% cache "foods-table", catalog_version %} ... {% endcache %}
+#
+# is rendered once per distinct key and then served as stored HTML. The key must name every
+# input the block depends on (a catalog version, a user id plus data version, ...): nothing
+# is invalidated, a new version simply stops matching and the old entry ages out of the LRU.
+# A key containing None is never cached, so a missing version renders normally.
+
+CACHE_BYTES = int(os.getenv("FRAGMENT_CACHE_BYTES", str(8 * 1024 * 1024)))
+
+
+class FragmentCache:
+    # LRU bounded by the total length of the stored fragments
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def fetch(self, key, render):
+        if any(part is None for part in key):
+            return render()
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        # Rendered outside the lock; two threads missing the same key both render, harmlessly
+        html = render()
+        self.put(key, html)
+        return html
+
+    def put(self, key, html):
+        if len(html) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = html
+            self._bytes += len(html)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self._bytes,
+                    "hit_ratio": round(self.hits / lookups, 3) if lookups else None}
+
+
+FRAGMENTS = FragmentCache(CACHE_BYTES)
+
+
+class FragmentCacheExtension(Extension):
+    # {% cache name, key1, key2, ... %}body{% endcache %}
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FRAGMENTS)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        call = self.call_method("_render", [nodes.List(parts)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        return self.environment.fragment_cache.fetch(tuple(parts), caller)
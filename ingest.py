@@ -0,0 +1,274 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from mysql.connector.errors import DataError, Error as MySQLError, IntegrityError, InterfaceError, OperationalError, PoolError
+from db import DB
+import bulk
+
+log = logging.getLogger(__name__)
+
+# Meal and medication logging. In the default "sync" mode a submission is written to MySQL
+# before the request returns. With INGEST_MODE=queue it is validated, appended to a local
+# SQLite queue (WAL, fsync on commit) and acknowledged; a background flusher drains the queue
+# in multi-row batches through sp_ingest_meals / sp_ingest_med_logs. Every entry carries an
+# idempotency key that is unique in MySQL, so a retried batch or a resubmitted form never
+# logs twice. Queued writes show up once flushed (INGEST_FLUSH_INTERVAL, 1 s by default).
+
+MODE = os.getenv("INGEST_MODE", "sync").lower()
+QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH", "ingest-queue.sqlite3")
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "1"))
+MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "8"))
+MAX_BACKOFF = 60
+# A leased batch not finished within this long (flusher died) becomes due again
+LEASE_SECONDS = 120
+KEY_LENGTH = 64
+
+KINDS = {"meal": "sp_ingest_meals", "medlog": "sp_ingest_med_logs"}
+# Database unreachable: the whole batch waits and is retried as is
+_TRANSIENT = (InterfaceError, OperationalError, PoolError)
+# Bad data: retrying cannot help, so the entry goes straight to the dead letters
+_PERMANENT = (IntegrityError, DataError)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  kind TEXT NOT NULL,
+  idemkey TEXT NOT NULL UNIQUE,
+  userid INTEGER NOT NULL,
+  payload TEXT NOT NULL,
+  enqueued_at REAL NOT NULL,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt REAL NOT NULL DEFAULT 0,
+  lease_until REAL NOT NULL DEFAULT 0,
+  last_error TEXT,
+  dead INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_entries_due ON entries(dead, next_attempt, id);
+"""
+
+
+def idempotency_key(value=None):
+    # The client's key (form field or Idempotency-Key header), or a fresh one
+    key = (value or "").strip()
+    if not key:
+        return uuid.uuid4().hex
+    if len(key) > KEY_LENGTH:
+        raise ValueError(f"Idempotency key must be at most {KEY_LENGTH} characters")
+    return key
+
+
+def _write(kind, entries):
+    # One statement per kind for the whole batch; returns the keys MySQL refused
+    with DB.transaction() as tx:
+        rows = tx.call_proc(KINDS[kind], (json.dumps(entries),))
+    return {r["idemkey"] for r in rows}
+
+
+class IngestQueue:
+    def __init__(self, path, batch_size, interval):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._pending_hint = 0
+        self._transient_failures = 0
+        self.flushed = {kind: 0 for kind in KINDS}
+        self.retries = 0
+        self.rejected = 0
+        self.dead_lettered = 0
+        self.last_lag = None
+
+    def _conn(self):
+        # One SQLite connection per thread, in autocommit mode (transactions are explicit)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def put(self, kind, key, uid, entry):
+        # True if queued, False if this key is already waiting in the queue
+        cur = self._conn().execute(
+            "INSERT OR IGNORE INTO entries (kind, idemkey, userid, payload, enqueued_at) VALUES (?, ?, ?, ?, ?)",
+            (kind, key, uid, json.dumps(entry), time.time()))
+        with self._stats_lock:
+            self._pending_hint += cur.rowcount
+            full = self._pending_hint >= self.batch_size
+        if full:
+            self._wake.set()
+        return cur.rowcount == 1
+
+    def _lease(self, now):
+        # BEGIN IMMEDIATE takes the write lock, so flushers in other processes sharing the
+        # file never lease the same entries
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, kind, idemkey, payload, enqueued_at, attempts FROM entries "
+                "WHERE dead = 0 AND next_attempt <= ? AND lease_until <= ? ORDER BY id LIMIT ?",
+                (now, now, self.batch_size)).fetchall()
+            conn.executemany("UPDATE entries SET lease_until = ? WHERE id = ?",
+                             [(now + LEASE_SECONDS, r[0]) for r in rows])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def _delete(self, rows):
+        self._conn().executemany("DELETE FROM entries WHERE id = ?", [(r[0],) for r in rows])
+
+    def _postpone(self, rows, error):
+        # Transient failure: release the batch untouched, retry after a growing pause
+        self._transient_failures += 1
+        delay = min(MAX_BACKOFF, self.interval * 2 ** self._transient_failures)
+        self._conn().executemany(
+            "UPDATE entries SET lease_until = 0, next_attempt = ?, last_error = ? WHERE id = ?",
+            [(time.time() + delay, str(error), r[0]) for r in rows])
+        log.warning("ingest flush of %d entries deferred %.1f s: %s", len(rows), delay, error)
+
+    def _fail(self, row, error, permanent):
+        attempts = row[5] + 1
+        dead = permanent or attempts >= MAX_ATTEMPTS
+        self._conn().execute(
+            "UPDATE entries SET attempts = ?, next_attempt = ?, lease_until = 0, last_error = ?, dead = ? WHERE id = ?",
+            (attempts, time.time() + min(MAX_BACKOFF, 2 ** attempts), str(error), int(dead), row[0]))
+        with self._stats_lock:
+            if dead:
+                self.dead_lettered += 1
+            else:
+                self.retries += 1
+        if dead:
+            log.error("ingest entry %s (%s) dead after %d attempts: %s", row[2], row[1], attempts, error)
+
+    def _finish(self, kind, rows, refused):
+        self._delete(rows)
+        now = time.time()
+        if refused:
+            log.warning("ingest dropped %d %s entries refused by the database: %s", len(refused), kind,
+                        ", ".join(sorted(refused)))
+        with self._stats_lock:
+            self.flushed[kind] += len(rows) - len(refused)
+            self.rejected += len(refused)
+            self.last_lag = now - min(r[4] for r in rows)
+        return len(rows)
+
+    def _flush_kind(self, kind, rows):
+        try:
+            refused = _write(kind, [json.loads(r[3]) for r in rows])
+        except _TRANSIENT as e:
+            self._postpone(rows, e)
+            return 0
+        except MySQLError as e:
+            if len(rows) == 1:
+                self._fail(rows[0], e, isinstance(e, _PERMANENT))
+                return 0
+            # One bad entry fails the whole statement; write them one by one to isolate it
+            log.warning("ingest batch of %d %s entries failed, retrying singly: %s", len(rows), kind, e)
+            return sum(self._flush_kind(kind, [r]) for r in rows)
+        self._transient_failures = 0
+        return self._finish(kind, rows, refused)
+
+    def flush(self):
+        # Writes one batch; returns the number of entries taken off the queue
+        rows = self._lease(time.time())
+        with self._stats_lock:
+            self._pending_hint = max(0, self._pending_hint - len(rows))
+        by_kind = {}
+        for r in rows:
+            by_kind.setdefault(r[1], []).append(r)
+        return sum(self._flush_kind(kind, batch) for kind, batch in by_kind.items())
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                written = self.flush()
+            except Exception:
+                log.exception("ingest flush failed")
+                written = 0
+            # A full batch means there is probably more waiting: go again straight away
+            if written < self.batch_size:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._conn()
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="ingest-flusher", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=10):
+        # Entries still queued stay on disk and are flushed after the next start
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        row = self._conn().execute(
+            "SELECT SUM(dead = 0), SUM(dead), MIN(CASE WHEN dead = 0 THEN enqueued_at END) FROM entries").fetchone()
+        with self._stats_lock:
+            return {"depth": row[0] or 0, "dead": row[1] or 0,
+                    "oldest_age": time.time() - row[2] if row[2] is not None else 0,
+                    "flushed": dict(self.flushed), "retries": self.retries, "rejected": self.rejected,
+                    "dead_lettered": self.dead_lettered, "last_lag": self.last_lag}
+
+
+QUEUE = IngestQueue(QUEUE_PATH, BATCH_SIZE, FLUSH_INTERVAL) if MODE == "queue" else None
+
+
+def _submit(kind, key, uid, entry):
+    # True when queued (acknowledged before it reaches MySQL), False when already written
+    if QUEUE is not None:
+        QUEUE.put(kind, key, uid, entry)
+        return True
+    if _write(kind, [entry]):
+        raise ValueError("Medication not found")
+    return False
+
+
+def submit_med_log(uid, medication_id, taken=None, skipped=False, key=None):
+    (medid, taken, skipped), _ = bulk._validate_medlog(
+        {"medicationid": medication_id, "takentime": taken or datetime.now(), "isskipped": skipped}, uid)
+    key = idempotency_key(key)
+    return _submit("medlog", key, uid, {"idemkey": key, "userid": uid, "medicationid": medid,
+                                        "takentime": taken.strftime("%Y-%m-%d %H:%M:%S"),
+                                        "isskipped": int(skipped)})
+
+
+def submit_meal(uid, mealtype, logtime=None, items=(), key=None):
+    # items: [{"foodid": .., "qty": ..}]; the same food twice is logged once with the summed quantity
+    (uid, mealtype, logtime), items = bulk._validate_meal(
+        {"mealtype": mealtype, "logtime": logtime or datetime.now(), "items": list(items)}, uid)
+    key = idempotency_key(key)
+    return _submit("meal", key, uid, {"idemkey": key, "userid": uid, "mealtype": mealtype,
+                                      "logtime": logtime.strftime("%Y-%m-%d %H:%M:%S"),
+                                      "items": [{"foodid": f, "qty": q} for f, q in items]})
+
+
+def start():
+    if QUEUE is not None:
+        QUEUE.start()
+
+
+def stats():
+    return QUEUE.stats() if QUEUE is not None else None
@@ -0,0 +1,209 @@
+import bisect
+import contextvars
+import logging
+import os
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+
+# In-process metrics rendered in the Prometheus text exposition format at /metrics.
+# Everything here is a dict lookup plus a short critical section, cheap enough to leave on.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+# redacted (default): strings masked, numbers/dates kept; full: raw args; none: no args
+SLOW_QUERY_LOG_ARGS = os.getenv("SLOW_QUERY_LOG_ARGS", "redacted")
+QUERY_COUNT_WARN = int(os.getenv("QUERY_COUNT_WARN", "25"))
+
+slow_log = logging.getLogger("wefit.db.slow")
+request_log = logging.getLogger("wefit.request")
+
+_metrics = []
+_collectors = []
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for lv, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, lv)} {v}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(lv, list(s[0]), s[1], s[2]) for lv, s in sorted(self._series.items())]
+        for lv, counts, total, n in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = "+Inf" if bound == float("inf") else bound
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), lv + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, lv)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, lv)} {n}")
+        return lines
+
+
+def register_collector(fn):
+    # fn() -> list of exposition lines, for values that live elsewhere (pool, caches, ...)
+    _collectors.append(fn)
+    return fn
+
+
+def family(name, kind, help, samples):
+    # samples: [(labels dict or None, value)]
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        names = tuple(labels or ())
+        lines.append(f"{name}{_labels(names, tuple((labels or {}).values()))} {value}")
+    return lines
+
+
+def histogram_family(name, help, buckets, total, count, labels=None):
+    # buckets: [(upper bound, observations in that bucket)], rendered cumulatively
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+    names, values = tuple(labels or ()), tuple((labels or {}).values())
+    cumulative = 0
+    for bound, c in buckets:
+        cumulative += c
+        le = "+Inf" if bound == float("inf") else bound
+        lines.append(f"{name}_bucket{_labels(names + ('le',), values + (le,))} {cumulative}")
+    lines.append(f"{name}_sum{_labels(names, values)} {total}")
+    lines.append(f"{name}_count{_labels(names, values)} {count}")
+    return lines
+
+
+def render():
+    lines = []
+    for m in _metrics:
+        lines.extend(m.render())
+    for fn in _collectors:
+        lines.extend(fn())
+    return "\n".join(lines) + "\n"
+
+
+# Database query metrics
+QUERY_SECONDS = Histogram("wefit_db_query_duration_seconds", "Stored procedure / statement latency.", ("query",))
+QUERY_ROWS = Counter("wefit_db_query_rows_total", "Rows returned, per stored procedure / statement.", ("query",))
+QUERY_RESULT_SETS = Counter("wefit_db_query_result_sets_total", "Result sets returned, per stored procedure.", ("query",))
+QUERY_ERRORS = Counter("wefit_db_query_errors_total", "Failed stored procedure / statement calls.", ("query",))
+REQUEST_QUERIES = Histogram("wefit_request_db_queries", "Database calls per HTTP request.", ("endpoint",), COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram("wefit_request_db_seconds", "Cumulative database time per HTTP request.", ("endpoint",))
+REQUEST_SECONDS = Histogram("wefit_request_duration_seconds", "HTTP request latency.", ("endpoint",))
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "_lock")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.db_seconds += seconds
+
+
+_request_stats = contextvars.ContextVar("wefit_request_stats", default=None)
+
+
+def start_request():
+    stats = RequestStats()
+    _request_stats.set(stats)
+    return stats
+
+
+def current_request():
+    return _request_stats.get()
+
+
+def redact_args(args):
+    if SLOW_QUERY_LOG_ARGS == "full":
+        return repr(tuple(args or ()))
+    if SLOW_QUERY_LOG_ARGS == "none":
+        return f"<{len(args or ())} args>"
+    shown = []
+    for a in args or ():
+        if a is None or isinstance(a, (bool, int, float, Decimal, date, datetime)):
+            shown.append(repr(a))
+        else:
+            shown.append(f"<str len={len(str(a))}>")
+    return "(" + ", ".join(shown) + ")"
+
+
+def record_query(name, args, seconds, rows, result_sets, error=None):
+    # DB query hook: see DB.add_query_hook
+    QUERY_SECONDS.observe(seconds, name)
+    if error is not None:
+        QUERY_ERRORS.inc(1, name)
+    else:
+        QUERY_ROWS.inc(rows, name)
+        if result_sets:
+            QUERY_RESULT_SETS.inc(result_sets, name)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.add(seconds)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        slow_log.warning("slow query %s took %.1f ms rows=%s sets=%s args=%s",
+                         name, seconds * 1000, rows, result_sets, redact_args(args))
+
+
+def finish_request(endpoint, seconds, stats):
+    endpoint = endpoint or "unknown"
+    REQUEST_SECONDS.observe(seconds, endpoint)
+    if stats is None:
+        return
+    REQUEST_QUERIES.observe(stats.queries, endpoint)
+    REQUEST_DB_SECONDS.observe(stats.db_seconds, endpoint)
+    level = logging.WARNING if stats.queries > QUERY_COUNT_WARN else logging.DEBUG
+    request_log.log(level, "%s queries=%d db_ms=%.1f total_ms=%.1f",
+                    endpoint, stats.queries, stats.db_seconds * 1000, seconds * 1000)
@@ -0,0 +1,187 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import types
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing off the request threads. scrypt/PBKDF2 are deliberately slow, so hashes are
+# computed in a small process pool: request threads only wait on a future, and at most
+# HASH_WORKERS + HASH_QUEUE operations are admitted at once. Anything beyond that, or waiting
+# longer than HASH_TIMEOUT, fails fast with HashingBusy instead of queueing without bound.
+
+HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(2, os.cpu_count() or 1))))
+HASH_QUEUE = int(os.getenv("HASH_QUEUE", "16"))
+HASH_TIMEOUT = float(os.getenv("HASH_TIMEOUT", "5"))
+
+LOGIN_MAX_FAILURES = int(os.getenv("LOGIN_MAX_FAILURES", "5"))
+LOGIN_FAILURE_WINDOW = int(os.getenv("LOGIN_FAILURE_WINDOW", "900"))
+IP_MAX_ATTEMPTS = int(os.getenv("IP_MAX_ATTEMPTS", "20"))
+IP_ATTEMPT_WINDOW = int(os.getenv("IP_ATTEMPT_WINDOW", "60"))
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def _ready():
+    return None
+
+
+def _start_workers(executor, count):
+    # A spawned child re-runs the parent's __main__ before taking work, which under
+    # `python app.py` is the whole app (connection pool, ingest flusher). Workers only need this
+    # module and werkzeug, so they are all started here with a bare __main__ in its place: the
+    # executor starts a process per submit while none is idle.
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        futures = [executor.submit(_ready) for _ in range(count)]
+    finally:
+        sys.modules["__main__"] = main
+    for future in futures:
+        future.result()
+
+
+class HashPool:
+    def __init__(self, workers, queue, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn: forking a threaded server process can copy held locks into the child
+                    executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                   mp_context=multiprocessing.get_context("spawn"))
+                    _start_workers(executor, self.workers)
+                    self._executor = executor
+        return self._executor
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def _release(self, _future):
+        self._slots.release()
+        self._count(in_flight=-1, completed=1)
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self._count(rejected=1)
+            raise HashingBusy("Password service is busy, please retry shortly")
+        self._count(in_flight=1)
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            self._count(in_flight=-1)
+            raise
+        # The slot stays taken until the worker is done, even if this caller gives up
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            self._count(timeouts=1)
+            raise HashingBusy("Password check timed out, please retry shortly")
+
+    def stats(self):
+        with self._stats_lock:
+            return {"workers": self.workers, "in_flight": self.in_flight, "completed": self.completed,
+                    "rejected": self.rejected, "timeouts": self.timeouts}
+
+
+HASH_POOL = HashPool(HASH_WORKERS, HASH_QUEUE, HASH_TIMEOUT)
+
+_current_prefix = None
+_dummy_hash = None
+
+
+def _method_prefix():
+    # werkzeug expands "scrypt" to "scrypt:32768:8:1" etc.; the stored prefix is what we compare
+    global _current_prefix, _dummy_hash
+    if _current_prefix is None:
+        _dummy_hash = HASH_POOL.run(generate_password_hash, "wefit-dummy-password", HASH_METHOD)
+        _current_prefix = _dummy_hash.split("$", 1)[0]
+    return _current_prefix
+
+
+def hash_password(password):
+    return HASH_POOL.run(generate_password_hash, password, HASH_METHOD)
+
+
+def needs_rehash(pwhash):
+    return (pwhash or "").split("$", 1)[0] != _method_prefix()
+
+
+def verify_password(pwhash, password):
+    # Unknown accounts are checked against a dummy hash so they take as long as real ones
+    _method_prefix()
+    if not pwhash:
+        HASH_POOL.run(check_password_hash, _dummy_hash, password or "")
+        return False
+    return HASH_POOL.run(check_password_hash, pwhash, password or "")
+
+
+class AttemptThrottle:
+    # Sliding-window counters per key: at most `limit` events within `window` seconds.
+    # Counters live in this process only: with N server processes a key gets up to N * limit
+    # attempts, so run one process (threads) or add a limit at the proxy in front of them.
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        self._events = {}
+
+    def _prune(self, key, now):
+        events = self._events.get(key)
+        if events is None:
+            return None
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        if not events:
+            del self._events[key]
+            return None
+        return events
+
+    def retry_after(self, key):
+        # Seconds until `key` may try again; 0 when it is under the limit
+        now = time.monotonic()
+        with self._lock:
+            events = self._prune(key, now)
+            if events is None or len(events) < self.limit:
+                return 0
+            return int(events[0] + self.window - now) + 1
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(key, now)
+            self._events.setdefault(key, deque()).append(now)
+            if len(self._events) > 10000:
+                # Drop idle keys so a spray of distinct keys cannot grow the table forever
+                for k in [k for k, ev in self._events.items() if ev[-1] <= now - self.window]:
+                    del self._events[k]
+
+    def reset(self, key):
+        with self._lock:
+            self._events.pop(key, None)
+
+
+ACCOUNT_FAILURES = AttemptThrottle(LOGIN_MAX_FAILURES, LOGIN_FAILURE_WINDOW)
+IP_ATTEMPTS = AttemptThrottle(IP_MAX_ATTEMPTS, IP_ATTEMPT_WINDOW)
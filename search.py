@@ -0,0 +1,124 @@
+import bisect
+import heapq
+import re
+import threading
+from catalog import FoodCatalog
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def allergen_list(food):
+    # sp_list_foods_with_allergens returns a ', '-joined label string; 'None' means no allergens
+    raw = food.get("allergens") or ""
+    return [a for a in (x.strip() for x in raw.split(",")) if a and a.lower() != "none"]
+
+
+class FoodSearchIndex:
+    # Token/prefix index over food_items.name. Each distinct token maps to the set of food ids
+    # whose name contains it; a sorted token list turns "tokens starting with p" into a bisect
+    # range, so typeahead queries never scan the whole catalog.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._foods = {}
+        self._food_tokens = {}
+        self._postings = {}
+        self._tokens = []
+
+    def _add(self, food):
+        fid = food.get("foodid")
+        toks = tokenize(food.get("name"))
+        self._foods[fid] = food
+        self._food_tokens[fid] = toks
+        for t in set(toks):
+            ids = self._postings.get(t)
+            if ids is None:
+                ids = self._postings[t] = set()
+                bisect.insort(self._tokens, t)
+            ids.add(fid)
+
+    def _remove(self, fid):
+        self._foods.pop(fid, None)
+        for t in set(self._food_tokens.pop(fid, ())):
+            ids = self._postings.get(t)
+            if ids is None:
+                continue
+            ids.discard(fid)
+            if not ids:
+                del self._postings[t]
+                del self._tokens[bisect.bisect_left(self._tokens, t)]
+
+    def sync(self, version, foods):
+        # Apply only the difference against the catalog we last indexed: new foods are added,
+        # renamed ones re-tokenized, deleted ones dropped; unchanged names keep their postings.
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            seen = set()
+            for f in foods:
+                fid = f.get("foodid")
+                seen.add(fid)
+                current = self._foods.get(fid)
+                if current is None:
+                    self._add(f)
+                elif current.get("name") != f.get("name"):
+                    self._remove(fid)
+                    self._add(f)
+                else:
+                    self._foods[fid] = f
+            for fid in [fid for fid in self._foods if fid not in seen]:
+                self._remove(fid)
+            self._version = version
+
+    def _prefix_ids(self, prefix):
+        ids = set()
+        i = bisect.bisect_left(self._tokens, prefix)
+        while i < len(self._tokens) and self._tokens[i].startswith(prefix):
+            ids |= self._postings[self._tokens[i]]
+            i += 1
+        return ids
+
+    def search(self, query, k=10, skip=None):
+        # skip: food ids to leave out (e.g. foods with an excluded allergen)
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            # Every query term must prefix-match some token of the name
+            candidates = None
+            for t in sorted(set(terms), key=len, reverse=True):
+                ids = self._prefix_ids(t)
+                candidates = ids if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+            if skip:
+                candidates = candidates - skip
+            q = " ".join(terms)
+
+            def rank(fid):
+                name = " ".join(self._food_tokens[fid])
+                if name == q:
+                    tier = 0
+                elif name.startswith(q):
+                    tier = 1
+                elif all(t in self._food_tokens[fid] for t in terms):
+                    tier = 2
+                else:
+                    tier = 3
+                return (tier, len(name), name, fid)
+
+            return [self._foods[fid] for fid in heapq.nsmallest(k, candidates, key=rank)]
+
+
+FOOD_INDEX = FoodSearchIndex()
+
+
+def search_foods(query, k=10, skip=None):
+    FOOD_INDEX.sync(*FoodCatalog.request_snapshot())
+    return FOOD_INDEX.search(query, k, skip)
@@ -0,0 +1,202 @@
+import random
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+from db import DB
+import passwords
+
+# Deterministic synthetic data for load testing. Every user's rows come from a Random seeded
+# with (seed, user number), so the same arguments always produce the same rows whatever the
+# chunking. Rows go in as multi-row INSERTs on a DB.bulk_load() connection, with the per-row
+# triggers switched off; BulkLoad.finish then derives totals, counters and rollups.
+
+SCALES = {
+    "tiny": dict(users=50, foods=300, meal_items=10_000, med_logs=5_000, days=60),
+    "small": dict(users=2_000, foods=2_000, meal_items=300_000, med_logs=200_000, days=365),
+    "medium": dict(users=20_000, foods=10_000, meal_items=2_000_000, med_logs=2_000_000, days=730),
+    "large": dict(users=100_000, foods=20_000, meal_items=10_000_000, med_logs=10_000_000, days=1095),
+}
+EMAIL_DOMAIN = "bench.wefit"
+SEED_PASSWORD = "wefit-bench"
+ROWS_PER_INSERT = 5000
+USERS_PER_CHUNK = 200
+ITEMS_PER_MEAL = (1, 5)
+
+# name, calories, proteins, carbs, fats per 100 g, allergens
+_BASE_FOODS = [
+    ("Chicken Breast", 165, 31, 0, 3.6, ()), ("Salmon", 208, 20, 0, 13, ("fish",)),
+    ("Tuna", 132, 28, 0, 1, ("fish",)), ("Shrimp", 99, 24, 0.2, 0.3, ("shellfish",)),
+    ("Beef Steak", 271, 25, 0, 19, ()), ("Tofu", 76, 8, 1.9, 4.8, ("soy",)),
+    ("Egg", 155, 13, 1.1, 11, ("egg",)), ("Greek Yogurt", 59, 10, 3.6, 0.4, ("milk",)),
+    ("Cheddar", 403, 25, 1.3, 33, ("milk",)), ("Milk", 42, 3.4, 5, 1, ("milk",)),
+    ("White Rice", 130, 2.7, 28, 0.3, ()), ("Brown Rice", 111, 2.6, 23, 0.9, ()),
+    ("Oats", 389, 17, 66, 7, ("gluten",)), ("Whole Wheat Bread", 247, 13, 41, 3.4, ("gluten", "wheat")),
+    ("Pasta", 131, 5, 25, 1.1, ("gluten", "wheat")), ("Quinoa", 120, 4.4, 21, 1.9, ()),
+    ("Potato", 77, 2, 17, 0.1, ()), ("Sweet Potato", 86, 1.6, 20, 0.1, ()),
+    ("Broccoli", 34, 2.8, 7, 0.4, ()), ("Spinach", 23, 2.9, 3.6, 0.4, ()),
+    ("Apple", 52, 0.3, 14, 0.2, ()), ("Banana", 89, 1.1, 23, 0.3, ()),
+    ("Blueberries", 57, 0.7, 14, 0.3, ()), ("Avocado", 160, 2, 9, 15, ()),
+    ("Almonds", 579, 21, 22, 50, ("tree nuts",)), ("Peanut Butter", 588, 25, 20, 50, ("peanuts",)),
+    ("Lentils", 116, 9, 20, 0.4, ()), ("Chickpeas", 164, 8.9, 27, 2.6, ()),
+    ("Olive Oil", 884, 0, 0, 100, ()), ("Dark Chocolate", 546, 4.9, 61, 31, ("milk", "soy")),
+]
+_STYLES = ["Plain", "Grilled", "Baked", "Roasted", "Steamed", "Organic", "Spiced", "Smoked",
+           "Fresh", "Frozen", "Homemade", "Light"]
+_FIRST = ["Alex", "Sam", "Jordan", "Taylor", "Casey", "Riley", "Morgan", "Jamie", "Avery", "Quinn",
+          "Priya", "Wei", "Omar", "Sofia", "Lena", "Mateo", "Aisha", "Kenji", "Noah", "Zara"]
+_LAST = ["Smith", "Garcia", "Chen", "Patel", "Kim", "Nguyen", "Müller", "Rossi", "Silva", "Okafor",
+         "Cohen", "Ivanova", "Khan", "Lopez", "Brown", "Sato", "Dubois", "Novak", "Ali", "Jensen"]
+# mealtype, relative frequency, typical hour
+_MEALS = [("breakfast", 3, 8), ("lunch", 3, 13), ("dinner", 3, 19), ("snack", 2, 16)]
+# medname, dosage, frequency (all parse in adherence.parse_frequency)
+_MEDS = [("Metformin", "500mg", "twice daily"), ("Lisinopril", "10mg", "once daily"),
+         ("Atorvastatin", "20mg", "once daily at bedtime"), ("Vitamin D", "1000 IU", "daily"),
+         ("Ibuprofen", "200mg", "as needed"), ("Amoxicillin", "250mg", "every 8 hours"),
+         ("Omega-3", "1g", "twice a day"), ("Methotrexate", "7.5mg", "once weekly")]
+_SCHEDULES = ["Morning Routine", "Workouts", "Work", "Appointments", "Evening Routine"]
+_EVENTS = ["Run", "Yoga", "Gym", "Meditation", "Stand-up", "Doctor visit", "Meal prep", "Walk"]
+
+
+def scale_params(scale, **overrides):
+    params = dict(SCALES[scale])
+    params.update({k: v for k, v in overrides.items() if v is not None})
+    return params
+
+
+_ID_COLUMNS = {"user": "userid", "food_items": "foodid", "meal_log": "meallogid", "schedule": "scheduleid",
+               "medication": "medicationid"}
+
+
+def _placeholders(n, width):
+    row = "(" + ",".join(["%s"] * width) + ")"
+    return ",".join([row] * n)
+
+
+def _insert(tx, table, columns, rows, key=None):
+    # Multi-row INSERTs of at most ROWS_PER_INSERT rows. With `key` (columns identifying each
+    # new row, see Transaction.insert_rows) the generated ids are returned in row order.
+    out = []
+    for i in range(0, len(rows), ROWS_PER_INSERT):
+        part = rows[i:i + ROWS_PER_INSERT]
+        if key:
+            out.extend(tx.insert_rows(table, _ID_COLUMNS[table], columns, part, key))
+        else:
+            tx.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES " + _placeholders(len(part), len(columns)),
+                       [v for row in part for v in row])
+    return out
+
+
+def _foods(seed, count):
+    rng = random.Random(f"{seed}:foods")
+    foods = []
+    for n in range(count):
+        name, cal, pro, carb, fat, allergens = _BASE_FOODS[n % len(_BASE_FOODS)]
+        jitter = rng.uniform(0.8, 1.2)
+        foods.append(((f"{rng.choice(_STYLES)} {name} {n // len(_BASE_FOODS) + 1}", round(cal * jitter),
+                       round(pro * jitter, 2), round(carb * jitter, 2), round(fat * jitter, 2)), allergens))
+    return foods
+
+
+def _user(seed, number, params, food_ids, food_weights, categories, first_day, password_hash):
+    # All rows for one user: (user row, meals [(row, items)], schedules [(row, events)],
+    # medications [(row, logs)]); ids are filled in by the loader
+    rng = random.Random(f"{seed}:user:{number}")
+    days = params["days"]
+    user = (rng.choice(_FIRST), rng.choice(_LAST), f"u{number}.s{seed}@{EMAIL_DOMAIN}", password_hash)
+
+    mean_meals = params["meal_items"] / params["users"] / (sum(ITEMS_PER_MEAL) / 2)
+    meals = []
+    for _ in range(max(0, round(rng.gauss(mean_meals, mean_meals * 0.3)))):
+        mealtype, _, hour = rng.choices(_MEALS, weights=[m[1] for m in _MEALS])[0]
+        logtime = datetime.combine(first_day + timedelta(days=rng.randrange(days)), datetime.min.time()) \
+            + timedelta(hours=hour, minutes=rng.randrange(-60, 60))
+        picked = rng.choices(food_ids, cum_weights=food_weights, k=rng.randint(*ITEMS_PER_MEAL))
+        meals.append(((mealtype, logtime), [(f, rng.randrange(20, 400, 10)) for f in dict.fromkeys(picked)]))
+
+    schedules = []
+    for name in rng.sample(_SCHEDULES, rng.randint(1, 3)):
+        events = []
+        for _ in range(rng.randint(2, 8)):
+            start = datetime.combine(first_day + timedelta(days=rng.randrange(days)), datetime.min.time()) \
+                + timedelta(hours=rng.randint(6, 20), minutes=rng.choice((0, 15, 30, 45)))
+            recurrence = rng.choices(("none", "daily", "weekly", "monthly"), weights=(6, 1, 2, 1))[0]
+            events.append((rng.choice(categories) if categories else None, rng.choice(_EVENTS), start,
+                           start + timedelta(minutes=rng.choice((15, 30, 45, 60, 90))), None, recurrence,
+                           rng.choice((1, 1, 2)) if recurrence != "none" else 1, None))
+        schedules.append(((name,), events))
+
+    meds = []
+    mean_logs = params["med_logs"] / params["users"]
+    chosen = rng.sample(_MEDS, rng.randint(0, 3))
+    for medname, dosage, frequency in chosen:
+        share = mean_logs / len(chosen)
+        logs = []
+        for _ in range(max(0, round(rng.gauss(share, share * 0.3)))):
+            when = datetime.combine(first_day + timedelta(days=rng.randrange(days)), datetime.min.time()) \
+                + timedelta(hours=rng.randint(6, 22), minutes=rng.randrange(60))
+            logs.append((when, rng.random() < 0.1))
+        meds.append(((medname, dosage, frequency), logs))
+    return user, meals, schedules, meds
+
+
+def _load_users(tx, batch):
+    user_ids = _insert(tx, "user", ("firstname", "lastname", "emailid", "passwordhash"),
+                       [u for u, _, _, _ in batch], ("emailid",))
+    meals, schedules, meds = [], [], []
+    for uid, (_, m, s, d) in zip(user_ids, batch):
+        meals += [((uid,) + row + (uuid.uuid4().hex,), items) for row, items in m]
+        schedules += [((row[0], uid), events) for row, events in s]
+        meds += [((uid,) + row, logs) for row, logs in d]
+    meal_ids = _insert(tx, "meal_log", ("userid", "mealtype", "logtime", "idemkey"), [r for r, _ in meals],
+                       ("idemkey",))
+    items = [(mid, f, q) for mid, (_, its) in zip(meal_ids, meals) for f, q in its]
+    _insert(tx, "meal_items", ("meallogid", "foodid", "quantityingram"), items)
+    schedule_ids = _insert(tx, "schedule", ("schedulename", "userid"), [r for r, _ in schedules],
+                           ("userid", "schedulename"))
+    events = [(sid,) + e for sid, (_, evs) in zip(schedule_ids, schedules) for e in evs]
+    _insert(tx, "schedule_events", ("scheduleid", "categoryid", "eventtitle", "starttime", "endtime",
+                                    "description", "recurrence", "recurinterval", "recuruntil"), events)
+    med_ids = _insert(tx, "medication", ("userid", "medname", "dosage", "frequency"), [r for r, _ in meds],
+                      ("userid", "medname"))
+    logs = [(mid,) + log for mid, (_, ls) in zip(med_ids, meds) for log in ls]
+    _insert(tx, "medication_log", ("medicationid", "takentime", "isskipped"), logs)
+    return {"users": len(user_ids), "meals": len(meal_ids), "meal_items": len(items),
+            "schedules": len(schedule_ids), "events": len(events), "medications": len(med_ids),
+            "med_logs": len(logs)}
+
+
+def seed(params, seed=1, end=None, progress=None):
+    # Loads foods, then users with their meals, schedules and medications over the `days`
+    # days ending at `end`. Returns row counts and timings.
+    started = time.perf_counter()
+    end = end or date.today()
+    first_day = end - timedelta(days=params["days"] - 1)
+    counts = {"foods": 0, "users": 0, "meals": 0, "meal_items": 0, "schedules": 0, "events": 0,
+              "medications": 0, "med_logs": 0}
+    password_hash = passwords.hash_password(SEED_PASSWORD)
+    with DB.bulk_load() as tx:
+        foods = _foods(seed, params["foods"])
+        with tx.chunk():
+            food_ids = _insert(tx, "food_items", ("name", "calories", "proteins", "carbs", "fats"),
+                               [f for f, _ in foods], ("name",))
+            _insert(tx, "food_allergens", ("foodid", "allergenname"),
+                    [(fid, a) for fid, (_, allergens) in zip(food_ids, foods) for a in allergens])
+        counts["foods"] = len(food_ids)
+        # Zipf-like popularity: a few foods show up in most meals, like a real catalog
+        food_weights = list(accumulate(1 / (rank + 1) ** 0.8 for rank in range(len(food_ids))))
+        categories = [r["categoryid"] for r in tx.execute("SELECT categoryid FROM event_category")]
+        for first in range(0, params["users"], USERS_PER_CHUNK):
+            batch = [_user(seed, n, params, food_ids, food_weights, categories, first_day, password_hash)
+                     for n in range(first, min(first + USERS_PER_CHUNK, params["users"]))]
+            with tx.chunk():
+                for k, v in _load_users(tx, batch).items():
+                    counts[k] += v
+            if progress:
+                progress(counts)
+        load_seconds = time.perf_counter() - started
+        # Also bumps the catalog and user data versions, so running workers drop their caches
+        tx.finish(first_day, end)
+    return {"seed": seed, "from": first_day.isoformat(), "to": end.isoformat(), "counts": counts,
+            "load_seconds": round(load_seconds, 1),
+            "finish_seconds": round(time.perf_counter() - started - load_seconds, 1)}
@@ -0,0 +1,76 @@
+// Food picker for the meal forms: each .food-picker row has a search input and a
+// select[name="foodID"]. Options are fetched from /foods/search as the user types
+// instead of rendering the whole catalog into every row.
+(function(){
+  var DEBOUNCE_MS = 150;
+
+  function optionLabel(f) {
+    var label = f.name + ' (' + f.calories + ' kcal/100g)';
+    if (f.allergens && f.allergens.length) label += ' - ' + f.allergens.join(', ');
+    return label;
+  }
+
+  function fillSelect(select, foods) {
+    var current = select.value;
+    var currentOpt = current ? select.options[select.selectedIndex] : null;
+    select.innerHTML = '';
+    if (!foods.length) {
+      var empty = document.createElement('option');
+      empty.value = '';
+      empty.textContent = 'No matching foods';
+      empty.disabled = true;
+      empty.selected = true;
+      select.appendChild(empty);
+    }
+    var keptCurrent = false;
+    for (var i = 0; i < foods.length; i++) {
+      var opt = document.createElement('option');
+      opt.value = foods[i].foodid;
+      opt.textContent = optionLabel(foods[i]);
+      if (String(foods[i].foodid) === current) { opt.selected = true; keptCurrent = true; }
+      select.appendChild(opt);
+    }
+    // Keep an existing choice selectable even if it is not among the new matches
+    if (currentOpt && !keptCurrent) select.insertBefore(currentOpt, select.firstChild);
+    select.dispatchEvent(new Event('change', { bubbles: true }));
+  }
+
+  function excludedAllergens() {
+    var boxes = document.querySelectorAll('.allergen-exclude:checked');
+    var names = [];
+    for (var i = 0; i < boxes.length; i++) names.push(boxes[i].value);
+    return names;
+  }
+
+  function search(input) {
+    var row = input.closest('.food-picker');
+    var select = row && row.querySelector('select[name="foodID"]');
+    var q = input.value.trim();
+    if (!select || !q) return;
+    var seq = (input._seq || 0) + 1;
+    input._seq = seq;
+    var exclude = excludedAllergens();
+    var url = '/foods/search?k=20&q=' + encodeURIComponent(q);
+    if (exclude.length) url += '&exclude=' + encodeURIComponent(exclude.join(','));
+    fetch(url, { credentials: 'same-origin' })
+      .then(function(r){ return r.ok ? r.json() : []; })
+      .then(function(foods){
+        // Ignore responses that arrive after a newer keystroke
+        if (input._seq === seq) fillSelect(select, foods);
+      });
+  }
+
+  document.addEventListener('input', function(e){
+    var input = e.target;
+    if (!input.classList || !input.classList.contains('food-query')) return;
+    clearTimeout(input._timer);
+    input._timer = setTimeout(function(){ search(input); }, DEBOUNCE_MS);
+  });
+
+  // Re-run every picker's search when the allergen filter changes
+  document.addEventListener('change', function(e){
+    if (!e.target.classList || !e.target.classList.contains('allergen-exclude')) return;
+    var inputs = document.querySelectorAll('.food-query');
+    for (var i = 0; i < inputs.length; i++) search(inputs[i]);
+  });
+})();